@@ -1,149 +1,306 @@
-import requests
-import feedparser
-import httpx
 import os
+import asyncio
+from contextlib import aclosing
 import xml.etree.ElementTree as ET
+from http_client import get_client
+from resilience import acquire, observe_response
+from cache import get_many_from_cache, set_many_to_cache
 
-ARXIV_API_URL = "http://export.arxiv.org/api/query"
-PUBMED_ESEARCH_URL = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esearch.fcgi"
-PUBMED_EFETCH_URL = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi"
-SEMANTIC_SCHOLAR_API_URL = "https://api.semanticscholar.org/graph/v1/paper/search"
+ARXIV_BASE_URL = os.getenv("ARXIV_BASE_URL", "http://export.arxiv.org").rstrip("/")
+PUBMED_BASE_URL = os.getenv("PUBMED_BASE_URL", "https://eutils.ncbi.nlm.nih.gov").rstrip("/")
+SEMANTIC_SCHOLAR_BASE_URL = os.getenv("SEMANTIC_SCHOLAR_BASE_URL", "https://api.semanticscholar.org").rstrip("/")
+ARXIV_API_URL = f"{ARXIV_BASE_URL}/api/query"
+PUBMED_ESEARCH_URL = f"{PUBMED_BASE_URL}/entrez/eutils/esearch.fcgi"
+PUBMED_EFETCH_URL = f"{PUBMED_BASE_URL}/entrez/eutils/efetch.fcgi"
+SEMANTIC_SCHOLAR_API_URL = f"{SEMANTIC_SCHOLAR_BASE_URL}/graph/v1/paper/search"
+SEMANTIC_SCHOLAR_BATCH_URL = f"{SEMANTIC_SCHOLAR_BASE_URL}/graph/v1/paper/batch"
+S2_PAPER_FIELDS = "title,authors,year,abstract,url,externalIds"
+S2_BATCH_SIZE = int(os.getenv("S2_BATCH_SIZE", "500"))
+S2_DETAILS_TTL = int(os.getenv("S2_DETAILS_TTL", str(7 * 24 * 3600)))
+# arXiv serves up to 2000 results per request and allows one request every
+# three seconds, so large pages keep big searches to a single rate-limit slot.
+ARXIV_PAGE_SIZE = min(2000, int(os.getenv("ARXIV_PAGE_SIZE", "1000")))
+PUBMED_PAGE_SIZE = int(os.getenv("PUBMED_PAGE_SIZE", "200"))
+STREAM_QUEUE_CHUNKS = int(os.getenv("STREAM_QUEUE_CHUNKS", "16"))
 
-def search_arxiv(query: str, max_results: int):
-    params = {
-        "search_query": query,
-        "start": 0,
-        "max_results": max_results
+async def _get(url: str, **kwargs):
+    await acquire(url)
+    response = await get_client(url).get(url, **kwargs)
+    observe_response(url, response)
+    return response
+
+def _ncbi_params(params: dict) -> dict:
+    api_key = os.getenv("NCBI_API_KEY")
+    if api_key:
+        params["api_key"] = api_key
+    return params
+
+_ATOM = "{http://www.w3.org/2005/Atom}"
+_ARXIV = "{http://arxiv.org/schemas/atom}"
+_OPENSEARCH = "{http://a9.com/-/spec/opensearch/1.1/}"
+_PAGE_END = object()
+
+async def _produce_pages(url: str, pages, queue: asyncio.Queue, error_prefix: str):
+    try:
+        async for params in pages:
+            await acquire(url)
+            async with get_client(url).stream("GET", url, params=params) as response:
+                observe_response(url, response)
+                if response.status_code != 200:
+                    raise Exception(f"{error_prefix} error: {response.status_code}")
+                async for chunk in response.aiter_bytes():
+                    await queue.put(chunk)
+            await queue.put(_PAGE_END)
+        await queue.put(None)
+    except Exception as e:
+        await queue.put(e)
+
+# Incremental parser for a stream of response pages. feed() takes the next
+# chunk of bytes and yields every record_tag element it completed, clearing
+# each once the caller has moved on; other elements go to on_element.
+class _RecordParser:
+    def __init__(self, record_tag: str, on_element=None):
+        self.record_tag = record_tag
+        self.on_element = on_element
+        self._parser = ET.XMLPullParser(events=("end",))
+
+    def feed(self, chunk: bytes):
+        self._parser.feed(chunk)
+        for _, elem in self._parser.read_events():
+            if elem.tag == self.record_tag:
+                yield elem
+                elem.clear()
+            elif self.on_element is not None:
+                self.on_element(elem)
+
+    def page_end(self):
+        self._parser.close()
+        self._parser = ET.XMLPullParser(events=("end",))
+        if self.on_element is not None:
+            self.on_element(None)
+
+# Fetches pages on a background task while the caller parses, with at most
+# STREAM_QUEUE_CHUNKS response chunks buffered in between. Each page is fed
+# to an incremental parser and every record_tag element is yielded as soon
+# as it is complete, then cleared. Callers that may stop early should close
+# the generator (contextlib.aclosing) so the producer and its open response
+# are released straight away.
+async def _iter_xml_records(url: str, pages, record_tag: str, error_prefix: str, on_element=None):
+    queue = asyncio.Queue(maxsize=STREAM_QUEUE_CHUNKS)
+    producer = asyncio.create_task(_produce_pages(url, pages, queue, error_prefix))
+    records = _RecordParser(record_tag, on_element)
+    try:
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            if isinstance(item, Exception):
+                raise item
+            if item is _PAGE_END:
+                records.page_end()
+                continue
+            for elem in records.feed(item):
+                yield elem
+    finally:
+        producer.cancel()
+        await asyncio.gather(producer, return_exceptions=True)
+
+def _arxiv_entry(entry) -> dict:
+    url = ""
+    for link in entry.iterfind(f"{_ATOM}link"):
+        if link.get("rel", "alternate") == "alternate":
+            url = link.get("href", "")
+            break
+    return {
+        "title": (entry.findtext(f"{_ATOM}title") or "").strip(),
+        "authors": [author.findtext(f"{_ATOM}name") or "" for author in entry.iterfind(f"{_ATOM}author")],
+        "publication_date": entry.findtext(f"{_ATOM}published") or "",
+        "source": "arXiv",
+        "abstract": (entry.findtext(f"{_ATOM}summary") or "").strip(),
+        "url": url,
+        "doi": entry.findtext(f"{_ARXIV}doi") or "",
+        "arxiv_id": (entry.findtext(f"{_ATOM}id") or "").rsplit("/abs/", 1)[-1]
     }
-    response = requests.get(ARXIV_API_URL, params=params)
-    if response.status_code != 200:
-        raise Exception(f"arXiv API error: {response.status_code}")
-    feed = feedparser.parse(response.text)
-    results = []
-    for entry in feed.entries:
-        title = entry.get("title", "").strip()
-        authors = [author.get("name", "") for author in entry.get("authors", [])]
-        publication_date = entry.get("published", "")
-        abstract = entry.get("summary", "").strip()
-        url = entry.get("link", "")
-        results.append({
-            "title": title,
-            "authors": authors,
-            "publication_date": publication_date,
-            "source": "arXiv",
-            "abstract": abstract,
-            "url": url
-        })
-    return results
-
-def search_pubmed(query: str, max_results: int):
+
+async def iter_arxiv(query: str, max_results: int, page_size: int = ARXIV_PAGE_SIZE):
+    state = {"total": None}
+    total_known = asyncio.Event()
+
+    def on_element(elem):
+        # totalResults arrives at the top of the first page; a page end is
+        # the fallback signal in case the feed omits it.
+        if elem is None or elem.tag == f"{_OPENSEARCH}totalResults":
+            if elem is not None and (elem.text or "").strip().isdigit():
+                state["total"] = int(elem.text)
+            total_known.set()
+
+    async def pages():
+        start = 0
+        while start < max_results:
+            yield {
+                "search_query": query,
+                "start": start,
+                "max_results": min(page_size, max_results - start)
+            }
+            start += page_size
+            await total_known.wait()
+            if state["total"] is not None and start >= state["total"]:
+                return
+
+    count = 0
+    async with aclosing(_iter_xml_records(ARXIV_API_URL, pages(), f"{_ATOM}entry", "arXiv API", on_element)) as entries:
+        async for entry in entries:
+            yield _arxiv_entry(entry)
+            count += 1
+            if count >= max_results:
+                return
+
+async def search_arxiv(query: str, max_results: int):
+    async with aclosing(iter_arxiv(query, max_results)) as papers:
+        return [paper async for paper in papers]
+
+def _pubmed_article(article) -> dict:
+    pmid = article.findtext(".//PMID") or ""
+    authors = []
+    for author in article.iterfind(".//AuthorList/Author"):
+        last = author.findtext("LastName")
+        fore = author.findtext("ForeName")
+        if last is not None and fore is not None:
+            authors.append(f"{fore} {last}")
+        elif last is not None:
+            authors.append(last)
+    pub_date = article.find(".//PubDate")
+    date_parts = []
+    if pub_date is not None:
+        date_parts = [pub_date.findtext("Year"), pub_date.findtext("Month"), pub_date.findtext("Day")]
+    return {
+        "title": article.findtext(".//ArticleTitle") or "",
+        "authors": authors,
+        "publication_date": "-".join(filter(None, date_parts)),
+        "source": "PubMed",
+        "abstract": article.findtext(".//Abstract/AbstractText") or "",
+        "url": f"https://pubmed.ncbi.nlm.nih.gov/{pmid}/" if pmid else "",
+        "doi": article.findtext(".//ArticleIdList/ArticleId[@IdType='doi']") or "",
+        "pmid": pmid
+    }
+
+async def iter_pubmed(query: str, max_results: int, page_size: int = PUBMED_PAGE_SIZE):
     esearch_params = {
         "db": "pubmed",
         "term": query,
-        "retmax": max_results,
+        "retmax": 0,
+        "usehistory": "y",
         "retmode": "json"
     }
-    esearch_resp = requests.get(PUBMED_ESEARCH_URL, params=esearch_params)
+    esearch_resp = await _get(PUBMED_ESEARCH_URL, params=_ncbi_params(esearch_params))
     if esearch_resp.status_code != 200:
         raise Exception(f"PubMed esearch error: {esearch_resp.status_code}")
-    id_list = esearch_resp.json().get("esearchresult", {}).get("idlist", [])
-    if not id_list:
-        return []
-    efetch_params = {
-        "db": "pubmed",
-        "id": ",".join(id_list),
-        "retmode": "xml"
+    result = esearch_resp.json().get("esearchresult", {})
+    total = min(int(result.get("count", 0) or 0), max_results)
+    if not total:
+        return
+
+    async def pages():
+        for retstart in range(0, total, page_size):
+            yield _ncbi_params({
+                "db": "pubmed",
+                "query_key": result.get("querykey"),
+                "WebEnv": result.get("webenv"),
+                "retstart": retstart,
+                "retmax": min(page_size, total - retstart),
+                "retmode": "xml"
+            })
+
+    async with aclosing(_iter_xml_records(PUBMED_EFETCH_URL, pages(), "PubmedArticle", "PubMed efetch")) as articles:
+        async for article in articles:
+            yield _pubmed_article(article)
+
+async def search_pubmed(query: str, max_results: int):
+    async with aclosing(iter_pubmed(query, max_results)) as papers:
+        return [paper async for paper in papers]
+
+def _s2_headers() -> dict:
+    api_key = os.getenv("SEMANTIC_SCHOLAR_API_KEY")
+    return {"x-api-key": api_key} if api_key else {}
+
+def _s2_paper(paper: dict) -> dict:
+    external_ids = paper.get("externalIds") or {}
+    paper_id = paper.get("paperId") or ""
+    year = paper.get("year")
+    return {
+        "title": paper.get("title") or "",
+        "authors": [a.get("name", "") for a in paper.get("authors") or []],
+        "publication_date": str(year) if year else "",
+        "source": "Semantic Scholar",
+        "abstract": paper.get("abstract") or "",
+        "url": paper.get("url") or (f"https://www.semanticscholar.org/paper/{paper_id}" if paper_id else ""),
+        "doi": external_ids.get("DOI") or "",
+        "arxiv_id": external_ids.get("ArXiv") or "",
+        "pmid": str(external_ids.get("PubMed") or ""),
+        "s2_id": paper_id
     }
-    efetch_resp = requests.get(PUBMED_EFETCH_URL, params=efetch_params)
-    if efetch_resp.status_code != 200:
-        raise Exception(f"PubMed efetch error: {efetch_resp.status_code}")
-    root = ET.fromstring(efetch_resp.text)
-    results = []
-    for article in root.findall('.//PubmedArticle'):
-        pmid_elem = article.find('.//PMID')
-        pmid = pmid_elem.text if pmid_elem is not None else ""
-        title_elem = article.find('.//ArticleTitle')
-        title = title_elem.text if title_elem is not None else ""
-        abstract_elem = article.find('.//Abstract/AbstractText')
-        abstract = abstract_elem.text if abstract_elem is not None else ""
-        authors = []
-        for author in article.findall('.//AuthorList/Author'):
-            last = author.find('LastName')
-            fore = author.find('ForeName')
-            if last is not None and fore is not None:
-                authors.append(f"{fore.text} {last.text}")
-            elif last is not None:
-                authors.append(last.text)
-        pub_date_elem = article.find('.//PubDate')
-        year = pub_date_elem.find('Year').text if pub_date_elem is not None and pub_date_elem.find('Year') is not None else ""
-        month = pub_date_elem.find('Month').text if pub_date_elem is not None and pub_date_elem.find('Month') is not None else ""
-        day = pub_date_elem.find('Day').text if pub_date_elem is not None and pub_date_elem.find('Day') is not None else ""
-        publication_date = "-".join(filter(None, [year, month, day]))
-        url = f"https://pubmed.ncbi.nlm.nih.gov/{pmid}/" if pmid else ""
-        results.append({
-            "title": title,
-            "authors": authors,
-            "publication_date": publication_date,
-            "source": "PubMed",
-            "abstract": abstract,
-            "url": url
-        })
-    return results
 
 async def search_semantic_scholar(query: str, max_results: int):
     params = {
         "query": query,
-        "fields": "title,authors,year,abstract,url",
+        "fields": S2_PAPER_FIELDS,
         "limit": max_results
     }
-    api_key = os.getenv("SEMANTIC_SCHOLAR_API_KEY")
-    headers = {}
-    if api_key:
-        headers["x-api-key"] = api_key
-    async with httpx.AsyncClient() as client:
-        response = await client.get(SEMANTIC_SCHOLAR_API_URL, params=params, headers=headers)
-        if response.status_code != 200:
-            raise Exception(f"Semantic Scholar API error: {response.status_code}")
-        data = response.json()
-        results = []
-        for paper in data.get("data", []):
-            title = paper.get("title", "")
-            authors = [a.get("name", "") for a in paper.get("authors", [])]
-            publication_date = str(paper.get("year", ""))
-            abstract = paper.get("abstract", "")
-            url = paper.get("url", "")
-            results.append({
-                "title": title,
-                "authors": authors,
-                "publication_date": publication_date,
-                "source": "Semantic Scholar",
-                "abstract": abstract,
-                "url": url
-            })
-        return results
-
-def get_paper_details_semantic_scholar(paper_id: str, fields: str = 'title,authors,abstract'):
-    import os
-    import requests
-    base_url = f"https://api.semanticscholar.org/graph/v1/paper/{paper_id}"
-    params = {"fields": fields}
-    api_key = os.getenv("SEMANTIC_SCHOLAR_API_KEY")
-    headers = {}
-    if api_key:
-        headers["x-api-key"] = api_key
-    response = requests.get(base_url, params=params, headers=headers)
+    response = await _get(SEMANTIC_SCHOLAR_API_URL, params=params, headers=_s2_headers())
     if response.status_code != 200:
-        raise Exception(f"Semantic Scholar paper details error: {response.status_code}")
+        raise Exception(f"Semantic Scholar API error: {response.status_code}")
     data = response.json()
-    title = data.get("title", "")
-    authors = [a.get("name", "") for a in data.get("authors", [])]
-    abstract = data.get("abstract", "")
-    url = data.get("url", f"https://www.semanticscholar.org/paper/{paper_id}")
-    return {
-        "title": title,
-        "authors": authors,
-        "publication_date": "",
-        "source": "Semantic Scholar",
-        "abstract": abstract,
-        "url": url
-    } 
\ No newline at end of file
+    return [_s2_paper(paper) for paper in data.get("data", [])]
+
+# Our paper IDs ("doi:...", "arxiv:...", "pmid:...", "s2:...") map onto the
+# prefixed ID forms the Semantic Scholar API accepts; other IDs pass through.
+_S2_ID_PREFIXES = {"doi:": "DOI:", "arxiv:": "ARXIV:", "pmid:": "PMID:", "s2:": ""}
+
+def s2_lookup_id(paper_id: str) -> str:
+    for prefix, s2_prefix in _S2_ID_PREFIXES.items():
+        if paper_id.startswith(prefix):
+            return s2_prefix + paper_id[len(prefix):]
+    return paper_id
+
+async def _fetch_s2_batch(ids: list[str], fields: str) -> list:
+    await acquire(SEMANTIC_SCHOLAR_BATCH_URL)
+    response = await get_client(SEMANTIC_SCHOLAR_BATCH_URL).post(
+        SEMANTIC_SCHOLAR_BATCH_URL,
+        params={"fields": fields},
+        json={"ids": [s2_lookup_id(pid) for pid in ids]},
+        headers=_s2_headers()
+    )
+    observe_response(SEMANTIC_SCHOLAR_BATCH_URL, response)
+    if response.status_code != 200:
+        raise Exception(f"Semantic Scholar paper batch error: {response.status_code}")
+    return response.json()
+
+async def get_papers_details_semantic_scholar(paper_ids: list[str], fields: str = S2_PAPER_FIELDS) -> dict:
+    paper_ids = list(dict.fromkeys(pid for pid in paper_ids if pid))
+    keys = [f"s2paper:{fields}:{pid}" for pid in paper_ids]
+    cached = await get_many_from_cache(keys)
+    details = {pid: value for pid, value in zip(paper_ids, cached) if value is not None}
+    missing = [pid for pid, value in zip(paper_ids, cached) if value is None]
+    chunks = [missing[i:i + S2_BATCH_SIZE] for i in range(0, len(missing), S2_BATCH_SIZE)]
+    responses = await asyncio.gather(*(_fetch_s2_batch(chunk, fields) for chunk in chunks))
+    fetched = {}
+    for chunk, papers in zip(chunks, responses):
+        # The batch endpoint answers positionally, with null for unknown IDs.
+        for pid, paper in zip(chunk, papers):
+            if paper:
+                fetched[pid] = _s2_paper(paper)
+    await set_many_to_cache({f"s2paper:{fields}:{pid}": paper for pid, paper in fetched.items()}, S2_DETAILS_TTL)
+    details.update(fetched)
+    return {pid: details.get(pid) for pid in paper_ids}
+
+async def get_paper_details_semantic_scholar(paper_id: str, fields: str = S2_PAPER_FIELDS):
+    details = (await get_papers_details_semantic_scholar([paper_id], fields)).get(paper_id)
+    if details is None:
+        raise Exception(f"Semantic Scholar paper not found: {paper_id}")
+    return details
+
+PROVIDERS = {
+    "arXiv": search_arxiv,
+    "PubMed": search_pubmed,
+    "Semantic Scholar": search_semantic_scholar
+}
@@ -0,0 +1,99 @@
+import os
+import sys
+import time
+import argparse
+import subprocess
+import xml.etree.ElementTree as ET
+from benchmarks.stubs import s2_search, pubmed_efetch
+from benchmarks.report import write_json
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def _texts(count: int) -> list[str]:
+    texts = [p["abstract"] for p in s2_search("equivalence", 0, count, count)["data"] if p["abstract"]]
+    root = ET.fromstring(pubmed_efetch("equivalence", 0, count))
+    texts += [a.text for a in root.iterfind(".//Abstract/AbstractText") if a.text]
+    return texts[:count]
+
+def _lcs(a: list[str], b: list[str]) -> int:
+    row = [0] * (len(b) + 1)
+    for x in a:
+        prev = 0
+        for j, y in enumerate(b, 1):
+            prev, row[j] = row[j], prev + 1 if x == y else max(row[j], row[j - 1])
+    return row[-1]
+
+def rouge_l(reference: str, candidate: str) -> float:
+    ref, cand = reference.lower().split(), candidate.lower().split()
+    if not ref or not cand:
+        return float(ref == cand)
+    lcs = _lcs(ref, cand)
+    if not lcs:
+        return 0.0
+    precision, recall = lcs / len(cand), lcs / len(ref)
+    return 2 * precision * recall / (precision + recall)
+
+def measure(backend: str, texts: list[str], max_length: int, min_length: int) -> tuple[dict, list[str]]:
+    from summarizer import load_backend, SUMMARY_MODEL
+    started = time.perf_counter()
+    summarizer = load_backend(backend, SUMMARY_MODEL)
+    load_seconds = time.perf_counter() - started
+    summarizer(texts[0], max_length=max_length, min_length=min_length, do_sample=False, truncation=True)
+    outputs = []
+    wall = cpu = 0.0
+    for text in texts:
+        wall_started, cpu_started = time.perf_counter(), time.process_time()
+        result = summarizer(text, max_length=max_length, min_length=min_length, do_sample=False, truncation=True)
+        wall += time.perf_counter() - wall_started
+        cpu += time.process_time() - cpu_started
+        outputs.append(result[0]["summary_text"])
+    return {
+        "load_seconds": round(load_seconds, 3),
+        "wall_ms_per_summary": round(wall * 1000 / len(texts), 2),
+        "cpu_ms_per_summary": round(cpu * 1000 / len(texts), 2)
+    }, outputs
+
+def import_seconds() -> float:
+    # Cold start as the server sees it: a fresh interpreter importing the app.
+    started = time.perf_counter()
+    subprocess.run([sys.executable, "-c", "import mcp_server"], cwd=REPO_ROOT, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return round(time.perf_counter() - started, 3)
+
+def main():
+    parser = argparse.ArgumentParser(description="Check summarizer backends against the reference pipeline and time them")
+    parser.add_argument("--backends", default="quantized", help="Comma-separated backends to compare with 'pipeline'")
+    parser.add_argument("--texts", type=int, default=12)
+    parser.add_argument("--max-length", type=int, default=50)
+    parser.add_argument("--min-length", type=int, default=25)
+    parser.add_argument("--min-rouge", type=float, default=0.8, help="Fail if a backend's mean ROUGE-L against the reference is lower")
+    parser.add_argument("--json", help="Write results to this file")
+    args = parser.parse_args()
+
+    texts = _texts(args.texts)
+    report = {"import_seconds": import_seconds(), "backends": {}}
+    reference_stats, reference = measure("pipeline", texts, args.max_length, args.min_length)
+    report["backends"]["pipeline"] = reference_stats
+    print(f"import mcp_server: {report['import_seconds']}s")
+    print(f"pipeline: {reference_stats}")
+    failed = []
+    for backend in [b.strip() for b in args.backends.split(",") if b.strip() and b.strip() != "pipeline"]:
+        stats, outputs = measure(backend, texts, args.max_length, args.min_length)
+        scores = [rouge_l(ref, out) for ref, out in zip(reference, outputs)]
+        stats["exact_match"] = round(sum(ref == out for ref, out in zip(reference, outputs)) / len(texts), 3)
+        stats["mean_rouge_l"] = round(sum(scores) / len(scores), 3)
+        stats["min_rouge_l"] = round(min(scores), 3)
+        stats["cpu_speedup"] = round(reference_stats["cpu_ms_per_summary"] / max(stats["cpu_ms_per_summary"], 1e-9), 2)
+        report["backends"][backend] = stats
+        print(f"{backend}: {stats}")
+        if stats["mean_rouge_l"] < args.min_rouge:
+            failed.append(f"{backend}: mean ROUGE-L {stats['mean_rouge_l']} < {args.min_rouge}")
+    if args.json:
+        write_json(args.json, report)
+    for failure in failed:
+        print(f"NOT EQUIVALENT {failure}", file=sys.stderr)
+    if failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+import sys
+import time
+import json
+import uuid
+import asyncio
+import argparse
+from benchmarks.stubs import arxiv_feed, pubmed_efetch, s2_search
+from benchmarks.report import summarize_latencies, print_table, write_json, compare
+
+def _timed(fn, iterations: int) -> dict:
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(iterations):
+        begin = time.perf_counter()
+        fn()
+        latencies.append((time.perf_counter() - begin) * 1000)
+    return summarize_latencies(latencies, time.perf_counter() - started)
+
+# Parsers are driven the way the providers drive them: response bytes are fed
+# to the providers' own incremental parser in network-sized chunks and each
+# record is handed to the field extractor as soon as it is complete.
+def _pull_parse(payload: bytes, record_tag: str, extract, chunk_size: int = 16384) -> list[dict]:
+    from academic_search import _RecordParser
+    parser = _RecordParser(record_tag)
+    records = []
+    for i in range(0, len(payload), chunk_size):
+        records.extend(extract(elem) for elem in parser.feed(payload[i:i + chunk_size]))
+    parser.page_end()
+    return records
+
+def parser_benchmarks(records: int, iterations: int) -> dict:
+    from academic_search import _arxiv_entry, _pubmed_article, _s2_paper, _ATOM
+    atom = arxiv_feed("micro", 0, records, records)
+    efetch = pubmed_efetch("micro", 0, records)
+    s2 = json.dumps(s2_search("micro", 0, records, records)).encode("utf-8")
+    return {
+        f"parse_arxiv[{records}]": _timed(lambda: _pull_parse(atom, f"{_ATOM}entry", _arxiv_entry), iterations),
+        f"parse_pubmed[{records}]": _timed(lambda: _pull_parse(efetch, "PubmedArticle", _pubmed_article), iterations),
+        f"parse_s2[{records}]": _timed(lambda: [_s2_paper(p) for p in json.loads(s2)["data"]], iterations)
+    }
+
+def codec_benchmarks(records: int, iterations: int) -> dict:
+    from cache import CACHE_CODECS, CACHE_COMPRESSORS, encode_value, decode_value
+    from academic_search import _s2_paper
+    papers = [_s2_paper(p) for p in s2_search("micro", 0, records, records)["data"]]
+    results = {}
+    for codec in CACHE_CODECS:
+        for compression in CACHE_COMPRESSORS:
+            encoded = encode_value(papers, codec, compression)
+            row = _timed(lambda: decode_value(encode_value(papers, codec, compression)), iterations)
+            row["bytes"] = len(encoded)
+            results[f"cache_codec[{codec}+{compression}]"] = row
+    return results
+
+def citation_benchmarks(records: int, iterations: int) -> dict:
+    from citations import STYLES, format_bibliography
+    from academic_search import _s2_paper
+    papers = [_s2_paper(p) for p in s2_search("micro", 0, records, records)["data"]]
+    return {
+        f"bibliography[{style}]": _timed(lambda: format_bibliography(papers, style), iterations)
+        for style in STYLES
+    }
+
+async def _summarize_benchmark(texts: list[str], concurrency: int) -> dict:
+    from summarizer import summarize_text
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(text: str):
+        async with semaphore:
+            begin = time.perf_counter()
+            await summarize_text(text)
+            latencies.append((time.perf_counter() - begin) * 1000)
+
+    # The first call loads the model; it is not part of the measurement.
+    await summarize_text(texts[0])
+    latencies.clear()
+    started = time.perf_counter()
+    await asyncio.gather(*(one(text) for text in texts[1:]))
+    return summarize_latencies(latencies, time.perf_counter() - started)
+
+def summarize_benchmarks(iterations: int, concurrency: int) -> dict:
+    # Every text is distinct so each call misses the summary cache.
+    run_id = uuid.uuid4().hex[:8]
+    texts = [paper["abstract"] for paper in s2_search(f"micro {run_id}", 0, iterations + 1, iterations + 1)["data"] if paper["abstract"]]
+    return {f"summarize_text[c={concurrency}]": asyncio.run(_summarize_benchmark(texts, concurrency))}
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for the response parsers, cache codecs, citation formatting and summarize_text")
+    parser.add_argument("--records", type=int, default=200, help="Records per parsed response")
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--summarize-iterations", type=int, default=16)
+    parser.add_argument("--concurrency", type=int, default=4, help="Concurrent summarize_text calls")
+    parser.add_argument("--skip-summarize", action="store_true", help="Only run the parser, codec and citation benchmarks")
+    parser.add_argument("--json", help="Write results to this file")
+    parser.add_argument("--baseline", help="Fail if results regress against this earlier --json output")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    results = parser_benchmarks(args.records, args.iterations)
+    results.update(codec_benchmarks(args.records, args.iterations))
+    results.update(citation_benchmarks(args.records, args.iterations))
+    if not args.skip_summarize:
+        results.update(summarize_benchmarks(args.summarize_iterations, args.concurrency))
+    print_table(results)
+    if args.json:
+        write_json(args.json, {"benchmarks": results})
+    if args.baseline:
+        regressions = compare(results, args.baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+import json
+import math
+
+def percentile(values: list[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100
+    low, high = math.floor(rank), math.ceil(rank)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+def summarize_latencies(latencies_ms: list[float], elapsed: float, errors: int = 0) -> dict:
+    return {
+        "requests": len(latencies_ms) + errors,
+        "errors": errors,
+        "throughput_rps": round(len(latencies_ms) / elapsed, 2) if elapsed > 0 else 0.0,
+        "p50_ms": round(percentile(latencies_ms, 50), 2),
+        "p95_ms": round(percentile(latencies_ms, 95), 2),
+        "p99_ms": round(percentile(latencies_ms, 99), 2)
+    }
+
+def print_table(results: dict):
+    columns = ("requests", "errors", "partial", "throughput_rps", "p50_ms", "p95_ms", "p99_ms", "bytes")
+    width = max([len(name) for name in results] + [10])
+    print(f"{'benchmark':<{width}}  " + "  ".join(f"{c:>14}" for c in columns))
+    for name, row in results.items():
+        print(f"{name:<{width}}  " + "  ".join(f"{row.get(c, ''):>14}" for c in columns))
+
+def write_json(path: str, data: dict):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+
+# A benchmark regresses when its p95 grows or its throughput drops by more
+# than the tolerance relative to the baseline run; missing entries are skipped.
+def compare(results: dict, baseline_path: str, tolerance: float) -> list[str]:
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f).get("benchmarks", {})
+    regressions = []
+    for name, row in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        if base.get("p95_ms") and row["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {row['p95_ms']}ms vs baseline {base['p95_ms']}ms")
+        if base.get("throughput_rps") and row["throughput_rps"] < base["throughput_rps"] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {row['throughput_rps']}/s vs baseline {base['throughput_rps']}/s")
+        if row.get("errors") and not base.get("errors"):
+            regressions.append(f"{name}: {row['errors']} failed requests, baseline had none")
+    return regressions
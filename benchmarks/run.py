@@ -0,0 +1,206 @@
+import os
+import sys
+import time
+import shutil
+import socket
+import asyncio
+import uuid
+import argparse
+import tempfile
+import resource
+import subprocess
+import httpx
+from benchmarks.stubs import base_urls, s2_search
+from benchmarks.report import summarize_latencies, print_table, write_json, compare
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCENARIOS = ("search", "search_and_summarize", "synthesize", "qa")
+QUESTION = "How do attention-based models compare to recurrent baselines?"
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def _papers(variant: str, count: int) -> list[dict]:
+    data = s2_search(variant, 0, count, count)["data"]
+    return [
+        {"title": p["title"], "abstract": p["abstract"] or "", "authors": [a["name"] for a in p["authors"]]}
+        for p in data
+    ]
+
+# Queries and papers are tagged with a per-run ID so that a shared Redis
+# cache does not turn a second run into all cache hits.
+def payload(scenario: str, variant: int, args) -> tuple[str, dict]:
+    query = f"bench {args.run_id} {scenario} {variant}"
+    if scenario == "search":
+        return "/api/search", {"query": query, "max_results": args.max_results, "mode": args.mode}
+    if scenario == "search_and_summarize":
+        return "/api/search_and_summarize", {"query": query, "max_results": args.max_results}
+    if scenario == "synthesize":
+        return "/api/synthesize", {"papers": _papers(query, args.papers)}
+    return "/api/qa", {"papers": _papers(query, args.papers), "question": QUESTION}
+
+async def _wait_ready(url: str, process: subprocess.Popen, timeout: float):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"{url} exited with code {process.returncode} before becoming ready")
+            try:
+                if (await client.get(url)).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} was not ready within {timeout}s")
+
+async def drive(base_url: str, scenario: str, args) -> dict:
+    variants = args.query_pool or args.requests
+    requests = [payload(scenario, i % variants, args) for i in range(args.requests)]
+    warmup = [payload(scenario, variants + i, args) for i in range(args.warmup)]
+    latencies = []
+    errors = 0
+    partial = 0
+    semaphore = asyncio.Semaphore(args.concurrency)
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.request_timeout, limits=limits) as client:
+        async def one(path: str, body: dict):
+            nonlocal errors, partial
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    response = await client.post(path, json=body)
+                    data = response.json() if response.status_code == 200 else {"status": "error"}
+                except (httpx.HTTPError, ValueError):
+                    data = {"status": "error"}
+                if data.get("status") == "error":
+                    errors += 1
+                    return
+                latencies.append((time.perf_counter() - started) * 1000)
+                # Searches answered without one or more sources still succeed.
+                if data.get("errors"):
+                    partial += 1
+
+        for path, body in warmup:
+            await one(path, body)
+        latencies.clear()
+        errors = partial = 0
+        started = time.perf_counter()
+        await asyncio.gather(*(one(path, body) for path, body in requests))
+        elapsed = time.perf_counter() - started
+    return {**summarize_latencies(latencies, elapsed, errors), "partial": partial}
+
+def _peak_rss_mb(pid: int):
+    # VmHWM is the resident set high-water mark of the server process.
+    try:
+        with open(f"/proc/{pid}/status", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        return None
+    return None
+
+async def run(args) -> dict:
+    stub_port = args.stub_port or _free_port()
+    server_port = args.server_port or _free_port()
+    workdir = tempfile.mkdtemp(prefix="research-bench-")
+    env = dict(os.environ)
+    env.update(base_urls("127.0.0.1", stub_port))
+    env.update({
+        "PORT": str(server_port),
+        "SEARCH_MODE": args.mode,
+        "PAPER_STORE_PATH": os.path.join(workdir, "papers.db"),
+        "EMBEDDING_DIR": os.path.join(workdir, "embeddings")
+    })
+    stub_cmd = [
+        sys.executable, "-m", "benchmarks.stubs", "--port", str(stub_port),
+        "--latency-ms", args.latency_ms, "--jitter-ms", str(args.jitter_ms),
+        "--error-rate", args.error_rate, "--error-status", str(args.error_status)
+    ]
+    if args.seed is not None:
+        stub_cmd += ["--seed", str(args.seed)]
+    output = None if args.verbose else subprocess.DEVNULL
+    stubs = subprocess.Popen(stub_cmd, cwd=REPO_ROOT, stdout=subprocess.DEVNULL, stderr=output)
+    server = None
+    try:
+        await _wait_ready(f"http://127.0.0.1:{stub_port}/stats", stubs, 30)
+        server = subprocess.Popen([sys.executable, "mcp_server.py"], cwd=REPO_ROOT, env=env, stdout=subprocess.DEVNULL, stderr=output)
+        await _wait_ready(f"http://127.0.0.1:{server_port}/health", server, args.startup_timeout)
+        base_url = f"http://127.0.0.1:{server_port}"
+        results = {}
+        for scenario in args.scenarios:
+            results[scenario] = await drive(base_url, scenario, args)
+            print(f"{scenario}: done", file=sys.stderr)
+        async with httpx.AsyncClient() as client:
+            upstream = (await client.get(f"http://127.0.0.1:{stub_port}/stats")).json()
+        return {
+            "benchmarks": results,
+            "server_peak_rss_mb": _peak_rss_mb(server.pid),
+            "upstream": upstream,
+            "config": {
+                "concurrency": args.concurrency,
+                "requests": args.requests,
+                "max_results": args.max_results,
+                "latency_ms": args.latency_ms,
+                "error_rate": args.error_rate,
+                "mode": args.mode
+            }
+        }
+    finally:
+        for process in (server, stubs):
+            if process is not None and process.poll() is None:
+                process.terminate()
+                try:
+                    process.wait(10)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the HTTP API against local stub upstreams")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"Comma-separated subset of {', '.join(SCENARIOS)}")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=50, help="Requests per scenario")
+    parser.add_argument("--warmup", type=int, default=2, help="Requests sent before timing starts")
+    parser.add_argument("--query-pool", type=int, default=0, help="Distinct queries/payloads cycled through (0 = all distinct, no cache hits)")
+    parser.add_argument("--max-results", type=int, default=10)
+    parser.add_argument("--papers", type=int, default=20, help="Papers sent to synthesize and qa")
+    parser.add_argument("--mode", default="remote", help="Search mode passed to the server")
+    parser.add_argument("--latency-ms", default="50", help="Stub latency, e.g. 200 or arxiv=400,pubmed=150,s2=100")
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--error-rate", default="0", help="Stub failure fraction, e.g. 0.05 or s2=0.2")
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--request-timeout", type=float, default=120)
+    parser.add_argument("--startup-timeout", type=float, default=120)
+    parser.add_argument("--stub-port", type=int, default=0)
+    parser.add_argument("--server-port", type=int, default=0)
+    parser.add_argument("--verbose", action="store_true", help="Show stub and server logs")
+    parser.add_argument("--json", help="Write results to this file")
+    parser.add_argument("--baseline", help="Fail if results regress against this earlier --json output")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative regression against the baseline")
+    args = parser.parse_args()
+    args.run_id = uuid.uuid4().hex[:8]
+    args.scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    report = asyncio.run(run(args))
+    print_table(report["benchmarks"])
+    print(f"server peak RSS: {report['server_peak_rss_mb']} MB")
+    print(f"load generator peak RSS: {round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)} MB")
+    if args.json:
+        write_json(args.json, report)
+    if args.baseline:
+        regressions = compare(report["benchmarks"], args.baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
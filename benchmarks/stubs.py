@@ -0,0 +1,210 @@
+import os
+import copy
+import json
+import random
+import asyncio
+import argparse
+import xml.etree.ElementTree as ET
+from fastapi import FastAPI, Request
+from fastapi.responses import Response, JSONResponse
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+UPSTREAMS = ("arxiv", "pubmed", "s2")
+
+_ATOM = "http://www.w3.org/2005/Atom"
+_OPENSEARCH = "http://a9.com/-/spec/opensearch/1.1/"
+_ARXIV = "http://arxiv.org/schemas/atom"
+ET.register_namespace("", _ATOM)
+ET.register_namespace("opensearch", _OPENSEARCH)
+ET.register_namespace("arxiv", _ARXIV)
+
+def _read(name: str) -> bytes:
+    with open(os.path.join(FIXTURES_DIR, name), "rb") as f:
+        return f.read()
+
+_arxiv_entries = ET.fromstring(_read("arxiv_query.xml")).findall(f"{{{_ATOM}}}entry")
+_pubmed_articles = ET.fromstring(_read("pubmed_efetch.xml")).findall("PubmedArticle")
+_esearch = json.loads(_read("pubmed_esearch.json"))
+_s2_papers = json.loads(_read("s2_search.json"))["data"]
+
+# The recorded responses hold a handful of records; larger pages are made by
+# cycling them with a per-position ID, title and abstract suffix so that
+# every record is distinct, survives deduplication and misses the summary cache.
+def _variant_title(title: str, query: str, n: int) -> str:
+    return f"{' '.join(title.split())} ({query} {n})"
+
+def _variant_abstract(abstract: str, query: str, n: int) -> str:
+    return f"{abstract.strip()} This is record {n} for {query}." if abstract else abstract
+
+def arxiv_feed(query: str, start: int, count: int, total: int) -> bytes:
+    feed = ET.Element(f"{{{_ATOM}}}feed")
+    ET.SubElement(feed, f"{{{_OPENSEARCH}}}totalResults").text = str(total)
+    ET.SubElement(feed, f"{{{_OPENSEARCH}}}startIndex").text = str(start)
+    ET.SubElement(feed, f"{{{_OPENSEARCH}}}itemsPerPage").text = str(count)
+    for n in range(start, min(start + count, total)):
+        entry = copy.deepcopy(_arxiv_entries[n % len(_arxiv_entries)])
+        arxiv_id = f"{2400 + n // 100000}.{n % 100000:05d}v1"
+        entry.find(f"{{{_ATOM}}}id").text = f"http://arxiv.org/abs/{arxiv_id}"
+        title = entry.find(f"{{{_ATOM}}}title")
+        title.text = _variant_title(title.text, query, n)
+        summary = entry.find(f"{{{_ATOM}}}summary")
+        summary.text = _variant_abstract(summary.text, query, n)
+        for link in entry.iterfind(f"{{{_ATOM}}}link"):
+            link.set("href", f"http://arxiv.org/abs/{arxiv_id}")
+        doi = entry.find(f"{{{_ARXIV}}}doi")
+        if doi is not None:
+            entry.remove(doi)
+        feed.append(entry)
+    return ET.tostring(feed, encoding="utf-8", xml_declaration=True)
+
+def pubmed_esearch(query: str, total: int) -> dict:
+    data = copy.deepcopy(_esearch)
+    data["esearchresult"]["count"] = str(total)
+    # The history server session carries the query through to efetch.
+    data["esearchresult"]["webenv"] = query
+    return data
+
+def pubmed_efetch(query: str, start: int, count: int) -> bytes:
+    root = ET.Element("PubmedArticleSet")
+    for n in range(start, start + count):
+        article = copy.deepcopy(_pubmed_articles[n % len(_pubmed_articles)])
+        pmid = str(40000000 + n)
+        article.find(".//PMID").text = pmid
+        title = article.find(".//ArticleTitle")
+        title.text = _variant_title(title.text, query, n)
+        for abstract in article.iterfind(".//Abstract/AbstractText"):
+            abstract.text = _variant_abstract(abstract.text, query, n)
+        for article_id in article.iterfind(".//ArticleIdList/ArticleId"):
+            if article_id.get("IdType") == "pubmed":
+                article_id.text = pmid
+            elif article_id.get("IdType") == "doi":
+                article_id.text = f"10.5555/bench.{pmid}"
+        for location in article.iterfind(".//ELocationID"):
+            location.text = f"10.5555/bench.{pmid}"
+        root.append(article)
+    return ET.tostring(root, encoding="utf-8", xml_declaration=True)
+
+def s2_paper(query: str, n: int) -> dict:
+    paper = copy.deepcopy(_s2_papers[n % len(_s2_papers)])
+    paper["paperId"] = f"{n:040x}"
+    paper["url"] = f"https://www.semanticscholar.org/paper/{paper['paperId']}"
+    paper["title"] = _variant_title(paper["title"], query, n)
+    paper["abstract"] = _variant_abstract(paper["abstract"], query, n)
+    paper["externalIds"] = {"CorpusId": n}
+    return paper
+
+def s2_search(query: str, offset: int, limit: int, total: int) -> dict:
+    papers = [s2_paper(query, n) for n in range(offset, min(offset + limit, total))]
+    return {"total": total, "offset": offset, "next": offset + len(papers), "data": papers}
+
+def parse_overrides(value: str, cast=float) -> dict:
+    # "200" applies to every upstream, "arxiv=400,s2=100" sets them one by one.
+    if not value:
+        return {}
+    if "=" not in value:
+        return {name: cast(value) for name in UPSTREAMS}
+    overrides = {}
+    for part in value.split(","):
+        name, _, number = part.partition("=")
+        if name.strip() not in UPSTREAMS:
+            raise ValueError(f"Unknown upstream {name!r}, expected one of {', '.join(UPSTREAMS)}")
+        overrides[name.strip()] = cast(number)
+    return overrides
+
+def create_app(latency_ms: dict = None, jitter_ms: float = 0, error_rate: dict = None,
+               error_status: int = 503, total: int = 1000, seed: int = None) -> FastAPI:
+    latency_ms = latency_ms or {}
+    error_rate = error_rate or {}
+    rng = random.Random(seed)
+    app = FastAPI()
+    app.state.requests = {name: 0 for name in UPSTREAMS}
+    app.state.errors = {name: 0 for name in UPSTREAMS}
+
+    async def upstream(name: str):
+        app.state.requests[name] += 1
+        delay = latency_ms.get(name, 0) + rng.uniform(0, jitter_ms)
+        if delay > 0:
+            await asyncio.sleep(delay / 1000)
+        if rng.random() < error_rate.get(name, 0):
+            app.state.errors[name] += 1
+            headers = {"Retry-After": "1"} if error_status == 429 else {}
+            return Response(status_code=error_status, headers=headers)
+        return None
+
+    @app.get("/arxiv/api/query")
+    async def arxiv_query(search_query: str = "", start: int = 0, max_results: int = 10):
+        error = await upstream("arxiv")
+        if error is not None:
+            return error
+        return Response(arxiv_feed(search_query, start, max_results, total), media_type="application/atom+xml")
+
+    @app.get("/pubmed/entrez/eutils/esearch.fcgi")
+    async def esearch(term: str = ""):
+        error = await upstream("pubmed")
+        if error is not None:
+            return error
+        return JSONResponse(pubmed_esearch(term, total))
+
+    @app.get("/pubmed/entrez/eutils/efetch.fcgi")
+    async def efetch(retstart: int = 0, retmax: int = 20, WebEnv: str = ""):
+        error = await upstream("pubmed")
+        if error is not None:
+            return error
+        return Response(pubmed_efetch(WebEnv, retstart, retmax), media_type="text/xml")
+
+    @app.get("/s2/graph/v1/paper/search")
+    async def s2_query(query: str = "", offset: int = 0, limit: int = 10):
+        error = await upstream("s2")
+        if error is not None:
+            return error
+        return JSONResponse(s2_search(query, offset, limit, total))
+
+    @app.post("/s2/graph/v1/paper/batch")
+    async def s2_batch(request: Request):
+        error = await upstream("s2")
+        if error is not None:
+            return error
+        ids = (await request.json()).get("ids", [])
+        return JSONResponse([s2_paper(pid, n) for n, pid in enumerate(ids)])
+
+    @app.get("/stats")
+    async def stats():
+        return {"requests": app.state.requests, "errors": app.state.errors}
+
+    return app
+
+def base_urls(host: str, port: int) -> dict:
+    root = f"http://{host}:{port}"
+    return {
+        "ARXIV_BASE_URL": f"{root}/arxiv",
+        "PUBMED_BASE_URL": f"{root}/pubmed",
+        "SEMANTIC_SCHOLAR_BASE_URL": f"{root}/s2"
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve recorded arXiv, PubMed and Semantic Scholar responses locally")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency-ms", default="0", help="Added latency, e.g. 200 or arxiv=400,pubmed=150,s2=100")
+    parser.add_argument("--jitter-ms", type=float, default=0, help="Uniform random latency added on top")
+    parser.add_argument("--error-rate", default="0", help="Fraction of failed responses, e.g. 0.05 or s2=0.2")
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--total", type=int, default=1000, help="Result count reported for every query")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    import uvicorn
+    app = create_app(
+        latency_ms=parse_overrides(args.latency_ms),
+        jitter_ms=args.jitter_ms,
+        error_rate=parse_overrides(args.error_rate),
+        error_status=args.error_status,
+        total=args.total,
+        seed=args.seed
+    )
+    for name, url in base_urls(args.host, args.port).items():
+        print(f"{name}={url}")
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
@@ -1,31 +1,494 @@
 import os
 import json
+import time
+import asyncio
+from collections import OrderedDict
+from dedup import merge_records
+from logger_config import logging
+from metrics import CACHE_REQUESTS, CACHE_LATENCY, CACHE_REFRESHES, timing
 
 try:
-    import redis
-    REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
-    redis_client = redis.Redis.from_url(REDIS_URL, decode_responses=True)
-    redis_available = True
-    try:
-        redis_client.ping()
-    except Exception:
-        redis_available = False
+    import redis.asyncio as redis
 except ImportError:
-    redis_available = False
+    redis = None
 
-def get_from_cache(key: str):
-    if redis_available:
-        try:
-            value = redis_client.get(key)
-            if value is not None:
-                return json.loads(value)
-        except Exception:
-            pass
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
+REDIS_RECHECK_INTERVAL = float(os.getenv("REDIS_RECHECK_INTERVAL", "30"))
+L1_CACHE_MAX_ENTRIES = int(os.getenv("L1_CACHE_MAX_ENTRIES", "1024"))
+L1_CACHE_TTL = int(os.getenv("L1_CACHE_TTL", "300"))
+CACHE_CODEC = os.getenv("CACHE_CODEC", "msgpack")
+CACHE_COMPRESSION = os.getenv("CACHE_COMPRESSION", "zstd")
+CACHE_COMPRESS_MIN_BYTES = int(os.getenv("CACHE_COMPRESS_MIN_BYTES", "1024"))
+PAPER_RECORD_TTL = int(os.getenv("PAPER_RECORD_TTL", str(7 * 24 * 3600)))
+REFRESH_LOCK_SECONDS = int(os.getenv("REFRESH_LOCK_SECONDS", "30"))
+
+# Redis values start with a three byte header: format version, codec ID and
+# compression ID. IDs are part of the stored format, so they must never be
+# reused for something else. Values written before the header existed are
+# plain JSON text, which can never start with the version byte.
+CACHE_FORMAT_VERSION = 1
+
+def _json_dumps(value) -> bytes:
+    return json.dumps(value, separators=(",", ":")).encode("utf-8")
+
+CACHE_CODECS = {"json": (1, _json_dumps, json.loads)}
+if msgpack is not None:
+    CACHE_CODECS["msgpack"] = (
+        2,
+        lambda value: msgpack.packb(value, use_bin_type=True),
+        lambda data: msgpack.unpackb(data, raw=False, strict_map_key=False)
+    )
+
+CACHE_COMPRESSORS = {"none": (0, None, None)}
+if zstandard is not None:
+    CACHE_COMPRESSORS["zstd"] = (
+        1,
+        lambda data: zstandard.ZstdCompressor(level=3).compress(data),
+        lambda data: zstandard.ZstdDecompressor().decompress(data)
+    )
+if lz4_frame is not None:
+    CACHE_COMPRESSORS["lz4"] = (2, lz4_frame.compress, lz4_frame.decompress)
+
+def _pick(registry: dict, name: str, fallback: str, setting: str):
+    if name in registry:
+        return name
+    logging.warning(f"{setting}={name!r} is not available, using {fallback!r}")
+    return fallback
+
+_codec_name = _pick(CACHE_CODECS, CACHE_CODEC, "json", "CACHE_CODEC")
+_compression_name = _pick(CACHE_COMPRESSORS, CACHE_COMPRESSION, "none", "CACHE_COMPRESSION")
+_CODECS_BY_ID = {codec_id: loads for codec_id, _, loads in CACHE_CODECS.values()}
+_DECOMPRESSORS_BY_ID = {comp_id: decompress for comp_id, _, decompress in CACHE_COMPRESSORS.values()}
+
+def encode_value(value, codec: str = None, compression: str = None) -> bytes:
+    codec_id, dumps, _ = CACHE_CODECS[codec or _codec_name]
+    comp_id, compress, _ = CACHE_COMPRESSORS[compression or _compression_name]
+    data = dumps(value)
+    if compress is None or len(data) < CACHE_COMPRESS_MIN_BYTES:
+        comp_id = 0
+    else:
+        data = compress(data)
+    return bytes((CACHE_FORMAT_VERSION, codec_id, comp_id)) + data
+
+def decode_value(raw: bytes):
+    if not raw:
+        return None
+    if raw[0] != CACHE_FORMAT_VERSION:
+        if raw[:1] in b"[{\"-0123456789tfn":
+            return json.loads(raw)
+        # Written by a newer release; treat it as a miss rather than guess.
+        return None
+    loads = _CODECS_BY_ID.get(raw[1])
+    decompress = _DECOMPRESSORS_BY_ID.get(raw[2])
+    if loads is None or decompress is None and raw[2] != 0:
+        return None
+    data = raw[3:] if raw[2] == 0 else decompress(raw[3:])
+    return loads(data)
+
+def _decode(key: str, raw):
+    try:
+        return decode_value(raw)
+    except Exception as e:
+        logging.warning(f"Undecodable cache value for {key}: {e}")
+        return None
+
+class LRUCache:
+    def __init__(self, max_entries: int, default_ttl: int):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self._data = OrderedDict()
+
+    def get(self, key: str):
+        return self.get_with_ttl(key)[0]
+
+    # The remaining TTL is the one the entry was stored with, not the (capped)
+    # time it will stay in this tier.
+    def get_with_ttl(self, key: str):
+        item = self._data.get(key)
+        if item is None:
+            return None, None
+        expires_at, value, deadline = item
+        now = time.monotonic()
+        if expires_at <= now:
+            del self._data[key]
+            return None, None
+        self._data.move_to_end(key)
+        return value, deadline - now
+
+    def set(self, key: str, value, ttl: int = None):
+        if self.max_entries <= 0:
+            return
+        now = time.monotonic()
+        ttl = self.default_ttl if ttl is None else ttl
+        self._data[key] = (now + min(ttl, self.default_ttl), value, now + ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    def delete(self, key: str):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+# Values are shared between callers on L1 hits, so callers must not mutate
+# what they get back from the cache.
+l1_cache = LRUCache(L1_CACHE_MAX_ENTRIES, L1_CACHE_TTL)
+
+_redis_client = None
+_redis_available = False
+_redis_next_check = 0.0
+_inflight: dict[str, asyncio.Future] = {}
+_background = set()
+
+async def _get_redis():
+    global _redis_client, _redis_available, _redis_next_check
+    if redis is None:
+        return None
+    if _redis_available:
+        return _redis_client
+    now = time.monotonic()
+    if now < _redis_next_check:
+        return None
+    _redis_next_check = now + REDIS_RECHECK_INTERVAL
+    try:
+        if _redis_client is None:
+            _redis_client = redis.Redis.from_url(REDIS_URL)
+        await _redis_client.ping()
+        _redis_available = True
+        logging.info("Redis cache available")
+        return _redis_client
+    except Exception as e:
+        logging.warning(f"Redis unavailable, retrying in {REDIS_RECHECK_INTERVAL}s: {e}")
+        return None
+
+async def redis_available() -> bool:
+    return await _get_redis() is not None
+
+def _mark_redis_down(e: Exception):
+    global _redis_available, _redis_next_check
+    if _redis_available:
+        logging.warning(f"Redis error, falling back to in-process cache: {e}")
+    _redis_available = False
+    _redis_next_check = time.monotonic() + REDIS_RECHECK_INTERVAL
+
+def _observe(tier: str, operation: str, started: float):
+    CACHE_LATENCY.labels(tier, operation).observe(time.perf_counter() - started)
+
+def _count(tier: str, hits: int, misses: int):
+    if hits:
+        CACHE_REQUESTS.labels(tier, "hit").inc(hits)
+    if misses:
+        CACHE_REQUESTS.labels(tier, "miss").inc(misses)
+
+PAPER_RECORD_PREFIX = "paperrec:"
+# Fields that depend on the query rather than on the paper stay in the entry.
+_PER_QUERY_FIELDS = ("relevance",)
+
+def _paper_list(value):
+    if isinstance(value, list):
+        return value
+    if isinstance(value, dict) and isinstance(value.get("results"), list):
+        return value["results"]
     return None
 
-def set_to_cache(key: str, value, ttl: int = 3600):
-    if redis_available:
+# Search entries can store each merged paper once under its paper_id and keep
+# only references plus per-query fields, so the same abstract returned by
+# many queries is held in Redis a single time.
+def _share_papers(value) -> tuple[dict, dict]:
+    papers = _paper_list(value)
+    if papers is None:
+        return value, {}
+    refs = []
+    records = {}
+    for paper in papers:
+        pid = paper.get("paper_id") if isinstance(paper, dict) else None
+        if not pid:
+            refs.append(paper)
+            continue
+        records[pid] = {k: v for k, v in paper.items() if k not in _PER_QUERY_FIELDS}
+        refs.append({"$ref": pid, **{k: paper[k] for k in _PER_QUERY_FIELDS if k in paper}})
+    return {"$shared": refs if isinstance(value, list) else {**value, "results": refs}}, records
+
+# Records are shared by every entry that returned the paper, so a sparse
+# copy from one provider is merged into the stored record (longest abstract,
+# missing fields filled in) rather than replacing a richer one.
+async def _merge_stored_records(client, records: dict) -> dict:
+    pids = list(records)
+    raws = await client.mget([PAPER_RECORD_PREFIX + pid for pid in pids])
+    merged = {}
+    for pid, raw in zip(pids, raws):
+        existing = _decode(pid, raw) if raw is not None else None
+        merged[pid] = merge_records(existing, records[pid]) if isinstance(existing, dict) else records[pid]
+    return merged
+
+async def _join_papers(client, entry):
+    if not isinstance(entry, dict) or "$shared" not in entry:
+        return entry
+    shell = entry["$shared"]
+    refs = _paper_list(shell)
+    ids = [ref["$ref"] for ref in refs if isinstance(ref, dict) and "$ref" in ref]
+    raws = await client.mget([PAPER_RECORD_PREFIX + pid for pid in ids]) if ids else []
+    records = {pid: _decode(pid, raw) for pid, raw in zip(ids, raws)}
+    if any(record is None for record in records.values()):
+        # A referenced record expired or was evicted; refetch the whole entry.
+        return None
+    papers = [
+        {**records[ref["$ref"]], **{k: v for k, v in ref.items() if k != "$ref"}}
+        if isinstance(ref, dict) and "$ref" in ref else ref
+        for ref in refs
+    ]
+    return papers if isinstance(shell, list) else {**shell, "results": papers}
+
+async def _get_with_ttl(key: str):
+    with timing("cache"):
+        started = time.perf_counter()
+        value, remaining = l1_cache.get_with_ttl(key)
+        _observe("l1", "get", started)
+        _count("l1", value is not None, value is None)
+        if value is not None:
+            return value, remaining
+        client = await _get_redis()
+        if client is not None:
+            started = time.perf_counter()
+            try:
+                async with client.pipeline(transaction=False) as pipe:
+                    pipe.get(key)
+                    pipe.ttl(key)
+                    raw, ttl = await pipe.execute()
+                _observe("redis", "get", started)
+                _count("redis", raw is not None, raw is None)
+                value = await _join_papers(client, _decode(key, raw)) if raw is not None else None
+                if value is not None:
+                    ttl = ttl if ttl and ttl > 0 else None
+                    l1_cache.set(key, value, ttl)
+                    return value, ttl
+            except Exception as e:
+                _mark_redis_down(e)
+        return None, None
+
+async def get_from_cache(key: str):
+    return (await _get_with_ttl(key))[0]
+
+# Seconds until the entry expires, or None when it is not cached. Only the
+# TTL is read, not the value.
+async def time_to_live(key: str):
+    value, remaining = l1_cache.get_with_ttl(key)
+    if value is not None:
+        return remaining
+    client = await _get_redis()
+    if client is None:
+        return None
+    try:
+        ttl = await client.ttl(key)
+    except Exception as e:
+        _mark_redis_down(e)
+        return None
+    if ttl == -1:
+        return float("inf")
+    return ttl if ttl >= 0 else None
+
+async def set_to_cache(key: str, value, ttl: int = 3600, share_papers: bool = False):
+    with timing("cache"):
+        l1_cache.set(key, value, ttl)
+        client = await _get_redis()
+        if client is not None:
+            started = time.perf_counter()
+            try:
+                entry, records = _share_papers(value) if share_papers else (value, {})
+                if records:
+                    records = await _merge_stored_records(client, records)
+                async with client.pipeline(transaction=False) as pipe:
+                    # Records outlive the entries that point at them.
+                    for pid, record in records.items():
+                        pipe.set(PAPER_RECORD_PREFIX + pid, encode_value(record), ex=max(ttl, PAPER_RECORD_TTL))
+                    pipe.set(key, encode_value(entry), ex=ttl)
+                    await pipe.execute()
+                _observe("redis", "set", started)
+            except Exception as e:
+                _mark_redis_down(e)
+
+async def get_many_from_cache(keys: list[str]) -> list:
+    with timing("cache"):
+        started = time.perf_counter()
+        values = [l1_cache.get(key) for key in keys]
+        missing = [i for i, value in enumerate(values) if value is None]
+        _observe("l1", "mget", started)
+        _count("l1", len(keys) - len(missing), len(missing))
+        if not missing:
+            return values
+        client = await _get_redis()
+        if client is not None:
+            started = time.perf_counter()
+            try:
+                raws = await client.mget([keys[i] for i in missing])
+                _observe("redis", "mget", started)
+                found = 0
+                for i, raw in zip(missing, raws):
+                    if raw is not None:
+                        values[i] = _decode(keys[i], raw)
+                    if values[i] is not None:
+                        l1_cache.set(keys[i], values[i])
+                        found += 1
+                _count("redis", found, len(missing) - found)
+            except Exception as e:
+                _mark_redis_down(e)
+        return values
+
+async def set_many_to_cache(items: dict, ttl: int = 3600):
+    if not items:
+        return
+    with timing("cache"):
+        for key, value in items.items():
+            l1_cache.set(key, value, ttl)
+        client = await _get_redis()
+        if client is not None:
+            started = time.perf_counter()
+            try:
+                async with client.pipeline(transaction=False) as pipe:
+                    for key, value in items.items():
+                        pipe.set(key, encode_value(value), ex=ttl)
+                    await pipe.execute()
+                _observe("redis", "mset", started)
+            except Exception as e:
+                _mark_redis_down(e)
+
+async def _fill(key: str, future: asyncio.Future, fetch, ttl, share_papers: bool, stale_ttl: int):
+    try:
+        value = await fetch()
+        ttl = ttl(value) if callable(ttl) else ttl
+        await set_to_cache(key, value, ttl + stale_ttl, share_papers)
+        future.set_result(value)
+        return value
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
+    except Exception as e:
+        future.set_exception(e)
+        # Mark the exception as retrieved when nobody else was waiting on it.
+        future.exception()
+        raise
+    finally:
+        _inflight.pop(key, None)
+
+def _claim(key: str) -> asyncio.Future:
+    future = asyncio.get_running_loop().create_future()
+    _inflight[key] = future
+    return future
+
+# Returns (value, cached). Concurrent misses on the same key share a single
+# fetch() call instead of each going upstream. ttl may also be a callable
+# that picks the TTL from the fetched value.
+#
+# With stale_ttl, entries are kept that much longer than ttl. A caller that
+# finds one in that window gets it straight away and a single background
+# revalidate() replaces it. fetch must then not depend on per-request state.
+async def get_or_fetch(key: str, fetch, ttl=3600, share_papers: bool = False, stale_ttl: int = 0):
+    value, remaining = await _get_with_ttl(key)
+    if value is not None:
+        if stale_ttl and remaining is not None and remaining <= stale_ttl:
+            revalidate(key, fetch, ttl, share_papers, stale_ttl, "stale")
+        return value, True
+    pending = _inflight.get(key)
+    if pending is not None:
+        await asyncio.wait([pending])
+        if pending.cancelled():
+            return await get_or_fetch(key, fetch, ttl, share_papers, stale_ttl)
+        return pending.result(), False
+    value = l1_cache.get(key)
+    if value is not None:
+        return value, True
+    return await _fill(key, _claim(key), fetch, ttl, share_papers, stale_ttl), False
+
+# For callers that build the value themselves, such as a search streamed to
+# the client as it arrives. claim() returns the future to complete with
+# fill() or release(), or None when a fetch for the key is already running;
+# join() then waits for that fetch's value (None if it failed).
+def claim(key: str):
+    if key in _inflight:
+        return None
+    return _claim(key)
+
+async def join(key: str):
+    pending = _inflight.get(key)
+    if pending is None:
+        return None
+    await asyncio.wait([pending])
+    if pending.cancelled() or pending.exception() is not None:
+        return None
+    return pending.result()
+
+async def fill(key: str, future: asyncio.Future, value, ttl=3600, share_papers: bool = False, stale_ttl: int = 0):
+    async def fetch():
+        return value
+    return await _fill(key, future, fetch, ttl, share_papers, stale_ttl)
+
+def release(key: str, future: asyncio.Future):
+    if not future.done():
+        future.cancel()
+    if _inflight.get(key) is future:
+        del _inflight[key]
+
+async def _acquire_refresh_lock(key: str) -> bool:
+    client = await _get_redis()
+    if client is None:
+        return True
+    try:
+        return bool(await client.set(f"refresh-lock:{key}", b"1", nx=True, ex=REFRESH_LOCK_SECONDS))
+    except Exception as e:
+        _mark_redis_down(e)
+        return True
+
+async def _revalidate(key: str, future: asyncio.Future, fetch, ttl, share_papers: bool, stale_ttl: int, trigger: str):
+    # Another replica holding the lock is already refreshing this key and
+    # will write the result to the shared cache.
+    if not await _acquire_refresh_lock(key):
+        _inflight.pop(key, None)
+        future.cancel()
+        CACHE_REFRESHES.labels(trigger, "skipped").inc()
+        return
+    try:
+        await _fill(key, future, fetch, ttl, share_papers, stale_ttl)
+        CACHE_REFRESHES.labels(trigger, "refreshed").inc()
+    except Exception as e:
+        CACHE_REFRESHES.labels(trigger, "failed").inc()
+        logging.warning(f"Background refresh of {key} failed: {e}")
+
+# Refreshes key in the background unless a fetch for it is already running.
+def revalidate(key: str, fetch, ttl=3600, share_papers: bool = False, stale_ttl: int = 0, trigger: str = "manual") -> bool:
+    if key in _inflight:
+        return False
+    task = asyncio.create_task(_revalidate(key, _claim(key), fetch, ttl, share_papers, stale_ttl, trigger))
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+    return True
+
+async def shutdown():
+    global _redis_client, _redis_available
+    for task in list(_background):
+        task.cancel()
+    if _redis_client is not None:
         try:
-            redis_client.set(key, json.dumps(value), ex=ttl)
+            await _redis_client.aclose()
         except Exception:
-            pass
\ No newline at end of file
+            pass
+    _redis_client = None
+    _redis_available = False
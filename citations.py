@@ -0,0 +1,264 @@
+import os
+import re
+import asyncio
+import unicodedata
+from functools import lru_cache
+from string import Formatter
+
+CITATION_CACHE_SIZE = int(os.getenv("CITATION_CACHE_SIZE", "65536"))
+MAX_CITATION_PAPERS = int(os.getenv("MAX_CITATION_PAPERS", "5000"))
+
+_PARTICLES = {"van", "von", "der", "den", "de", "del", "della", "di", "da", "du", "la", "le", "ter", "ten", "dos", "das", "al", "el", "bin", "ibn"}
+_SUFFIXES = {"jr", "jr.", "sr", "sr.", "ii", "iii", "iv"}
+_MONTHS = {m: i for i, m in enumerate(("jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"), 1)}
+_MONTH_NAMES = ("January", "February", "March", "April", "May", "June", "July",
+                "August", "September", "October", "November", "December")
+_MLA_MONTHS = ("Jan.", "Feb.", "Mar.", "Apr.", "May", "June", "July", "Aug.", "Sept.", "Oct.", "Nov.", "Dec.")
+_DATE = re.compile(r"(\d{4})(?:[-/ ]([A-Za-z]{3,}|\d{1,2}))?(?:[-/ ](\d{1,2}))?")
+_BIBTEX_SPECIAL = re.compile(r"([&%$#_{}])")
+
+# Providers give names as "Given Family" (and occasionally "Family, Given");
+# parsing is memoized because the same authors recur across a bibliography.
+@lru_cache(maxsize=CITATION_CACHE_SIZE)
+def parse_name(name: str) -> tuple[tuple[str, ...], str, str]:
+    name = " ".join(name.split())
+    if "," in name:
+        family, _, given = name.partition(",")
+        given_parts = given.split()
+        suffix = ""
+        if given_parts and given_parts[-1].lower() in _SUFFIXES:
+            suffix = given_parts.pop()
+        return tuple(given_parts), family.strip(), suffix
+    parts = name.split()
+    suffix = ""
+    if len(parts) > 1 and parts[-1].lower() in _SUFFIXES:
+        suffix = parts.pop()
+    if len(parts) <= 1:
+        return (), parts[0] if parts else "", suffix
+    start = len(parts) - 1
+    while start > 1 and parts[start - 1].lower() in _PARTICLES:
+        start -= 1
+    return tuple(parts[:start]), " ".join(parts[start:]), suffix
+
+@lru_cache(maxsize=CITATION_CACHE_SIZE)
+def parse_date(value: str) -> tuple[str, int, int]:
+    match = _DATE.search(value or "")
+    if not match:
+        return "", 0, 0
+    year, month, day = match.groups()
+    if month and month.isdigit():
+        month = int(month)
+    elif month:
+        month = _MONTHS.get(month[:3].lower(), 0)
+    month = month if month and 1 <= month <= 12 else 0
+    day = int(day) if day and month else 0
+    return year, month, day
+
+def _initials(given: tuple[str, ...]) -> str:
+    initials = []
+    for part in given:
+        # Hyphenated given names keep the hyphen: Jean-Paul -> J.-P.
+        pieces = [p for p in part.replace(".", " ").split("-") if p.strip()]
+        initials.append("-".join(f"{p.strip()[0]}." for p in pieces))
+    return " ".join(initials)
+
+@lru_cache(maxsize=CITATION_CACHE_SIZE)
+def _apa_author(name: str) -> str:
+    given, family, suffix = parse_name(name)
+    initials = _initials(given)
+    text = f"{family}, {initials}" if initials else family
+    return f"{text}, {suffix}" if suffix else text
+
+@lru_cache(maxsize=CITATION_CACHE_SIZE)
+def _inverted_author(name: str) -> str:
+    given, family, suffix = parse_name(name)
+    text = f"{family}, {' '.join(given)}" if given else family
+    return f"{text}, {suffix}" if suffix else text
+
+@lru_cache(maxsize=CITATION_CACHE_SIZE)
+def _natural_author(name: str) -> str:
+    given, family, suffix = parse_name(name)
+    text = " ".join(given + (family,)) if given else family
+    return f"{text} {suffix}" if suffix else text
+
+# BibTeX's three-part form puts the suffix second: "Jones, Jr., Bob".
+@lru_cache(maxsize=CITATION_CACHE_SIZE)
+def _bibtex_author(name: str) -> str:
+    given, family, suffix = parse_name(name)
+    parts = [family, suffix, " ".join(given)] if suffix else [family, " ".join(given)]
+    return ", ".join(parts) if given or suffix else family
+
+def _apa_authors(authors: list[str]) -> str:
+    names = [_apa_author(a) for a in authors if a.strip()]
+    if len(names) > 20:
+        return ", ".join(names[:19]) + ", . . . " + names[-1]
+    if len(names) > 1:
+        return ", ".join(names[:-1]) + ", & " + names[-1]
+    return names[0] if names else ""
+
+def _mla_authors(authors: list[str]) -> str:
+    authors = [a for a in authors if a.strip()]
+    if len(authors) > 2:
+        return f"{_inverted_author(authors[0])}, et al"
+    if len(authors) == 2:
+        return f"{_inverted_author(authors[0])}, and {_natural_author(authors[1])}"
+    return _inverted_author(authors[0]) if authors else ""
+
+def _strip_period(text: str) -> str:
+    return text.rstrip().rstrip(".")
+
+def _doi_url(paper: dict) -> str:
+    return f"https://doi.org/{paper['doi']}" if paper.get("doi") else paper.get("url", "")
+
+def _apa_fields(paper: dict) -> dict:
+    year, _, _ = parse_date(paper.get("publication_date", ""))
+    return {
+        "authors": _strip_period(_apa_authors(paper.get("authors") or [])),
+        "year": year or "n.d.",
+        "title": _strip_period(paper.get("title", "")),
+        "source": paper.get("source", ""),
+        "link": _doi_url(paper)
+    }
+
+def _mla_fields(paper: dict) -> dict:
+    year, month, day = parse_date(paper.get("publication_date", ""))
+    date = " ".join(filter(None, (str(day) if day else "", _MLA_MONTHS[month - 1] if month else "", year)))
+    link = _doi_url(paper)
+    return {
+        "authors": _strip_period(_mla_authors(paper.get("authors") or [])),
+        "title": _strip_period(paper.get("title", "")),
+        "source": paper.get("source", ""),
+        "date": date,
+        "link": link.removeprefix("https://").removeprefix("http://")
+    }
+
+def _bibtex_escape(text: str) -> str:
+    return _BIBTEX_SPECIAL.sub(r"\\\1", text)
+
+def _bibtex_key(paper: dict, year: str) -> str:
+    authors = paper.get("authors") or []
+    family = parse_name(authors[0])[1] if authors else "anon"
+    word = next((w for w in re.findall(r"\w+", paper.get("title", "")) if len(w) > 3), "paper")
+    key = f"{family}{year}{word}".lower()
+    key = unicodedata.normalize("NFKD", key).encode("ascii", "ignore").decode("ascii")
+    return re.sub(r"[^a-z0-9]", "", key) or "paper"
+
+def _bibtex_fields(paper: dict) -> dict:
+    year, month, _ = parse_date(paper.get("publication_date", ""))
+    return {
+        "type": "misc" if paper.get("arxiv_id") and not paper.get("doi") else "article",
+        "key": _bibtex_key(paper, year),
+        "authors": " and ".join(_bibtex_escape(_bibtex_author(a)) for a in paper.get("authors") or [] if a.strip()),
+        "title": _bibtex_escape(paper.get("title", "")),
+        "source": _bibtex_escape(paper.get("source", "")),
+        "year": year,
+        "month": _MONTH_NAMES[month - 1][:3].lower() if month else "",
+        "doi": paper.get("doi", ""),
+        "eprint": paper.get("arxiv_id", ""),
+        "pmid": paper.get("pmid", ""),
+        "url": paper.get("url", "")
+    }
+
+def _ris_fields(paper: dict) -> dict:
+    year, month, day = parse_date(paper.get("publication_date", ""))
+    return {
+        "type": "JOUR" if paper.get("doi") or paper.get("pmid") else "GEN",
+        "authors": "".join(f"AU  - {_inverted_author(a)}\n" for a in paper.get("authors") or [] if a.strip()),
+        "title": paper.get("title", ""),
+        "source": paper.get("source", ""),
+        "year": year,
+        "date": f"{year}/{month:02d}/{day:02d}" if day else f"{year}/{month:02d}" if month else "",
+        "doi": paper.get("doi", ""),
+        "url": paper.get("url", ""),
+        "abstract": " ".join((paper.get("abstract") or "").split())
+    }
+
+# A template is a sequence of segments; a segment is left out when any field
+# it refers to is empty, which keeps missing dates or DOIs from leaving
+# dangling punctuation. Templates are parsed once at import.
+def _compile(*segments: str) -> list[tuple[str, tuple[str, ...]]]:
+    return [
+        (segment, tuple(name for _, name, _, _ in Formatter().parse(segment) if name))
+        for segment in segments
+    ]
+
+STYLES = {
+    "apa": (_apa_fields, _compile("{authors}. ", "({year}). ", "{title}. ", "{source}. ", "{link}"), "text/plain"),
+    "mla": (_mla_fields, _compile("{authors}. ", "\"{title}.\" ", "{source}, ", "{date}, ", "{link}, "), "text/plain"),
+    "bibtex": (_bibtex_fields, _compile(
+        "@{type}{{{key},\n",
+        "  author = {{{authors}}},\n",
+        "  title = {{{{{title}}}}},\n",
+        "  journal = {{{source}}},\n",
+        "  year = {{{year}}},\n",
+        "  month = {month},\n",
+        "  doi = {{{doi}}},\n",
+        "  eprint = {{{eprint}}},\n",
+        "  pmid = {{{pmid}}},\n",
+        "  url = {{{url}}},\n",
+        "}}\n"
+    ), "application/x-bibtex"),
+    "ris": (_ris_fields, _compile(
+        "TY  - {type}\n", "{authors}", "TI  - {title}\n", "JO  - {source}\n", "PY  - {year}\n", "DA  - {date}\n",
+        "DO  - {doi}\n", "UR  - {url}\n", "AB  - {abstract}\n", "ER  - \n"
+    ), "application/x-research-info-systems")
+}
+
+def _render(template: list, fields: dict) -> str:
+    text = "".join(segment.format_map(fields) for segment, names in template if all(fields[n] for n in names))
+    # Record formats end on a newline and keep their trailing spaces, since
+    # RIS requires "ER  - ". MLA entries end on whichever element came last,
+    # closed with a period.
+    if text.endswith("\n"):
+        return text.rstrip("\n")
+    text = text.strip()
+    return text[:-1] + "." if text.endswith(",") else text
+
+def format_citation(paper: dict, style: str = "apa") -> str:
+    if style not in STYLES:
+        raise ValueError(f"Unknown citation style {style!r}, expected one of {', '.join(STYLES)}")
+    build, template, _ = STYLES[style]
+    return _render(template, build(paper))
+
+# Yields one formatted entry per paper. BibTeX keys are made unique within
+# the bibliography by appending a, b, c, ... to repeats.
+def iter_citations(papers: list[dict], style: str = "apa"):
+    if style not in STYLES:
+        raise ValueError(f"Unknown citation style {style!r}, expected one of {', '.join(STYLES)}")
+    build, template, _ = STYLES[style]
+    seen_keys = {}
+    for paper in papers:
+        fields = build(paper)
+        if "key" in fields:
+            count = seen_keys.get(fields["key"], 0)
+            seen_keys[fields["key"]] = count + 1
+            if count:
+                fields["key"] += _key_suffix(count)
+        yield _render(template, fields)
+
+def _key_suffix(count: int) -> str:
+    suffix = ""
+    while count:
+        count, rem = divmod(count - 1, 26)
+        suffix = chr(ord("a") + rem) + suffix
+    return suffix
+
+def format_bibliography(papers: list[dict], style: str = "apa") -> list[str]:
+    return list(iter_citations(papers, style))
+
+def media_type(style: str) -> str:
+    return STYLES[style][2] if style in STYLES else "text/plain"
+
+# Streams a bibliography as text, yielding to the event loop between chunks
+# so a large export does not hold up other requests.
+async def stream_bibliography(papers: list[dict], style: str = "apa", chunk_size: int = 100):
+    separator = "\n" if style in ("bibtex", "ris") else ""
+    chunk = []
+    for entry in iter_citations(papers, style):
+        chunk.append(entry + "\n" + separator)
+        if len(chunk) >= chunk_size:
+            yield "".join(chunk)
+            chunk = []
+            await asyncio.sleep(0)
+    if chunk:
+        yield "".join(chunk)
@@ -0,0 +1,100 @@
+import re
+import unicodedata
+
+ID_FIELDS = ("doi", "arxiv_id", "pmid", "s2_id")
+_NON_ALNUM = re.compile(r"[^a-z0-9]+")
+_ARXIV_VERSION = re.compile(r"v\d+$")
+_DOI_PREFIX = re.compile(r"^(https?://(dx\.)?doi\.org/|doi:)")
+# Titles this short are too generic to match on alone, so they also need the
+# first author's surname to agree.
+_MIN_TITLE_WORDS = 4
+
+def normalize_text(text: str) -> str:
+    text = unicodedata.normalize("NFKD", text or "")
+    text = text.encode("ascii", "ignore").decode("ascii").lower()
+    return _NON_ALNUM.sub(" ", text).strip()
+
+def normalize_author(name: str) -> str:
+    parts = normalize_text(name).split()
+    return parts[-1] if parts else ""
+
+def paper_keys(paper: dict) -> list[str]:
+    keys = []
+    doi = _DOI_PREFIX.sub("", (paper.get("doi") or "").strip().lower())
+    if doi:
+        keys.append(f"doi:{doi}")
+    arxiv_id = _ARXIV_VERSION.sub("", (paper.get("arxiv_id") or "").strip().lower())
+    if arxiv_id:
+        keys.append(f"arxiv:{arxiv_id}")
+    pmid = (paper.get("pmid") or "").strip()
+    if pmid:
+        keys.append(f"pmid:{pmid}")
+    s2_id = (paper.get("s2_id") or "").strip()
+    if s2_id:
+        keys.append(f"s2:{s2_id}")
+    title = normalize_text(paper.get("title"))
+    if title:
+        if len(title.split()) < _MIN_TITLE_WORDS:
+            authors = paper.get("authors") or []
+            if not authors:
+                return keys
+            title = f"{title}|{normalize_author(authors[0])}"
+        keys.append(f"title:{title}")
+    return keys
+
+def paper_id(paper: dict) -> str:
+    if paper.get("paper_id"):
+        return paper["paper_id"]
+    keys = paper_keys(paper)
+    return keys[0] if keys else ""
+
+def _provenance(paper: dict) -> dict:
+    return {"source": paper.get("source", ""), "url": paper.get("url", "")}
+
+def _merge_into(record: dict, paper: dict):
+    if len(paper.get("abstract") or "") > len(record.get("abstract") or ""):
+        record["abstract"] = paper["abstract"]
+    if len(paper.get("authors") or []) > len(record.get("authors") or []):
+        record["authors"] = paper["authors"]
+    if len(paper.get("publication_date") or "") > len(record.get("publication_date") or ""):
+        record["publication_date"] = paper["publication_date"]
+    for field in ("title", "url") + ID_FIELDS:
+        if not record.get(field) and paper.get(field):
+            record[field] = paper[field]
+    for provenance in paper.get("sources") or [_provenance(paper)]:
+        if provenance not in record["sources"]:
+            record["sources"].append(provenance)
+
+def merge_records(existing: dict, paper: dict) -> dict:
+    record = dict(existing)
+    record["sources"] = list(existing.get("sources") or [_provenance(existing)])
+    _merge_into(record, paper)
+    return record
+
+class MergeIndex:
+    def __init__(self):
+        self.records = []
+        self._keys = {}
+
+    def add(self, paper: dict) -> tuple[int, bool]:
+        keys = paper_keys(paper)
+        index = next((self._keys[key] for key in keys if key in self._keys), None)
+        if index is None:
+            index = len(self.records)
+            record = dict(paper)
+            record["sources"] = list(paper.get("sources") or [_provenance(paper)])
+            record["paper_id"] = paper.get("paper_id") or (keys[0] if keys else "")
+            self.records.append(record)
+            is_new = True
+        else:
+            _merge_into(self.records[index], paper)
+            is_new = False
+        for key in keys:
+            self._keys.setdefault(key, index)
+        return index, is_new
+
+def merge_results(papers: list[dict]) -> list[dict]:
+    index = MergeIndex()
+    for paper in papers:
+        index.add(paper)
+    return index.records
@@ -0,0 +1,240 @@
+import os
+import sys
+import json
+import asyncio
+import hashlib
+import threading
+from contextlib import contextmanager
+import numpy as np
+from logger_config import logging
+from metrics import timing
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+EMBEDDING_DIR = os.getenv("EMBEDDING_DIR", "embeddings")
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "32"))
+RERANK_RESULTS = os.getenv("RERANK_RESULTS", "false").lower() in ("1", "true", "yes")
+
+_model = None
+_model_lock = threading.Lock()
+
+def get_model():
+    global _model
+    with _model_lock:
+        if _model is None:
+            try:
+                from sentence_transformers import SentenceTransformer
+                _model = SentenceTransformer(EMBEDDING_MODEL)
+            except Exception as e:
+                print(f"Failed to load {EMBEDDING_MODEL} embedding model: {e}", file=sys.stderr)
+                raise
+    return _model
+
+def encode(texts: list[str]) -> np.ndarray:
+    vectors = get_model().encode(
+        texts,
+        batch_size=EMBEDDING_BATCH_SIZE,
+        normalize_embeddings=True,
+        convert_to_numpy=True,
+        show_progress_bar=False
+    )
+    return np.asarray(vectors, dtype=np.float32)
+
+def warmup():
+    try:
+        encode(["Warm up the embedding model."])
+        logging.info(f"Embedding model {EMBEDDING_MODEL} warmed up")
+    except Exception as e:
+        logging.warning(f"Embedding model warmup failed: {e}")
+
+def paper_text(paper: dict) -> str:
+    return f"{paper.get('title') or ''}. {paper.get('abstract') or ''}".strip()
+
+def text_digest(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+class EmbeddingIndex:
+    # Row-major float32 matrix in vectors.f32, memory-mapped read-only and
+    # grown by appending; ids.txt holds the paper ID of each row in order and
+    # meta.json the model and dimension the rows were written with.
+    # Several processes may share the directory: appends are serialized with
+    # an exclusive lock on index.lock, and each process picks up rows the
+    # others appended by reading ids.txt on from where it last stopped.
+    # Vectors are always written before their IDs, so every complete line
+    # in ids.txt has its row.
+    def __init__(self, directory: str, model_name: str = EMBEDDING_MODEL):
+        self.directory = directory
+        self.model_name = model_name
+        self._vectors_path = os.path.join(directory, "vectors.f32")
+        self._ids_path = os.path.join(directory, "ids.txt")
+        self._meta_path = os.path.join(directory, "meta.json")
+        self._lock_path = os.path.join(directory, "index.lock")
+        self._lock = threading.Lock()
+        self._rows = None
+        self._ids = []
+        self._ids_offset = 0
+        self._matrix = None
+        self._dim = None
+
+    @contextmanager
+    def _file_lock(self):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self._lock_path, "a") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _read_meta(self) -> dict:
+        if not os.path.exists(self._meta_path):
+            return {}
+        with open(self._meta_path, encoding="utf-8") as f:
+            return json.load(f)
+
+    def _load(self):
+        if self._rows is not None:
+            return
+        self._rows = {}
+        meta = self._read_meta()
+        if meta and meta.get("model") != self.model_name:
+            with self._file_lock():
+                # Another process may already have rebuilt it for this model.
+                meta = self._read_meta()
+                if meta and meta.get("model") != self.model_name:
+                    logging.info(f"Embedding model changed to {self.model_name}, rebuilding index")
+                    for path in (self._vectors_path, self._ids_path, self._meta_path):
+                        if os.path.exists(path):
+                            os.remove(path)
+                    meta = {}
+        if meta:
+            self._dim = meta["dim"]
+        self._sync()
+
+    # Reads the ID lines appended since the last call. A line without its
+    # newline is still being written (or was cut short by a crash) and is
+    # left for later.
+    def _sync(self):
+        if self._dim is None:
+            meta = self._read_meta()
+            if not meta:
+                return
+            self._dim = meta["dim"]
+        if not os.path.exists(self._ids_path):
+            return
+        with open(self._ids_path, "rb") as f:
+            f.seek(self._ids_offset)
+            data = f.read()
+        end = data.rfind(b"\n") + 1
+        if not end:
+            return
+        self._ids_offset += end
+        for line in data[:end].decode("utf-8").split("\n")[:-1]:
+            pid, _, digest = line.partition("\t")
+            # A paper whose text changed is re-encoded into a new row; the
+            # old row stays in the file but is no longer pointed to.
+            self._rows[pid] = (len(self._ids), digest)
+            self._ids.append(pid)
+        self._remap()
+
+    def _remap(self):
+        self._matrix = None
+        if self._ids:
+            self._matrix = np.memmap(self._vectors_path, dtype=np.float32, mode="r", shape=(len(self._ids), self._dim))
+
+    def _append(self, entries: list[tuple[str, str]], vectors: np.ndarray):
+        with self._file_lock():
+            self._sync()
+            keep = [i for i, (pid, digest) in enumerate(entries) if self._rows.get(pid, (None, None))[1] != digest]
+            if not keep:
+                return
+            if self._dim is None:
+                self._dim = vectors.shape[1]
+                with open(self._meta_path, "w", encoding="utf-8") as f:
+                    json.dump({"model": self.model_name, "dim": self._dim}, f)
+            row_bytes = 4 * self._dim
+            # Rows past the last complete ID line belong to an append that
+            # never finished; they are written over rather than built upon.
+            with os.fdopen(os.open(self._vectors_path, os.O_RDWR | os.O_CREAT, 0o644), "r+b") as f:
+                f.seek(row_bytes * len(self._ids))
+                f.write(np.ascontiguousarray(vectors[keep], dtype=np.float32).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            with open(self._ids_path, "ab") as f:
+                if f.tell() != self._ids_offset:
+                    # Drop the tail of a line an earlier crash left unfinished.
+                    f.truncate(self._ids_offset)
+                f.write("".join(f"{entries[i][0]}\t{entries[i][1]}\n" for i in keep).encode("utf-8"))
+            self._sync()
+
+    def embed_papers(self, papers: list[dict]) -> np.ndarray:
+        with self._lock:
+            self._load()
+            self._sync()
+            digests = [text_digest(paper_text(p)) if p.get("paper_id") else None for p in papers]
+            missing = {}
+            for paper, digest in zip(papers, digests):
+                pid = paper.get("paper_id")
+                if digest is not None and pid not in missing and self._rows.get(pid, (None, None))[1] != digest:
+                    missing[pid] = (digest, paper)
+            if missing:
+                entries = [(pid, digest) for pid, (digest, _) in missing.items()]
+                self._append(entries, encode([paper_text(p) for _, p in missing.values()]))
+            # Papers without an ID, or whose row another process has just
+            # replaced with different text, are encoded without being stored.
+            direct = [
+                p for p, digest in zip(papers, digests)
+                if digest is None or self._rows[p["paper_id"]][1] != digest
+            ]
+            extra = iter(encode([paper_text(p) for p in direct])) if direct else iter(())
+            return np.stack([
+                self._matrix[self._rows[p["paper_id"]][0]]
+                if digest is not None and self._rows[p["paper_id"]][1] == digest else next(extra)
+                for p, digest in zip(papers, digests)
+            ])
+
+    def similar(self, paper_id: str, top_k: int) -> list[tuple[str, float]]:
+        with self._lock:
+            self._load()
+            self._sync()
+            row = self._rows.get(paper_id, (None, None))[0]
+            if row is None or self._matrix is None:
+                return []
+            scores = self._matrix @ self._matrix[row]
+            current = np.zeros(len(scores), dtype=bool)
+            current[[r for r, _ in self._rows.values()]] = True
+            scores[~current] = -np.inf
+            scores[row] = -np.inf
+            top_k = min(top_k, int(current.sum()) - 1)
+            if top_k <= 0:
+                return []
+            top = np.argpartition(-scores, top_k - 1)[:top_k]
+            top = top[np.argsort(-scores[top])]
+            return [(self._ids[i], float(scores[i])) for i in top]
+
+embedding_index = EmbeddingIndex(EMBEDDING_DIR)
+
+def _rerank(query: str, papers: list[dict]) -> list[dict]:
+    matrix = embedding_index.embed_papers(papers)
+    scores = matrix @ encode([query])[0]
+    order = np.argsort(-scores, kind="stable")
+    return [{**papers[i], "relevance": round(float(scores[i]), 4)} for i in order]
+
+async def rerank(query: str, papers: list[dict]) -> list[dict]:
+    if not papers:
+        return papers
+    try:
+        with timing("rerank"):
+            return await asyncio.to_thread(_rerank, query, papers)
+    except Exception as e:
+        logging.warning(f"Reranking failed, keeping provider order: {e}")
+        return papers
+
+async def similar_papers(paper_id: str, top_k: int = 10) -> list[tuple[str, float]]:
+    return await asyncio.to_thread(embedding_index.similar, paper_id, top_k)
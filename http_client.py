@@ -0,0 +1,58 @@
+import os
+from urllib.parse import urlsplit
+import httpx
+from logger_config import logging
+
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "20"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "10"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "15"))
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "false").lower() in ("1", "true", "yes")
+
+_clients: dict[str, httpx.AsyncClient] = {}
+
+def _http2_available():
+    if not HTTP2_ENABLED:
+        return False
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        logging.warning("HTTP2_ENABLED is set but the 'h2' package is not installed; using HTTP/1.1")
+        return False
+
+def _new_client():
+    limits = httpx.Limits(
+        max_connections=HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY
+    )
+    return httpx.AsyncClient(
+        limits=limits,
+        timeout=HTTP_TIMEOUT,
+        http2=_http2_available(),
+        follow_redirects=True
+    )
+
+def get_client(url: str) -> httpx.AsyncClient:
+    host = urlsplit(url).netloc
+    client = _clients.get(host)
+    if client is None or client.is_closed:
+        client = _new_client()
+        _clients[host] = client
+    return client
+
+async def startup():
+    logging.info(
+        f"HTTP transport ready (max_connections={HTTP_MAX_CONNECTIONS} per host, "
+        f"keepalive={HTTP_MAX_KEEPALIVE_CONNECTIONS}, http2={_http2_available()})"
+    )
+
+async def shutdown():
+    clients = list(_clients.values())
+    _clients.clear()
+    for client in clients:
+        try:
+            await client.aclose()
+        except Exception as e:
+            logging.warning(f"Error closing HTTP client: {e}")
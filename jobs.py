@@ -0,0 +1,336 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import re
+from cache import get_from_cache, set_to_cache, redis_available
+from logger_config import logging
+from metrics import JOBS_TOTAL, JOBS_QUEUED, JOBS_RUNNING, JOB_SECONDS
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_QUEUE_LIMIT = int(os.getenv("JOB_QUEUE_LIMIT", "100"))
+JOB_RESULT_TTL = int(os.getenv("JOB_RESULT_TTL", str(24 * 3600)))
+JOB_STORE = os.getenv("JOB_STORE", "disk")
+JOB_STORE_DIR = os.getenv("JOB_STORE_DIR", "jobs")
+
+PRIORITIES = {"high": 0, "normal": 1, "low": 2}
+FINISHED_STATES = ("succeeded", "failed", "cancelled")
+_JOB_ID = re.compile(r"[0-9a-f]{32}")
+
+class JobRejectedError(Exception):
+    pass
+
+# One JSON file per finished job. Files are replaced atomically and expire
+# by modification time.
+class DiskJobStore:
+    def __init__(self, path: str = JOB_STORE_DIR):
+        self.path = path
+
+    def _file(self, job_id: str) -> str:
+        return os.path.join(self.path, f"{job_id}.json")
+
+    def _read(self, job_id: str, ttl: int):
+        path = self._file(job_id)
+        try:
+            if os.path.getmtime(path) + ttl < time.time():
+                os.remove(path)
+                return None
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write(self, record: dict):
+        os.makedirs(self.path, exist_ok=True)
+        path = self._file(record["id"])
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(record, f)
+        os.replace(tmp, path)
+
+    def _sweep(self, ttl: int):
+        if not os.path.isdir(self.path):
+            return
+        cutoff = time.time() - ttl
+        for name in os.listdir(self.path):
+            path = os.path.join(self.path, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    async def get(self, job_id: str):
+        if not valid_job_id(job_id):
+            return None
+        return await asyncio.to_thread(self._read, job_id, JOB_RESULT_TTL)
+
+    async def put(self, record: dict, ttl: int):
+        await asyncio.to_thread(self._write, record)
+
+    async def sweep(self):
+        await asyncio.to_thread(self._sweep, JOB_RESULT_TTL)
+
+# Keeps finished jobs in Redis so replicas share them. The in-process tier
+# alone would drop a record after L1_CACHE_TTL, so while Redis is
+# unavailable records go to a DiskJobStore instead.
+class CacheJobStore:
+    def __init__(self):
+        self.fallback = DiskJobStore()
+
+    async def get(self, job_id: str):
+        record = await get_from_cache(f"job:{job_id}")
+        if record is None:
+            record = await self.fallback.get(job_id)
+        return record
+
+    async def put(self, record: dict, ttl: int):
+        if await redis_available():
+            await set_to_cache(f"job:{record['id']}", record, ttl)
+        else:
+            await self.fallback.put(record, ttl)
+
+    async def sweep(self):
+        await self.fallback.sweep()
+
+JOB_STORES = {
+    "cache": CacheJobStore,
+    "disk": DiskJobStore
+}
+
+def job_id(kind: str, params: dict) -> str:
+    canonical = json.dumps({"kind": kind, "params": params}, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:32]
+
+# IDs reach the store from clients and name files on disk, so only the
+# shape job_id() produces is accepted.
+def valid_job_id(value) -> bool:
+    return isinstance(value, str) and _JOB_ID.fullmatch(value) is not None
+
+class Job:
+    def __init__(self, job_id: str, kind: str, params: dict, priority: int):
+        self.id = job_id
+        self.kind = kind
+        self.params = params
+        self.priority = priority
+        self.state = "queued"
+        self.events = []
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.task = None
+        self._changed = asyncio.Event()
+
+    # Handlers report progress and partial results through emit(); pollers
+    # and streams read them back by sequence number.
+    def emit(self, event: dict):
+        self.events.append(event)
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def finish(self, state: str, result=None, error: str = None):
+        self.state = state
+        self.result = result
+        self.error = error
+        self.finished_at = time.time()
+        self.emit({"type": "state", "state": state})
+
+    def record(self) -> dict:
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "params": self.params,
+            "state": self.state,
+            "priority": next(name for name, value in PRIORITIES.items() if value == self.priority),
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "result": self.result,
+            "error": self.error
+        }
+
+# Runs registered long-running operations on a fixed number of worker tasks
+# fed from a priority queue. A job's ID is derived from its kind and
+# parameters, so submitting the same work again attaches to the queued,
+# running or stored job instead of recomputing it. Finished jobs are written
+# to the job store and dropped from memory.
+class JobManager:
+    def __init__(self, workers: int = JOB_WORKERS, queue_limit: int = JOB_QUEUE_LIMIT, store: str = JOB_STORE):
+        if store not in JOB_STORES:
+            raise ValueError(f"Unknown JOB_STORE {store!r}, expected one of {', '.join(JOB_STORES)}")
+        self.workers = max(1, workers)
+        self.queue_limit = queue_limit
+        self.store = JOB_STORES[store]()
+        self._handlers = {}
+        self._jobs = {}
+        self._queue = None
+        self._queued = 0
+        self._seq = 0
+        self._tasks = []
+
+    def register(self, kind: str, handler, defaults: dict):
+        self._handlers[kind] = (handler, defaults)
+
+    @property
+    def kinds(self) -> list[str]:
+        return list(self._handlers)
+
+    def start(self):
+        if self._tasks:
+            return
+        self._queue = asyncio.PriorityQueue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        if hasattr(self.store, "sweep"):
+            self._tasks.append(asyncio.create_task(self.store.sweep()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._jobs.clear()
+        self._queued = 0
+        JOBS_QUEUED.set(0)
+
+    def _params(self, kind: str, params: dict) -> dict:
+        handler = self._handlers.get(kind)
+        if handler is None:
+            raise ValueError(f"Unknown job kind {kind!r}, expected one of {', '.join(self._handlers)}")
+        defaults = handler[1]
+        unknown = set(params) - set(defaults)
+        if unknown:
+            raise ValueError(f"Unknown parameters for {kind}: {', '.join(sorted(unknown))}")
+        return {**defaults, **params}
+
+    # Low priority work only gets half of the queue so that it cannot crowd
+    # out interactive submissions.
+    def _admit(self, priority: int) -> bool:
+        limit = self.queue_limit if priority < PRIORITIES["low"] else self.queue_limit // 2
+        return self._queued < limit
+
+    async def submit(self, kind: str, params: dict, priority: str = "normal") -> dict:
+        if priority not in PRIORITIES:
+            raise ValueError(f"priority must be one of {', '.join(PRIORITIES)}")
+        params = self._params(kind, params)
+        jid = job_id(kind, params)
+        job = self._jobs.get(jid)
+        if job is None:
+            record = await self.store.get(jid)
+            if record is not None and record["state"] == "succeeded":
+                JOBS_TOTAL.labels(kind, "attached").inc()
+                return {"job_id": jid, "state": record["state"], "attached": True}
+            job = self._jobs.get(jid)
+        if job is not None:
+            JOBS_TOTAL.labels(kind, "attached").inc()
+            return {"job_id": jid, "state": job.state, "attached": True}
+        level = PRIORITIES[priority]
+        if not self._admit(level):
+            JOBS_TOTAL.labels(kind, "rejected").inc()
+            raise JobRejectedError(f"Job queue is full ({self._queued} jobs waiting), retry later")
+        self.start()
+        job = Job(jid, kind, params, level)
+        self._jobs[jid] = job
+        self._seq += 1
+        self._queue.put_nowait((level, self._seq, job))
+        self._queued += 1
+        JOBS_QUEUED.inc()
+        return {"job_id": jid, "state": job.state, "attached": False, "queue_position": self._queued}
+
+    async def get(self, jid: str, after: int = 0):
+        if not valid_job_id(jid):
+            return None
+        job = self._jobs.get(jid)
+        if job is not None:
+            return {**job.record(), "events": job.events[after:], "next": len(job.events)}
+        record = await self.store.get(jid)
+        if record is None:
+            return None
+        return {**record, "events": [], "next": after}
+
+    async def stream(self, jid: str, after: int = 0):
+        job = self._jobs.get(jid)
+        if job is None:
+            record = await self.store.get(jid) if valid_job_id(jid) else None
+            if record is None:
+                yield {"type": "error", "message": f"Unknown job {jid}"}
+            else:
+                yield {"type": "done", "job": record}
+            return
+        index = after
+        while True:
+            changed = job._changed
+            while index < len(job.events):
+                yield {"seq": index, **job.events[index]}
+                index += 1
+            if job.state in FINISHED_STATES:
+                yield {"type": "done", "job": job.record()}
+                return
+            await changed.wait()
+
+    async def cancel(self, jid: str) -> bool:
+        if not valid_job_id(jid):
+            return False
+        job = self._jobs.get(jid)
+        if job is None or job.state in FINISHED_STATES:
+            return False
+        if job.state == "queued":
+            self._queued -= 1
+            JOBS_QUEUED.dec()
+            await self._finish(job, "cancelled")
+        else:
+            job.task.cancel()
+        return True
+
+    async def _finish(self, job: Job, state: str, result=None, error: str = None):
+        job.finish(state, result, error)
+        JOBS_TOTAL.labels(job.kind, state).inc()
+        try:
+            await self.store.put(job.record(), JOB_RESULT_TTL)
+        except Exception as e:
+            logging.warning(f"Could not store job {job.id}: {e}")
+        self._jobs.pop(job.id, None)
+
+    async def _run(self, job: Job):
+        handler = self._handlers[job.kind][0]
+        job.state = "running"
+        job.started_at = time.time()
+        job.emit({"type": "state", "state": "running"})
+        JOBS_RUNNING.inc()
+        job.task = asyncio.create_task(handler(job.params, job))
+        try:
+            await asyncio.wait([job.task])
+        except asyncio.CancelledError:
+            job.task.cancel()
+            raise
+        finally:
+            JOBS_RUNNING.dec()
+            JOB_SECONDS.labels(job.kind).observe(time.time() - job.started_at)
+        if job.task.cancelled():
+            await self._finish(job, "cancelled")
+        elif job.task.exception() is not None:
+            await self._finish(job, "failed", error=str(job.task.exception()))
+        else:
+            result = job.task.result()
+            if isinstance(result, dict) and result.get("status") == "error":
+                await self._finish(job, "failed", error=result.get("message"))
+            else:
+                await self._finish(job, "succeeded", result)
+
+    async def _worker(self):
+        while True:
+            _, _, job = await self._queue.get()
+            if job.state != "queued":
+                continue
+            self._queued -= 1
+            JOBS_QUEUED.dec()
+            try:
+                await self._run(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Job {job.id} ({job.kind}) crashed: {e}")
+
+job_manager = JobManager()
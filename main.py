@@ -1,17 +1,49 @@
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
-from academic_search import search_arxiv, search_pubmed, search_semantic_scholar
-from summarizer import summarize_text
+from summarizer import summarize_text, summarize_long, get_scheduler, warmup, MAX_SYNTHESIS_PAPERS, MODEL_WARMUP
+from summarizer import shutdown as shutdown_summarizer
 import asyncio
-from cache import get_from_cache, set_to_cache
+import cache
+from pipeline import pipeline
+from retrieval import select_passages
+from paper_store import paper_store
+from citations import format_citation
 from logger_config import logging
+from contextlib import asynccontextmanager
+import http_client
+from metrics import install_http_metrics, install_executor
+from refresh import refresh_scheduler, CACHE_WARM_FILE
 from dotenv import load_dotenv
 load_dotenv()
 
+@asynccontextmanager
+async def lifespan(app):
+    install_executor()
+    await http_client.startup()
+    if MODEL_WARMUP:
+        get_scheduler()
+        asyncio.get_running_loop().run_in_executor(None, warmup)
+    refresh_scheduler.start()
+    warming = None
+    if CACHE_WARM_FILE:
+        warming = asyncio.create_task(refresh_scheduler.warm(CACHE_WARM_FILE, pipeline.search))
+    try:
+        yield
+    finally:
+        if warming is not None:
+            warming.cancel()
+        await refresh_scheduler.stop()
+        shutdown_summarizer()
+        await http_client.shutdown()
+        await cache.shutdown()
+        paper_store.close()
+
 app = FastAPI(
     title="AI-Driven Research Assistant MCP Server",
-    description="A prototype server for academic search and summarization."
+    description="A prototype server for academic search and summarization.",
+    lifespan=lifespan
 )
+install_http_metrics(app)
 
 class SearchQuery(BaseModel):
     query: str
@@ -50,44 +82,15 @@ async def root():
 @app.post("/search")
 async def search_endpoint(search_query: SearchQuery):
     logging.info(f"/search called with query='{search_query.query}', max_results={search_query.max_results}")
-    cache_key = f"search:{search_query.query}:{search_query.max_results}"
-    cached = get_from_cache(cache_key)
-    if cached is not None:
-        logging.info(f"Cache hit for key: {cache_key}")
-        return cached
-    logging.info(f"Cache miss for key: {cache_key}")
-    results = []
-    errors = []
-    tasks = []
-    loop = asyncio.get_event_loop()
-    def run_sync(func, *args, **kwargs):
-        return loop.run_in_executor(None, func, *args, **kwargs)
-    tasks.append(run_sync(search_arxiv, search_query.query, search_query.max_results))
-    tasks.append(run_sync(search_pubmed, search_query.query, search_query.max_results))
-    tasks.append(search_semantic_scholar(search_query.query, search_query.max_results))
-    results_list = await asyncio.gather(*tasks, return_exceptions=True)
-    for idx, res in enumerate(results_list):
-        if isinstance(res, Exception):
-            if idx == 0:
-                logging.warning(f"arXiv error: {res}")
-                errors.append(f"arXiv: {str(res)}")
-            elif idx == 1:
-                logging.warning(f"PubMed error: {res}")
-                errors.append(f"PubMed: {str(res)}")
-            elif idx == 2:
-                logging.warning(f"Semantic Scholar error: {res}")
-                errors.append(f"Semantic Scholar: {str(res)}")
-        else:
-            results.extend(res)
-    response = {"results": results, "errors": errors}
-    set_to_cache(cache_key, response, 3600)
-    return response
+    entry, cached = await pipeline.search_remote(search_query.query, search_query.max_results)
+    logging.info(f"Cache {'hit' if cached else 'miss'} for key: {pipeline.cache_key(search_query.query, search_query.max_results)}")
+    return {"results": entry["results"], "errors": entry["errors"]}
 
 @app.post("/summarize")
 async def summarize_endpoint(request: SummarizeRequest):
     logging.info("/summarize called.")
     try:
-        summary = summarize_text(request.text, max_length=request.max_length)
+        summary = await summarize_text(request.text, max_length=request.max_length)
         return {"summary": summary}
     except Exception as e:
         logging.error(f"Summarization error: {e}")
@@ -97,48 +100,23 @@ async def summarize_endpoint(request: SummarizeRequest):
 async def search_and_summarize_endpoint(request: SearchAndSummarizeRequest):
     logging.info(f"/search_and_summarize called with query='{request.query}', max_results={request.max_results}")
     try:
-        results = []
-        errors = []
-        loop = asyncio.get_event_loop()
-        def run_sync(func, *args, **kwargs):
-            return loop.run_in_executor(None, func, *args, **kwargs)
-        tasks = [
-            run_sync(search_arxiv, request.query, request.max_results),
-            run_sync(search_pubmed, request.query, request.max_results),
-            search_semantic_scholar(request.query, request.max_results)
-        ]
-        results_list = await asyncio.gather(*tasks, return_exceptions=True)
-        for idx, res in enumerate(results_list):
-            if isinstance(res, Exception):
-                if idx == 0:
-                    logging.warning(f"arXiv error: {res}")
-                    errors.append(f"arXiv: {str(res)}")
-                elif idx == 1:
-                    logging.warning(f"PubMed error: {res}")
-                    errors.append(f"PubMed: {str(res)}")
-                elif idx == 2:
-                    logging.warning(f"Semantic Scholar error: {res}")
-                    errors.append(f"Semantic Scholar: {str(res)}")
-            else:
-                results.extend(res)
+        entry, _ = await pipeline.search_remote(request.query, request.max_results)
+        results, failures = await pipeline.summarize(
+            entry["results"], request.summary_max_length, request.summary_min_length
+        )
         summarized = []
-        for entry in results:
-            try:
-                summary = summarize_text(
-                    entry["abstract"],
-                    max_length=request.summary_max_length,
-                    min_length=request.summary_min_length
-                )
-            except Exception as e:
-                logging.error(f"Summarization failed for paper '{entry['title']}': {e}")
-                summary = f"Summarization failed: {e}"
+        for index, paper in enumerate(results):
+            summary = paper.get("summary", "")
+            if index in failures:
+                logging.error(f"Summarization failed for paper '{paper['title']}': {failures[index]}")
+                summary = f"Summarization failed: {failures[index]}"
             summarized.append({
-                "source": entry["source"],
-                "title": entry["title"],
-                "original_abstract": entry["abstract"],
+                "source": paper["source"],
+                "title": paper["title"],
+                "original_abstract": paper["abstract"],
                 "summary": summary
             })
-        return {"results": summarized, "errors": errors}
+        return {"results": summarized, "errors": entry["errors"]}
     except Exception as e:
         logging.error(f"/search_and_summarize critical error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -149,13 +127,13 @@ async def synthesize_endpoint(request: SynthesizeRequest):
     try:
         if not request.papers:
             return {"synthesis": "No papers provided."}
-        combined_abstracts = "\n\n---\n\n".join([p.abstract for p in request.papers if p.abstract])
-        prompt = (
+        abstracts = [p.abstract for p in request.papers[:MAX_SYNTHESIS_PAPERS] if p.abstract]
+        prefix = (
             "Please provide a synthesis of the following research abstracts. "
             "Focus on the common themes, key findings, and any notable differences. "
-            f"Abstracts: {combined_abstracts}"
+            "Abstracts: "
         )
-        synthesis = summarize_text(prompt, max_length=300, min_length=100)
+        synthesis = await summarize_long(abstracts, max_length=300, min_length=100, prefix=prefix)
         return {"synthesis": synthesis}
     except Exception as e:
         logging.error(f"/synthesize error: {e}")
@@ -164,22 +142,7 @@ async def synthesize_endpoint(request: SynthesizeRequest):
 @app.post("/cite")
 async def cite_endpoint(paper: Paper):
     logging.info(f"/cite called for paper: {paper.title}")
-    # Simple APA formatting: Lastname, F. I., ... (Year). Title. Source.
-    authors = paper.authors
-    year = ""  # Try to extract year from publication_date
-    if paper.publication_date:
-        year = paper.publication_date[:4]
-    def format_author(name):
-        parts = name.split()
-        if not parts:
-            return ""
-        last = parts[-1]
-        initials = " ".join([p[0] + "." for p in parts[:-1] if p])
-        return f"{last}, {initials}" if initials else last
-    author_str = ", ".join([format_author(a) for a in authors])
-    citation = f"{author_str} ({year}). {paper.title}. {paper.source}."
-    # TODO: Use citeproc-py for more advanced citation formatting in the future.
-    return {"citation": citation}
+    return {"citation": format_citation(paper.model_dump(), "apa")}
 
 @app.post("/qa")
 async def qa_endpoint(request: QARequest):
@@ -187,14 +150,17 @@ async def qa_endpoint(request: QARequest):
     try:
         if not request.papers:
             return {"answer": "No papers provided."}
-        context = "\n\n---\n\n".join([p.abstract for p in request.papers if p.abstract])
-        prompt = (
+        prefix = (
             f"Answer the following question based only on the provided research abstracts. "
             f"If the answer is not present, say so.\n"
             f"Question: {request.question}\n"
-            f"Abstracts: {context}"
+            f"Abstracts: "
         )
-        answer = summarize_text(prompt, max_length=200, min_length=50)
+        papers = [p.model_dump() for p in request.papers]
+        passages = await select_passages(request.question, papers, prefix)
+        if not passages:
+            return {"answer": "No abstracts provided."}
+        answer = await summarize_long(passages, max_length=200, min_length=50, prefix=prefix)
         return {"answer": answer}
     except Exception as e:
         logging.error(f"/qa error: {e}")
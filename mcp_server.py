@@ -1,42 +1,160 @@
 import asyncio
 import os
+from contextlib import asynccontextmanager
 from fastmcp import FastMCP
 from fastapi import FastAPI
-from academic_search import search_arxiv, search_pubmed, search_semantic_scholar
-from summarizer import summarize_text
-from cache import get_from_cache, set_to_cache
+from fastapi.responses import StreamingResponse
+from academic_search import S2_PAPER_FIELDS, get_papers_details_semantic_scholar
+from summarizer import summarize_text, summarize_long, summary_cache_stats, MAX_SYNTHESIS_PAPERS, MODEL_WARMUP
+from summarizer import get_scheduler, warmup as warmup_summarizer, shutdown as shutdown_summarizer
+import cache
+import http_client
+from dedup import paper_id
+from resilience import call_provider
+from paper_store import paper_store, SEARCH_MODE
+from retrieval import select_passages, MAX_QA_PAPERS
+from embeddings import similar_papers as find_similar, RERANK_RESULTS, warmup as warmup_embeddings
+from streaming import stream_search, ndjson
+from refresh import refresh_scheduler, CACHE_WARM_FILE
+from pipeline import pipeline
+from jobs import job_manager, JobRejectedError
+from citations import format_citation, format_bibliography, stream_bibliography, media_type, STYLES, MAX_CITATION_PAPERS
+from metrics import instrument_tool, install_http_metrics, install_executor, with_timings
 
-mcp = FastMCP("research-assistant")
-app = FastAPI(title="Research Assistant Server", version="1.0.0")
+MAX_BATCH_QUERIES = int(os.getenv("MAX_BATCH_QUERIES", "100"))
+BATCH_PROVIDER_DEADLINE = float(os.getenv("BATCH_PROVIDER_DEADLINE_SECONDS", "60"))
+
+def _warmup():
+    warmup_summarizer()
+    if RERANK_RESULTS:
+        warmup_embeddings()
+
+@asynccontextmanager
+async def lifespan(server):
+    install_executor()
+    await http_client.startup()
+    if MODEL_WARMUP:
+        # Loads the models in the background; requests arriving meanwhile
+        # wait on the same load instead of starting another.
+        get_scheduler()
+        asyncio.get_running_loop().run_in_executor(None, _warmup)
+    refresh_scheduler.start()
+    job_manager.start()
+    warming = None
+    if CACHE_WARM_FILE:
+        warming = asyncio.create_task(refresh_scheduler.warm(CACHE_WARM_FILE, pipeline.search))
+    try:
+        yield
+    finally:
+        if warming is not None:
+            warming.cancel()
+        await refresh_scheduler.stop()
+        await job_manager.stop()
+        shutdown_summarizer()
+        await http_client.shutdown()
+        await cache.shutdown()
+        paper_store.close()
+
+mcp = FastMCP("research-assistant", lifespan=lifespan)
+app = FastAPI(title="Research Assistant Server", version="1.0.0", lifespan=lifespan)
+install_http_metrics(app)
 
 @mcp.tool()
-async def search(query: str, max_results: int = 5) -> dict:
+@instrument_tool
+async def search(query: str, max_results: int = 5, mode: str = SEARCH_MODE) -> dict:
     try:
-        cache_key = f"search:{query}:{max_results}"
-        cached_result = get_from_cache(cache_key)
-        if cached_result:
-            return {"status": "success", "results": cached_result, "source": "cache"}
-
-        tasks = [
-            search_arxiv(query, max_results),
-            search_pubmed(query, max_results),
-            search_semantic_scholar(query, max_results)
-        ]
-        
-        results_list = await asyncio.gather(*tasks, return_exceptions=True)
-        
-        all_results = []
-        for results in results_list:
-            if isinstance(results, list):
-                all_results.extend(results)
+        return await pipeline.search(query, max_results, mode)
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
+
+@mcp.tool()
+@instrument_tool
+async def batch_search(queries: list, max_results: int = 5, mode: str = SEARCH_MODE, summarize: bool = False,
+                       summary_max_length: int = 50, summary_min_length: int = 25) -> dict:
+    try:
+        unique_queries = list(dict.fromkeys(q.strip() for q in queries if isinstance(q, str) and q.strip()))
+        if not unique_queries:
+            return {"status": "error", "message": "At least one query is required"}
+        if len(unique_queries) > MAX_BATCH_QUERIES:
+            return {"status": "error", "message": f"At most {MAX_BATCH_QUERIES} distinct queries per batch"}
+        outcomes = await asyncio.gather(
+            *(pipeline.search(q, max_results, mode, BATCH_PROVIDER_DEADLINE) for q in unique_queries),
+            return_exceptions=True
+        )
+        papers = {}
+        results = {}
+        for query, outcome in zip(unique_queries, outcomes):
+            if isinstance(outcome, Exception):
+                outcome = {"status": "error", "message": str(outcome)}
+            if outcome["status"] != "success":
+                results[query] = outcome
+                continue
+            paper_ids = []
+            scores = []
+            for index, paper in enumerate(outcome["results"]):
+                pid = paper_id(paper)
+                if not pid:
+                    # Papers with no DOI, provider ID or title get an ID of
+                    # their own rather than sharing the empty key.
+                    pid = f"{paper.get('source') or 'unknown'}:{len(results)}:{index}"
+                if pid not in papers:
+                    papers[pid] = {k: v for k, v in paper.items() if k != "relevance"}
+                paper_ids.append(pid)
+                scores.append(paper.get("relevance"))
+            entry = {"status": "success", "paper_ids": paper_ids, "source": outcome["source"]}
+            if any(score is not None for score in scores):
+                entry["relevance"] = scores
+            if outcome.get("errors"):
+                entry["errors"] = outcome["errors"]
+            results[query] = entry
         
-        set_to_cache(cache_key, all_results)
+        if summarize:
+            summarized, _ = await pipeline.summarize(list(papers.values()), summary_max_length, summary_min_length)
+            papers = dict(zip(papers, summarized))
         
-        return {"status": "success", "results": all_results, "source": "live"}
+        return {
+            "status": "success",
+            "results": results,
+            "papers": papers
+        }
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
+
+@mcp.tool()
+@instrument_tool
+async def similar_papers(paper_id: str, top_k: int = 10) -> dict:
+    try:
+        matches = await find_similar(paper_id, top_k)
+        papers = await paper_store.get([pid for pid, _ in matches])
+        results = [
+            {**papers[pid], "similarity": round(score, 4)}
+            for pid, score in matches if pid in papers
+        ]
+        return {"status": "success", "paper_id": paper_id, "results": results}
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
 @mcp.tool()
+@instrument_tool
+async def paper_details(paper_ids: list, fields: str = S2_PAPER_FIELDS) -> dict:
+    try:
+        if not paper_ids:
+            return {"status": "error", "message": "At least one paper ID is required"}
+        details = await call_provider(
+            "Semantic Scholar",
+            lambda: get_papers_details_semantic_scholar([str(pid) for pid in paper_ids], fields),
+            BATCH_PROVIDER_DEADLINE
+        )
+        return {
+            "status": "success",
+            "papers": {pid: paper for pid, paper in details.items() if paper is not None},
+            "not_found": [pid for pid, paper in details.items() if paper is None]
+        }
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
+
+@mcp.tool()
+@instrument_tool
 async def summarize(text: str, max_length: int = 150) -> dict:
     try:
         summary = await summarize_text(text, max_length=max_length)
@@ -45,38 +163,32 @@ async def summarize(text: str, max_length: int = 150) -> dict:
         return {"status": "error", "message": str(e)}
 
 @mcp.tool()
+@instrument_tool
 async def search_and_summarize(query: str, max_results: int = 5, summary_max_length: int = 50, summary_min_length: int = 25) -> dict:
     try:
-        search_result = await search(query, max_results)
+        search_result = await pipeline.search(query, max_results, SEARCH_MODE)
         if search_result["status"] != "success":
             return search_result
         
-        papers = search_result["results"]
-        
-        summarized_papers = []
-        for paper in papers:
-            if "abstract" in paper and paper["abstract"]:
-                summary_result = await summarize(paper["abstract"], summary_max_length)
-                if summary_result["status"] == "success":
-                    paper["summary"] = summary_result["summary"]
-            summarized_papers.append(paper)
+        papers, _ = await pipeline.summarize(search_result["results"], summary_max_length, summary_min_length)
         
-        return {"status": "success", "results": summarized_papers}
+        return {"status": "success", "results": papers}
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
 @mcp.tool()
+@instrument_tool
 async def synthesize(papers: list) -> dict:
     try:
         if not papers:
             return {"status": "error", "message": "No papers provided for synthesis"}
         
-        combined_text = "\n\n".join([
+        texts = [
             f"Paper: {paper.get('title', 'Unknown')}\nAbstract: {paper.get('abstract', 'No abstract available')}"
-            for paper in papers[:5]
-        ])
+            for paper in papers[:MAX_SYNTHESIS_PAPERS]
+        ]
         
-        synthesis = await summarize_text(combined_text, max_length=300)
+        synthesis = await summarize_long(texts, max_length=300)
         
         return {
             "status": "success",
@@ -87,46 +199,133 @@ async def synthesize(papers: list) -> dict:
         return {"status": "error", "message": str(e)}
 
 @mcp.tool()
-async def cite(paper: dict) -> dict:
+@instrument_tool
+async def cite(paper: dict, style: str = "apa") -> dict:
     try:
-        title = paper.get("title", "Unknown Title")
-        authors = paper.get("authors", ["Unknown Author"])
-        year = paper.get("year", "Unknown Year")
-        source = paper.get("source", "Unknown Source")
-        
-        author_str = ", ".join(authors[:3])
-        if len(authors) > 3:
-            author_str += ", et al."
-        
-        citation = f"{author_str} ({year}). {title}. {source}."
-        
-        return {"status": "success", "citation": citation}
+        return {"status": "success", "style": style, "citation": format_citation(paper, style)}
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
+async def _citation_papers(papers: list, paper_ids: list) -> tuple[list, list]:
+    # Papers can be given inline, by the IDs search results carry, or both.
+    papers = list(papers or [])
+    not_found = []
+    if paper_ids:
+        stored = await paper_store.get([str(pid) for pid in paper_ids])
+        for pid in paper_ids:
+            if str(pid) in stored:
+                papers.append(stored[str(pid)])
+            else:
+                not_found.append(pid)
+    return papers, not_found
+
 @mcp.tool()
+@instrument_tool
+async def cite_papers(papers: list = None, paper_ids: list = None, style: str = "apa") -> dict:
+    try:
+        if style not in STYLES:
+            return {"status": "error", "message": f"style must be one of {', '.join(STYLES)}"}
+        papers, not_found = await _citation_papers(papers, paper_ids)
+        if not papers:
+            return {"status": "error", "message": "No papers to cite", "not_found": not_found}
+        if len(papers) > MAX_CITATION_PAPERS:
+            return {"status": "error", "message": f"At most {MAX_CITATION_PAPERS} papers can be cited at once"}
+        return {
+            "status": "success",
+            "style": style,
+            "citations": format_bibliography(papers, style),
+            "not_found": not_found
+        }
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
+
+@mcp.tool()
+@instrument_tool
 async def qa(papers: list, question: str) -> dict:
     try:
         if not papers or not question:
             return {"status": "error", "message": "Papers and question are required"}
         
-        context = "\n\n".join([
-            f"Title: {paper.get('title', 'Unknown')}\nAbstract: {paper.get('abstract', 'No abstract')}"
-            for paper in papers[:3]
-        ])
+        used = papers[:MAX_QA_PAPERS]
+        prefix = f"Question: {question}\n\nContext:\n"
+        suffix = "\n\nBased on the context above, provide a concise answer:"
+        passages = await select_passages(question, used, prefix, suffix)
+        if not passages:
+            return {"status": "error", "message": "No abstracts available to answer from"}
         
-        prompt = f"Question: {question}\n\nContext:\n{context}\n\nBased on the context above, provide a concise answer:"
-        answer = await summarize_text(prompt, max_length=200)
+        answer = await summarize_long(passages, max_length=200, prefix=prefix, suffix=suffix)
         
         return {
             "status": "success",
             "question": question,
             "answer": answer,
-            "papers_used": len(papers[:3])
+            "papers_used": len(used),
+            "passages_used": len(passages)
         }
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
+async def _search_and_summarize_job(params: dict, job) -> dict:
+    search_result = await pipeline.search(params["query"], params["max_results"], params["mode"])
+    if search_result["status"] != "success":
+        return search_result
+    job.emit({"type": "results", "source": search_result["source"], "results": search_result["results"]})
+
+    def on_summary(index: int, summary: str, error: Exception):
+        if error is None:
+            job.emit({"type": "summary", "index": index, "summary": summary})
+        else:
+            job.emit({"type": "summary", "index": index, "error": str(error)})
+
+    papers, _ = await pipeline.summarize(
+        search_result["results"], params["summary_max_length"], params["summary_min_length"], on_summary
+    )
+    return {"status": "success", "results": papers}
+
+async def _synthesize_job(params: dict, job) -> dict:
+    return await synthesize(params["papers"])
+
+async def _qa_job(params: dict, job) -> dict:
+    return await qa(params["papers"], params["question"])
+
+job_manager.register("search_and_summarize", _search_and_summarize_job, {
+    "query": "", "max_results": 5, "mode": SEARCH_MODE, "summary_max_length": 50, "summary_min_length": 25
+})
+job_manager.register("synthesize", _synthesize_job, {"papers": []})
+job_manager.register("qa", _qa_job, {"papers": [], "question": ""})
+
+@mcp.tool()
+@instrument_tool
+async def submit_job(kind: str, params: dict = None, priority: str = "normal") -> dict:
+    try:
+        submitted = await job_manager.submit(kind, params or {}, priority)
+        return {"status": "success", **submitted}
+    except JobRejectedError as e:
+        return {"status": "error", "message": str(e), "rejected": True}
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
+
+@mcp.tool()
+@instrument_tool
+async def job_status(job_id: str, after: int = 0) -> dict:
+    try:
+        job = await job_manager.get(job_id, after)
+        if job is None:
+            return {"status": "error", "message": f"Unknown or expired job {job_id}"}
+        return {"status": "success", "job": job}
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
+
+@mcp.tool()
+@instrument_tool
+async def cancel_job(job_id: str) -> dict:
+    try:
+        if not await job_manager.cancel(job_id):
+            return {"status": "error", "message": f"Job {job_id} is not queued or running"}
+        return {"status": "success", "job_id": job_id}
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
+
 @app.get("/")
 async def root():
     return {
@@ -138,50 +337,133 @@ async def root():
             "search": "/api/search",
             "summarize": "/api/summarize",
             "search_and_summarize": "/api/search_and_summarize",
+            "batch_search": "/api/batch_search",
+            "search_stream": "/api/search/stream",
+            "search_and_summarize_stream": "/api/search_and_summarize/stream",
             "synthesize": "/api/synthesize",
+            "similar": "/api/similar",
+            "paper_details": "/api/paper_details",
             "cite": "/api/cite",
-            "qa": "/api/qa"
+            "citations": "/api/citations",
+            "qa": "/api/qa",
+            "jobs": "/api/jobs",
+            "metrics": "/metrics"
         }
     }
 
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy", "service": "research-assistant"}
+    return {"status": "healthy", "service": "research-assistant", "summary_cache": summary_cache_stats}
 
 @app.post("/api/search")
 async def api_search(request: dict):
     query = request.get("query", "")
     max_results = request.get("max_results", 5)
-    return await search(query, max_results)
+    mode = request.get("mode", SEARCH_MODE)
+    return await with_timings(request.get("timings", False), search(query, max_results, mode))
 
 @app.post("/api/summarize")
 async def api_summarize(request: dict):
     text = request.get("text", "")
     max_length = request.get("max_length", 150)
-    return await summarize(text, max_length)
+    return await with_timings(request.get("timings", False), summarize(text, max_length))
 
 @app.post("/api/search_and_summarize")
 async def api_search_and_summarize(request: dict):
     query = request.get("query", "")
     max_results = request.get("max_results", 5)
     summary_max_length = request.get("summary_max_length", 50)
-    return await search_and_summarize(query, max_results, summary_max_length)
+    return await with_timings(request.get("timings", False), search_and_summarize(query, max_results, summary_max_length))
+
+@app.post("/api/batch_search")
+async def api_batch_search(request: dict):
+    queries = request.get("queries", [])
+    max_results = request.get("max_results", 5)
+    mode = request.get("mode", SEARCH_MODE)
+    summarize = request.get("summarize", False)
+    summary_max_length = request.get("summary_max_length", 50)
+    summary_min_length = request.get("summary_min_length", 25)
+    return await with_timings(request.get("timings", False), batch_search(queries, max_results, mode, summarize, summary_max_length, summary_min_length))
+
+@app.post("/api/search/stream")
+async def api_search_stream(request: dict):
+    query = request.get("query", "")
+    max_results = request.get("max_results", 5)
+    mode = request.get("mode", SEARCH_MODE)
+    events = stream_search(query, max_results, mode=mode)
+    return StreamingResponse(ndjson(events), media_type="application/x-ndjson")
+
+@app.post("/api/search_and_summarize/stream")
+async def api_search_and_summarize_stream(request: dict):
+    query = request.get("query", "")
+    max_results = request.get("max_results", 5)
+    summary_max_length = request.get("summary_max_length", 50)
+    summary_min_length = request.get("summary_min_length", 25)
+    mode = request.get("mode", SEARCH_MODE)
+    events = stream_search(query, max_results, summarize=True,
+                           summary_max_length=summary_max_length, summary_min_length=summary_min_length, mode=mode)
+    return StreamingResponse(ndjson(events), media_type="application/x-ndjson")
 
 @app.post("/api/synthesize")
 async def api_synthesize(request: dict):
     papers = request.get("papers", [])
-    return await synthesize(papers)
+    return await with_timings(request.get("timings", False), synthesize(papers))
+
+@app.post("/api/similar")
+async def api_similar(request: dict):
+    paper_id = request.get("paper_id", "")
+    top_k = request.get("top_k", 10)
+    return await with_timings(request.get("timings", False), similar_papers(paper_id, top_k))
+
+@app.post("/api/paper_details")
+async def api_paper_details(request: dict):
+    paper_ids = request.get("paper_ids", [])
+    fields = request.get("fields", S2_PAPER_FIELDS)
+    return await with_timings(request.get("timings", False), paper_details(paper_ids, fields))
 
 @app.post("/api/cite")
 async def api_cite(request: dict):
     paper = request.get("paper", {})
-    return await cite(paper)
+    style = request.get("style", "apa")
+    return await cite(paper, style)
+
+@app.post("/api/citations")
+async def api_citations(request: dict):
+    papers = request.get("papers", [])
+    paper_ids = request.get("paper_ids", [])
+    style = request.get("style", "apa")
+    if not request.get("stream", False):
+        return await with_timings(request.get("timings", False), cite_papers(papers, paper_ids, style))
+    if style not in STYLES:
+        return {"status": "error", "message": f"style must be one of {', '.join(STYLES)}"}
+    # Streamed exports skip IDs that are not in the paper store and have no size cap.
+    papers, _ = await _citation_papers(papers, paper_ids)
+    return StreamingResponse(stream_bibliography(papers, style), media_type=media_type(style))
 
 @app.post("/api/qa")
 async def api_qa(request: dict):
     papers = request.get("papers", [])
     question = request.get("question", "")
-    return await qa(papers, question)
+    return await with_timings(request.get("timings", False), qa(papers, question))
+
+@app.post("/api/jobs")
+async def api_submit_job(request: dict):
+    kind = request.get("kind", "")
+    params = request.get("params", {})
+    priority = request.get("priority", "normal")
+    return await submit_job(kind, params, priority)
+
+@app.get("/api/jobs/{job_id}")
+async def api_job_status(job_id: str, after: int = 0):
+    return await job_status(job_id, after)
+
+@app.get("/api/jobs/{job_id}/stream")
+async def api_job_stream(job_id: str, after: int = 0):
+    return StreamingResponse(ndjson(job_manager.stream(job_id, after)), media_type="application/x-ndjson")
+
+@app.post("/api/jobs/{job_id}/cancel")
+async def api_cancel_job(job_id: str):
+    return await cancel_job(job_id)
 
 if __name__ == "__main__":
     port = os.getenv("PORT")
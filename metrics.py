@@ -0,0 +1,177 @@
+import os
+import time
+import asyncio
+import functools
+import contextvars
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from fastapi.responses import Response
+from logger_config import logging
+
+try:
+    import prometheus_client
+except ImportError:
+    prometheus_client = None
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+EXECUTOR_MAX_WORKERS = int(os.getenv("EXECUTOR_MAX_WORKERS", str(min(32, (os.cpu_count() or 1) + 4))))
+
+_FAST_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+_SLOW_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+_TOKEN_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25)
+_BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+class _NoopMetric:
+    def labels(self, *args, **kwargs):
+        return self
+
+    def observe(self, value):
+        pass
+
+    def inc(self, amount=1):
+        pass
+
+    def dec(self, amount=1):
+        pass
+
+    def set(self, value):
+        pass
+
+def _metric(kind: str, name: str, documentation: str, labels=(), **kwargs):
+    if prometheus_client is None or not METRICS_ENABLED:
+        return _NoopMetric()
+    return getattr(prometheus_client, kind)(name, documentation, labels, **kwargs)
+
+PROVIDER_LATENCY = _metric("Histogram", "research_provider_request_seconds",
+                           "Upstream provider call latency, including retries and hedges",
+                           ("provider", "outcome"), buckets=_SLOW_BUCKETS)
+PROVIDER_ERRORS = _metric("Counter", "research_provider_errors_total",
+                          "Failed upstream provider calls", ("provider", "kind"))
+CACHE_REQUESTS = _metric("Counter", "research_cache_requests_total",
+                         "Cache lookups per tier and result", ("tier", "result"))
+CACHE_REFRESHES = _metric("Counter", "research_cache_refreshes_total",
+                          "Background cache refreshes by trigger (stale, ahead) and outcome", ("trigger", "outcome"))
+CACHE_LATENCY = _metric("Histogram", "research_cache_operation_seconds",
+                        "Cache operation latency per tier", ("tier", "operation"), buckets=_FAST_BUCKETS)
+SUMMARIZER_QUEUE_DEPTH = _metric("Gauge", "research_summarizer_queue_depth",
+                                 "Summaries waiting to be batched")
+SUMMARIZER_BATCH_SIZE = _metric("Histogram", "research_summarizer_batch_size",
+                                "Texts per summarization forward pass", buckets=_BATCH_BUCKETS)
+SUMMARIZER_BATCH_SECONDS = _metric("Histogram", "research_summarizer_batch_seconds",
+                                   "Summarization forward pass latency", buckets=_SLOW_BUCKETS)
+SUMMARIZER_TOKEN_SECONDS = _metric("Histogram", "research_summarizer_seconds_per_token",
+                                   "Summarization time per generated token", buckets=_TOKEN_BUCKETS)
+SUMMARY_WORKERS_READY = _metric("Gauge", "research_summary_workers_ready", "Summary worker processes with a loaded model")
+SUMMARY_WORKER_RESTARTS = _metric("Counter", "research_summary_worker_restarts_total", "Summary worker processes restarted after exiting")
+JOBS_TOTAL = _metric("Counter", "research_jobs_total",
+                     "Job submissions and outcomes (attached, rejected, succeeded, failed, cancelled)", ("kind", "outcome"))
+JOBS_QUEUED = _metric("Gauge", "research_jobs_queued", "Jobs waiting for a job worker")
+JOBS_RUNNING = _metric("Gauge", "research_jobs_running", "Jobs being run")
+JOB_SECONDS = _metric("Histogram", "research_job_seconds", "Job run time", ("kind",), buckets=_SLOW_BUCKETS + (300.0, 600.0, 1800.0))
+EXECUTOR_ACTIVE = _metric("Gauge", "research_executor_active_tasks", "Executor threads running a task")
+EXECUTOR_QUEUED = _metric("Gauge", "research_executor_queued_tasks", "Tasks waiting for an executor thread")
+EXECUTOR_WORKERS = _metric("Gauge", "research_executor_max_workers", "Executor thread pool size")
+EXECUTOR_WAIT = _metric("Histogram", "research_executor_queue_wait_seconds",
+                        "Time tasks wait for an executor thread", buckets=_FAST_BUCKETS + (2.5, 5.0, 10.0, 30.0))
+TOOL_LATENCY = _metric("Histogram", "research_tool_seconds",
+                       "MCP tool latency", ("tool", "status"), buckets=_SLOW_BUCKETS)
+HTTP_LATENCY = _metric("Histogram", "research_http_request_seconds",
+                       "HTTP route latency (streaming routes up to the first byte)",
+                       ("method", "route", "status"), buckets=_SLOW_BUCKETS)
+
+# Per-request breakdown of where time went, in milliseconds per stage. It is
+# only collected inside record_timings(); tasks spawned by the request share
+# the same dict through their copied context.
+_timings = contextvars.ContextVar("request_timings", default=None)
+
+def add_timing(stage: str, seconds: float):
+    timings = _timings.get()
+    if timings is not None:
+        timings[stage] = round(timings.get(stage, 0.0) + seconds * 1000, 2)
+
+@contextmanager
+def timing(stage: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_timing(stage, time.perf_counter() - started)
+
+@contextmanager
+def record_timings():
+    timings = {}
+    token = _timings.set(timings)
+    started = time.perf_counter()
+    try:
+        yield timings
+    finally:
+        _timings.reset(token)
+        timings["total"] = round((time.perf_counter() - started) * 1000, 2)
+
+async def with_timings(enabled: bool, call):
+    if not enabled:
+        return await call
+    with record_timings() as timings:
+        result = await call
+    if isinstance(result, dict):
+        result = {**result, "timings_ms": timings}
+    return result
+
+def instrument_tool(fn):
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        status = "error"
+        try:
+            result = await fn(*args, **kwargs)
+            if isinstance(result, dict):
+                status = result.get("status", "success")
+            return result
+        finally:
+            TOOL_LATENCY.labels(fn.__name__, status).observe(time.perf_counter() - started)
+    return wrapper
+
+def install_http_metrics(app):
+    @app.middleware("http")
+    async def observe_route(request, call_next):
+        started = time.perf_counter()
+        status = 500
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            return response
+        finally:
+            route = request.scope.get("route")
+            HTTP_LATENCY.labels(
+                request.method, getattr(route, "path", "unmatched"), str(status)
+            ).observe(time.perf_counter() - started)
+
+    @app.get("/metrics", include_in_schema=False)
+    async def metrics_endpoint():
+        if prometheus_client is None or not METRICS_ENABLED:
+            return Response("metrics disabled\n", status_code=503, media_type="text/plain")
+        return Response(prometheus_client.generate_latest(), media_type=prometheus_client.CONTENT_TYPE_LATEST)
+
+class InstrumentedExecutor(ThreadPoolExecutor):
+    def submit(self, fn, /, *args, **kwargs):
+        queued_at = time.perf_counter()
+        EXECUTOR_QUEUED.inc()
+
+        def run():
+            EXECUTOR_QUEUED.dec()
+            EXECUTOR_ACTIVE.inc()
+            EXECUTOR_WAIT.observe(time.perf_counter() - queued_at)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                EXECUTOR_ACTIVE.dec()
+        return super().submit(run)
+
+def install_executor():
+    # run_in_executor(None, ...) and asyncio.to_thread both use the loop's
+    # default executor, so replacing it covers every blocking call we make.
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(InstrumentedExecutor(max_workers=EXECUTOR_MAX_WORKERS, thread_name_prefix="research"))
+    EXECUTOR_WORKERS.set(EXECUTOR_MAX_WORKERS)
+    if prometheus_client is None and METRICS_ENABLED:
+        logging.warning("prometheus_client is not installed; /metrics is disabled")
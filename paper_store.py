@@ -0,0 +1,168 @@
+import os
+import re
+import json
+import time
+import asyncio
+import sqlite3
+import threading
+from dedup import paper_keys, paper_id, merge_records
+from logger_config import logging
+from metrics import timing
+
+PAPER_STORE_PATH = os.getenv("PAPER_STORE_PATH", "papers.db")
+SEARCH_MODE = os.getenv("SEARCH_MODE", "remote")
+SEARCH_MODES = ("local", "local-then-remote", "remote")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS papers (
+    rowid INTEGER PRIMARY KEY,
+    id TEXT NOT NULL UNIQUE,
+    title TEXT NOT NULL DEFAULT '',
+    abstract TEXT NOT NULL DEFAULT '',
+    data TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS paper_keys (
+    key TEXT PRIMARY KEY,
+    paper_id TEXT NOT NULL
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS papers_fts USING fts5(
+    title, abstract, content='papers', content_rowid='rowid'
+);
+CREATE TRIGGER IF NOT EXISTS papers_ai AFTER INSERT ON papers BEGIN
+    INSERT INTO papers_fts(rowid, title, abstract) VALUES (new.rowid, new.title, new.abstract);
+END;
+CREATE TRIGGER IF NOT EXISTS papers_ad AFTER DELETE ON papers BEGIN
+    INSERT INTO papers_fts(papers_fts, rowid, title, abstract) VALUES ('delete', old.rowid, old.title, old.abstract);
+END;
+CREATE TRIGGER IF NOT EXISTS papers_au AFTER UPDATE ON papers BEGIN
+    INSERT INTO papers_fts(papers_fts, rowid, title, abstract) VALUES ('delete', old.rowid, old.title, old.abstract);
+    INSERT INTO papers_fts(rowid, title, abstract) VALUES (new.rowid, new.title, new.abstract);
+END;
+"""
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+# arXiv-style field prefixes ("all:", "ti:") and boolean operators are not
+# meaningful to FTS5, so only the plain terms of a query are matched.
+_IGNORED_TERMS = {"and", "or", "not", "andnot", "all", "ti", "au", "abs"}
+
+class PaperStore:
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = None
+        self._lock = threading.Lock()
+        self._disabled = False
+
+    def _connect(self):
+        if self._conn is None and not self._disabled:
+            try:
+                conn = sqlite3.connect(self.path, check_same_thread=False)
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=NORMAL")
+                conn.executescript(_SCHEMA)
+                self._conn = conn
+            except sqlite3.Error as e:
+                logging.warning(f"Paper store disabled, could not open {self.path}: {e}")
+                self._disabled = True
+        return self._conn
+
+    # A paper is filed under the ID of the stored row that already holds one
+    # of its keys, checked in key order (DOI first), so a paper keeps one ID
+    # however much each provider knows about it. Returns the ID each paper
+    # was stored under ("" when it has no keys) without touching the input.
+    def _upsert(self, papers: list[dict]) -> list[str]:
+        conn = self._connect()
+        if conn is None:
+            return [paper.get("paper_id") or "" for paper in papers]
+        now = time.time()
+        ids = []
+        with self._lock, conn:
+            for paper in papers:
+                keys = paper_keys(paper)
+                existing_id = None
+                if keys:
+                    placeholders = ",".join("?" * len(keys))
+                    found = dict(conn.execute(
+                        f"SELECT key, paper_id FROM paper_keys WHERE key IN ({placeholders})", keys
+                    ).fetchall())
+                    existing_id = next((found[key] for key in keys if key in found), None)
+                pid = existing_id or paper_id(paper)
+                ids.append(pid)
+                if not pid:
+                    continue
+                record = {**paper, "paper_id": pid}
+                if existing_id:
+                    row = conn.execute("SELECT data FROM papers WHERE id = ?", (pid,)).fetchone()
+                    if row:
+                        record = merge_records(json.loads(row[0]), record)
+                        record["paper_id"] = pid
+                conn.execute(
+                    "INSERT INTO papers (id, title, abstract, data, updated_at) VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT(id) DO UPDATE SET title=excluded.title, abstract=excluded.abstract, "
+                    "data=excluded.data, updated_at=excluded.updated_at",
+                    (pid, record.get("title") or "", record.get("abstract") or "", json.dumps(record), now)
+                )
+                conn.executemany(
+                    "INSERT OR IGNORE INTO paper_keys (key, paper_id) VALUES (?, ?)",
+                    [(key, pid) for key in keys]
+                )
+        return ids
+
+    def _search(self, query: str, limit: int) -> list[dict]:
+        conn = self._connect()
+        if conn is None:
+            return []
+        terms = [t for t in _WORD.findall(query.lower()) if t not in _IGNORED_TERMS]
+        if not terms:
+            return []
+        match = " ".join(f'"{term}"' for term in terms)
+        with self._lock:
+            rows = conn.execute(
+                "SELECT p.data FROM papers_fts JOIN papers p ON p.rowid = papers_fts.rowid "
+                "WHERE papers_fts MATCH ? ORDER BY bm25(papers_fts) LIMIT ?",
+                (match, limit)
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def _get(self, ids: list[str]) -> dict:
+        conn = self._connect()
+        if conn is None or not ids:
+            return {}
+        placeholders = ",".join("?" * len(ids))
+        with self._lock:
+            rows = conn.execute(f"SELECT id, data FROM papers WHERE id IN ({placeholders})", ids).fetchall()
+        return {pid: json.loads(data) for pid, data in rows}
+
+    async def upsert(self, papers: list[dict]) -> list[str]:
+        if not papers:
+            return []
+        try:
+            with timing("store"):
+                return await asyncio.to_thread(self._upsert, papers)
+        except sqlite3.Error as e:
+            logging.warning(f"Paper store upsert failed: {e}")
+            return [paper.get("paper_id") or "" for paper in papers]
+
+    async def search(self, query: str, limit: int) -> list[dict]:
+        try:
+            with timing("store"):
+                return await asyncio.to_thread(self._search, query, limit)
+        except sqlite3.Error as e:
+            logging.warning(f"Paper store search failed: {e}")
+            return []
+
+    async def get(self, ids: list[str]) -> dict:
+        try:
+            with timing("store"):
+                return await asyncio.to_thread(self._get, ids)
+        except sqlite3.Error as e:
+            logging.warning(f"Paper store lookup failed: {e}")
+            return {}
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+paper_store = PaperStore(PAPER_STORE_PATH)
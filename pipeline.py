@@ -0,0 +1,200 @@
+import os
+import asyncio
+from contextlib import asynccontextmanager
+from academic_search import PROVIDERS
+from cache import get_or_fetch, set_to_cache
+from dedup import merge_results
+from embeddings import rerank, RERANK_RESULTS
+from paper_store import paper_store, SEARCH_MODES
+from refresh import refresh_scheduler, SEARCH_STALE_TTL
+from resilience import call_provider, PARTIAL_RESULT_TTL, PROVIDER_DEADLINE
+from summarizer import summarize_text, summarize_many
+from logger_config import logging
+
+SEARCH_CACHE_TTL = int(os.getenv("SEARCH_CACHE_TTL", "3600"))
+PIPELINE_STAGES = os.getenv("PIPELINE_STAGES", "store,rerank")
+STAGE_CONCURRENCY = os.getenv("STAGE_CONCURRENCY", "")
+
+async def _store_stage(query: str, papers: list[dict]) -> list[dict]:
+    # The results carry the ID the store filed each paper under, on copies,
+    # since the input may be shared with cached entries.
+    ids = await paper_store.upsert(papers)
+    return [{**paper, "paper_id": pid} if pid and pid != paper.get("paper_id") else paper for paper, pid in zip(papers, ids)]
+
+async def _rerank_stage(query: str, papers: list[dict]) -> list[dict]:
+    if not RERANK_RESULTS:
+        return papers
+    return await rerank(query, papers)
+
+# Post-merge stages take (query, papers) and return the papers to pass on.
+STAGES = {
+    "store": _store_stage,
+    "rerank": _rerank_stage
+}
+
+def parse_limits(value: str) -> dict:
+    # "fanout=32,summarize=8" caps how many calls may be inside each stage at once.
+    limits = {}
+    for part in value.split(","):
+        name, _, number = part.partition("=")
+        if name.strip() and number.strip():
+            limits[name.strip()] = int(number)
+    return limits
+
+# The search flow shared by the MCP tools, the HTTP apps and the job
+# handlers: fan out to every registered provider at once, merge duplicates,
+# run the post-merge stages, and cache the entry under search:<query>:<n>.
+# Stage limits are per process; "fanout" and "summarize" cover those steps
+# and every post-merge stage can be limited by its name.
+class SearchPipeline:
+    def __init__(self, providers: dict = None, stages: list = None, limits: dict = None):
+        self.providers = dict(PROVIDERS if providers is None else providers)
+        self.stage_functions = dict(STAGES)
+        if stages is None:
+            stages = [name.strip() for name in PIPELINE_STAGES.split(",") if name.strip()]
+        unknown = [name for name in stages if name not in self.stage_functions]
+        if unknown:
+            raise ValueError(f"Unknown pipeline stages {', '.join(unknown)}, expected some of {', '.join(self.stage_functions)}")
+        self.stages = list(stages)
+        self.limits = parse_limits(STAGE_CONCURRENCY) if limits is None else dict(limits)
+        self._semaphores = {}
+
+    def register_provider(self, name: str, search):
+        self.providers[name] = search
+
+    def register_stage(self, name: str, stage, enabled: bool = True):
+        self.stage_functions[name] = stage
+        if enabled and name not in self.stages:
+            self.stages.append(name)
+
+    @asynccontextmanager
+    async def limit(self, stage: str):
+        limit = self.limits.get(stage, 0)
+        if limit <= 0:
+            yield
+            return
+        semaphore = self._semaphores.get(stage)
+        if semaphore is None:
+            semaphore = self._semaphores[stage] = asyncio.Semaphore(limit)
+        async with semaphore:
+            yield
+
+    async def call(self, name: str, query: str, max_results: int, deadline: float = PROVIDER_DEADLINE) -> list[dict]:
+        search = self.providers[name]
+        return await call_provider(name, lambda: search(query, max_results), deadline)
+
+    async def fan_out(self, query: str, max_results: int, deadline: float = PROVIDER_DEADLINE) -> tuple[list[dict], list[str]]:
+        async with self.limit("fanout"):
+            outcomes = await asyncio.gather(
+                *(self.call(name, query, max_results, deadline) for name in self.providers),
+                return_exceptions=True
+            )
+        papers = []
+        errors = []
+        for name, outcome in zip(self.providers, outcomes):
+            if isinstance(outcome, list):
+                papers.extend(outcome)
+            else:
+                logging.warning(f"{name} error: {outcome}")
+                errors.append(f"{name}: {outcome}")
+        return merge_results(papers), errors
+
+    async def process(self, query: str, papers: list[dict]) -> list[dict]:
+        for name in self.stages:
+            async with self.limit(name):
+                papers = await self.stage_functions[name](query, papers)
+        return papers
+
+    async def fetch(self, query: str, max_results: int, deadline: float = PROVIDER_DEADLINE) -> dict:
+        papers, errors = await self.fan_out(query, max_results, deadline)
+        return {"results": await self.process(query, papers), "errors": errors}
+
+    @staticmethod
+    def cache_key(query: str, max_results: int) -> str:
+        return f"search:{query}:{max_results}"
+
+    # Partial results from a throttled or failing source are only cached briefly.
+    @staticmethod
+    def entry_ttl(entry: dict) -> int:
+        return PARTIAL_RESULT_TTL if entry["errors"] else SEARCH_CACHE_TTL
+
+    async def store(self, query: str, max_results: int, entry: dict):
+        await set_to_cache(
+            self.cache_key(query, max_results), entry, self.entry_ttl(entry) + SEARCH_STALE_TTL, share_papers=True
+        )
+
+    # Returns ({"results", "errors"}, cached). The fetch closure holds no
+    # per-request state, so the refresh scheduler can rerun it.
+    async def search_remote(self, query: str, max_results: int, deadline: float = PROVIDER_DEADLINE) -> tuple[dict, bool]:
+        key = self.cache_key(query, max_results)
+
+        def fetch():
+            return self.fetch(query, max_results, deadline)
+
+        refresh_scheduler.track(key, fetch, self.entry_ttl, True, SEARCH_STALE_TTL)
+        entry, cached = await get_or_fetch(key, fetch, self.entry_ttl, share_papers=True, stale_ttl=SEARCH_STALE_TTL)
+        # Entries written before errors were cached alongside the results.
+        if isinstance(entry, list):
+            entry = {"results": entry, "errors": []}
+        return entry, cached
+
+    async def search_local(self, query: str, max_results: int) -> list[dict]:
+        results = await paper_store.search(query, max_results * len(self.providers))
+        if "rerank" in self.stages:
+            results = await _rerank_stage(query, results)
+        return results
+
+    # Whether a search in this mode is answered from the paper store alone.
+    @staticmethod
+    def answers_locally(mode: str, local_results: list, max_results: int) -> bool:
+        return mode == "local" or (mode != "remote" and len(local_results) >= max_results)
+
+    async def search(self, query: str, max_results: int, mode: str = "remote", deadline: float = PROVIDER_DEADLINE) -> dict:
+        if mode not in SEARCH_MODES:
+            return {"status": "error", "message": f"mode must be one of {', '.join(SEARCH_MODES)}"}
+        local_results = []
+        if mode != "remote":
+            local_results = await self.search_local(query, max_results)
+            if self.answers_locally(mode, local_results, max_results):
+                return {"status": "success", "results": local_results, "source": "local"}
+
+        entry, cached = await self.search_remote(query, max_results, deadline)
+        if not entry["results"] and local_results:
+            return {"status": "success", "results": local_results, "source": "local", "errors": entry["errors"]}
+        response = {"status": "success", "results": entry["results"], "source": "cache" if cached else "live"}
+        if entry["errors"]:
+            response["errors"] = entry["errors"]
+        return response
+
+    # Returns copies of the papers with a "summary" added where one could be
+    # made, and {index: error} for the papers whose summary failed. With
+    # on_summary, each summary is reported as it finishes instead of waiting
+    # for the whole batch.
+    async def summarize(self, papers: list[dict], max_length: int, min_length: int, on_summary=None) -> tuple[list[dict], dict]:
+        papers = [dict(paper) for paper in papers]
+        indexes = [i for i, paper in enumerate(papers) if paper.get("abstract")]
+        failures = {}
+        async with self.limit("summarize"):
+            if on_summary is None:
+                summaries = await summarize_many(
+                    [papers[i]["abstract"] for i in indexes], max_length=max_length, min_length=min_length
+                )
+                for i, summary in zip(indexes, summaries):
+                    if isinstance(summary, Exception):
+                        failures[i] = summary
+                    else:
+                        papers[i]["summary"] = summary
+                return papers, failures
+
+            async def one(i: int):
+                try:
+                    papers[i]["summary"] = await summarize_text(papers[i]["abstract"], max_length=max_length, min_length=min_length)
+                    on_summary(i, papers[i]["summary"], None)
+                except Exception as e:
+                    failures[i] = e
+                    on_summary(i, None, e)
+
+            await asyncio.gather(*(one(i) for i in indexes))
+        return papers, failures
+
+pipeline = SearchPipeline()
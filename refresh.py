@@ -0,0 +1,145 @@
+import os
+import time
+import heapq
+import random
+import asyncio
+import cache
+from logger_config import logging
+
+REFRESH_AHEAD = os.getenv("REFRESH_AHEAD", "true").lower() in ("1", "true", "yes")
+REFRESH_INTERVAL = float(os.getenv("REFRESH_INTERVAL_SECONDS", "30"))
+REFRESH_AHEAD_SECONDS = float(os.getenv("REFRESH_AHEAD_SECONDS", "300"))
+REFRESH_TOP_KEYS = int(os.getenv("REFRESH_TOP_KEYS", "50"))
+REFRESH_MIN_HITS = float(os.getenv("REFRESH_MIN_HITS", "3"))
+POPULARITY_CAPACITY = int(os.getenv("POPULARITY_CAPACITY", "1000"))
+POPULARITY_HALF_LIFE = float(os.getenv("POPULARITY_HALF_LIFE_SECONDS", "600"))
+SEARCH_STALE_TTL = int(os.getenv("SEARCH_STALE_TTL", "600"))
+CACHE_WARM_FILE = os.getenv("CACHE_WARM_FILE", "")
+CACHE_WARM_CONCURRENCY = int(os.getenv("CACHE_WARM_CONCURRENCY", "4"))
+
+# Space-saving top-k counter: at most `capacity` keys are tracked. A new key
+# replaces the least counted one and inherits its count, so a key that is
+# really hot cannot be pushed out by a stream of one-off queries.
+class SpaceSaving:
+    def __init__(self, capacity: int):
+        self.capacity = max(1, capacity)
+        self.counts = {}
+
+    def add(self, key: str, weight: float = 1.0):
+        if key in self.counts:
+            self.counts[key] += weight
+            return None
+        evicted = None
+        floor = 0.0
+        if len(self.counts) >= self.capacity:
+            evicted = min(self.counts, key=self.counts.get)
+            floor = self.counts.pop(evicted)
+        self.counts[key] = floor + weight
+        return evicted
+
+    def top(self, n: int) -> list[tuple[str, float]]:
+        return heapq.nlargest(n, self.counts.items(), key=lambda item: item[1])
+
+    def decay(self, factor: float = 0.5) -> list[str]:
+        dropped = []
+        for key in list(self.counts):
+            self.counts[key] *= factor
+            if self.counts[key] < 0.5:
+                del self.counts[key]
+                dropped.append(key)
+        return dropped
+
+    def __len__(self):
+        return len(self.counts)
+
+# Keeps the hottest cached searches fresh. Each request is counted in the
+# sketch along with the fetch that can rebuild its entry; a periodic pass
+# revalidates hot keys that are about to go stale, so popular queries never
+# fall back to a cold fan-out.
+class RefreshScheduler:
+    def __init__(self, capacity: int = POPULARITY_CAPACITY):
+        self.sketch = SpaceSaving(capacity)
+        self._refreshers = {}
+        self._task = None
+        self._last_decay = time.monotonic()
+
+    def track(self, key: str, fetch=None, ttl=3600, share_papers: bool = False, stale_ttl: int = 0):
+        evicted = self.sketch.add(key)
+        if evicted is not None:
+            self._refreshers.pop(evicted, None)
+        if fetch is not None:
+            self._refreshers[key] = (fetch, ttl, share_papers, stale_ttl)
+
+    async def refresh_due(self) -> int:
+        started = 0
+        for key, count in self.sketch.top(REFRESH_TOP_KEYS):
+            if count < REFRESH_MIN_HITS:
+                break
+            refresher = self._refreshers.get(key)
+            if refresher is None:
+                continue
+            fetch, ttl, share_papers, stale_ttl = refresher
+            remaining = await cache.time_to_live(key)
+            if remaining is None or remaining - stale_ttl <= REFRESH_AHEAD_SECONDS:
+                started += cache.revalidate(key, fetch, ttl, share_papers, stale_ttl, "ahead")
+        return started
+
+    def _decay(self):
+        if POPULARITY_HALF_LIFE <= 0:
+            return
+        now = time.monotonic()
+        while now - self._last_decay >= POPULARITY_HALF_LIFE:
+            self._last_decay += POPULARITY_HALF_LIFE
+            for key in self.sketch.decay():
+                self._refreshers.pop(key, None)
+
+    async def _run(self):
+        while True:
+            # Jitter keeps replicas from refreshing in lockstep.
+            await asyncio.sleep(REFRESH_INTERVAL * random.uniform(0.8, 1.2))
+            try:
+                self._decay()
+                started = await self.refresh_due()
+                if started:
+                    logging.info(f"Refreshing {started} popular cache entries ahead of expiry")
+            except Exception as e:
+                logging.warning(f"Cache refresh pass failed: {e}")
+
+    def start(self):
+        if REFRESH_AHEAD and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    # The warm list has one query per line, optionally followed by a tab and
+    # max_results. Blank lines and lines starting with # are ignored.
+    async def warm(self, path: str, search, default_max_results: int = 5) -> int:
+        try:
+            with open(path, encoding="utf-8") as f:
+                lines = [line.rstrip("\n") for line in f]
+        except OSError as e:
+            logging.warning(f"Could not read cache warm list {path}: {e}")
+            return 0
+        entries = []
+        for line in lines:
+            if not line.strip() or line.lstrip().startswith("#"):
+                continue
+            query, _, max_results = line.partition("\t")
+            entries.append((query.strip(), int(max_results) if max_results.strip().isdigit() else default_max_results))
+        semaphore = asyncio.Semaphore(max(1, CACHE_WARM_CONCURRENCY))
+
+        async def one(query: str, max_results: int):
+            async with semaphore:
+                return await search(query, max_results)
+
+        started = time.perf_counter()
+        outcomes = await asyncio.gather(*(one(q, n) for q, n in entries), return_exceptions=True)
+        failed = sum(isinstance(o, Exception) or (isinstance(o, dict) and o.get("status") == "error") for o in outcomes)
+        logging.info(f"Warmed the cache with {len(entries) - failed}/{len(entries)} queries from {path} in {time.perf_counter() - started:.1f}s")
+        return len(entries) - failed
+
+refresh_scheduler = RefreshScheduler()
@@ -0,0 +1,292 @@
+import os
+import time
+import asyncio
+import contextvars
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+from logger_config import logging
+from metrics import PROVIDER_LATENCY, PROVIDER_ERRORS, add_timing
+
+PROVIDER_DEADLINE = float(os.getenv("PROVIDER_DEADLINE_SECONDS", "10"))
+HEDGE_DELAY_MS = float(os.getenv("HEDGE_DELAY_MS", "0"))
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_SECONDS = float(os.getenv("BREAKER_RESET_SECONDS", "30"))
+PARTIAL_RESULT_TTL = int(os.getenv("PARTIAL_RESULT_TTL", "60"))
+PROVIDER_CONCURRENCY = int(os.getenv("PROVIDER_CONCURRENCY", "8"))
+
+class CircuitOpenError(Exception):
+    pass
+
+class ProviderTimeoutError(Exception):
+    pass
+
+class ProviderBusyError(Exception):
+    pass
+
+class TokenBucket:
+    # Adaptive limiter: a 429 halves the rate and pauses until Retry-After,
+    # each success then creeps the rate back up towards the configured one.
+    def __init__(self, rate: float, burst: float):
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.waiters = 0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        self.waiters += 1
+        try:
+            async with self._lock:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    wait = max(0.0, self.paused_until - now)
+                    if not wait and self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    if not wait:
+                        wait = (1 - self.tokens) / self.rate
+                    await asyncio.sleep(wait)
+        finally:
+            self.waiters -= 1
+
+    # How long a new caller would wait for a token behind everyone already queued.
+    def expected_wait(self) -> float:
+        now = time.monotonic()
+        tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        return max(0.0, self.paused_until - now) + max(0.0, (self.waiters + 1 - tokens) / self.rate)
+
+    def throttled(self, retry_after: float = None):
+        self.rate = max(self.max_rate / 16, self.rate / 2)
+        pause = retry_after if retry_after is not None else 1 / self.rate
+        self.paused_until = max(self.paused_until, time.monotonic() + pause)
+        self.tokens = 0
+
+    def succeeded(self):
+        if self.rate < self.max_rate:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 10)
+
+class CircuitBreaker:
+    def __init__(self, name: str, failure_threshold: int = BREAKER_FAILURE_THRESHOLD, reset_seconds: float = BREAKER_RESET_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_seconds:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        # Once the reset period has passed a single probe request is let
+        # through; its outcome closes the breaker or re-opens it.
+        if state == "half-open" and not self._probing:
+            self._probing = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def abandon(self):
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self._probing or self.failures >= self.failure_threshold:
+            if self.opened_at is None or self._probing:
+                logging.warning(f"{self.name} circuit opened after {self.failures} consecutive failures")
+            self.opened_at = time.monotonic()
+        self._probing = False
+
+# Time a provider call spends queued locally, for the provider's concurrency
+# limit or its rate limiter, is tracked apart from the upstream request. Only
+# upstream time counts against the deadline and the circuit breaker; a call
+# that would queue locally for longer than the deadline is rejected instead.
+class CallBudget:
+    def __init__(self, deadline: float):
+        self.deadline = deadline
+        self.waited = 0.0
+        self._waiting = 0
+        self._since = 0.0
+
+    def local_wait(self, now: float) -> float:
+        return self.waited + (now - self._since if self._waiting else 0.0)
+
+    @contextmanager
+    def waiting(self):
+        if not self._waiting:
+            self._since = time.monotonic()
+        self._waiting += 1
+        try:
+            yield
+        finally:
+            self._waiting -= 1
+            if not self._waiting:
+                self.waited += time.monotonic() - self._since
+
+_budget: contextvars.ContextVar = contextvars.ContextVar("provider_budget", default=None)
+
+def _rate_limits():
+    ncbi_key = os.getenv("NCBI_API_KEY")
+    s2_key = os.getenv("SEMANTIC_SCHOLAR_API_KEY")
+    ncbi_rate = float(os.getenv("PUBMED_RATE_LIMIT", "10" if ncbi_key else "3"))
+    s2_rate = float(os.getenv("SEMANTIC_SCHOLAR_RATE_LIMIT", "1" if s2_key else "0.3"))
+    arxiv_rate = float(os.getenv("ARXIV_RATE_LIMIT", "0.34"))
+    return {
+        "export.arxiv.org": TokenBucket(arxiv_rate, 1),
+        "eutils.ncbi.nlm.nih.gov": TokenBucket(ncbi_rate, ncbi_rate),
+        "api.semanticscholar.org": TokenBucket(s2_rate, max(1.0, s2_rate))
+    }
+
+_limiters = _rate_limits()
+breakers: dict[str, CircuitBreaker] = {}
+_semaphores: dict[str, asyncio.Semaphore] = {}
+
+def limiter_for(url: str):
+    return _limiters.get(urlsplit(url).netloc)
+
+async def acquire(url: str):
+    limiter = limiter_for(url)
+    if limiter is None:
+        return
+    budget = _budget.get()
+    if budget is None:
+        await limiter.acquire()
+        return
+    allowed = budget.deadline - budget.local_wait(time.monotonic())
+    if limiter.expected_wait() > allowed:
+        raise ProviderBusyError(f"{urlsplit(url).netloc} rate limit would delay the request past the {budget.deadline}s deadline")
+    with budget.waiting():
+        await limiter.acquire()
+
+def observe_response(url: str, response):
+    limiter = limiter_for(url)
+    if limiter is None:
+        return
+    if response.status_code == 429:
+        retry_after = response.headers.get("Retry-After")
+        try:
+            retry_after = float(retry_after) if retry_after else None
+        except ValueError:
+            retry_after = None
+        limiter.throttled(retry_after)
+    elif response.status_code < 400:
+        limiter.succeeded()
+
+def breaker_for(name: str) -> CircuitBreaker:
+    breaker = breakers.get(name)
+    if breaker is None:
+        breaker = breakers[name] = CircuitBreaker(name)
+    return breaker
+
+def _semaphore_for(name: str) -> asyncio.Semaphore:
+    semaphore = _semaphores.get(name)
+    if semaphore is None:
+        semaphore = _semaphores[name] = asyncio.Semaphore(PROVIDER_CONCURRENCY)
+    return semaphore
+
+async def _limited(name: str, factory, hedge_delay: float):
+    semaphore = _semaphore_for(name)
+    with _budget.get().waiting():
+        await semaphore.acquire()
+    try:
+        return await _hedged(factory, hedge_delay)
+    finally:
+        semaphore.release()
+
+async def _within_budget(name: str, task: asyncio.Task, budget: CallBudget):
+    started = time.monotonic()
+    try:
+        while True:
+            now = time.monotonic()
+            local = budget.local_wait(now)
+            if local >= budget.deadline:
+                raise ProviderBusyError(f"{name} is busy, the request waited {local:.1f}s without being sent")
+            remaining = budget.deadline - (now - started - local)
+            if remaining <= 0:
+                raise asyncio.TimeoutError()
+            done, _ = await asyncio.wait({task}, timeout=min(remaining, budget.deadline - local))
+            if done:
+                return task.result()
+    finally:
+        task.cancel()
+
+async def _hedged(factory, hedge_delay: float):
+    tasks = {asyncio.create_task(factory())}
+    try:
+        if hedge_delay > 0:
+            done, _ = await asyncio.wait(tasks, timeout=hedge_delay)
+            if not done:
+                tasks.add(asyncio.create_task(factory()))
+        error = None
+        while tasks:
+            done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in tasks:
+            task.cancel()
+
+async def call_provider(name: str, factory, deadline: float = PROVIDER_DEADLINE, hedge_delay_ms: float = HEDGE_DELAY_MS):
+    breaker = breaker_for(name)
+    if not breaker.allow():
+        PROVIDER_ERRORS.labels(name, "circuit_open").inc()
+        raise CircuitOpenError(f"{name} is temporarily unavailable (circuit open)")
+    started = time.perf_counter()
+    outcome = "success"
+    budget = CallBudget(deadline)
+    # The task copies the context here, so the budget is seen by the factory
+    # and anything it spawns but not by the caller.
+    token = _budget.set(budget)
+    try:
+        task = asyncio.create_task(_limited(name, factory, hedge_delay_ms / 1000))
+    finally:
+        _budget.reset(token)
+    try:
+        result = await _within_budget(name, task, budget)
+    except asyncio.CancelledError:
+        outcome = "cancelled"
+        breaker.abandon()
+        raise
+    except ProviderBusyError:
+        outcome = "busy"
+        breaker.abandon()
+        raise
+    except asyncio.TimeoutError:
+        outcome = "timeout"
+        breaker.record_failure()
+        raise ProviderTimeoutError(f"{name} did not respond within {deadline}s")
+    except Exception:
+        outcome = "error"
+        breaker.record_failure()
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        PROVIDER_LATENCY.labels(name, outcome).observe(elapsed)
+        if outcome in ("timeout", "error", "busy"):
+            PROVIDER_ERRORS.labels(name, outcome).inc()
+        add_timing(f"upstream:{name}", elapsed)
+    breaker.record_success()
+    return result
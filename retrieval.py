@@ -0,0 +1,99 @@
+import os
+import re
+import math
+import asyncio
+from collections import Counter
+import numpy as np
+from summarizer import get_tokenizer, window_budget
+from logger_config import logging
+from metrics import timing
+
+QA_RETRIEVAL = os.getenv("QA_RETRIEVAL", "bm25")
+QA_PASSAGE_WORDS = int(os.getenv("QA_PASSAGE_WORDS", "80"))
+MAX_QA_PAPERS = int(os.getenv("MAX_QA_PAPERS", "1000"))
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+_TERM = re.compile(r"[a-z0-9]+")
+_STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from has have how in is it its of on or "
+    "that the their there these this to was were what when where which who why will with".split()
+)
+
+def tokenize(text: str) -> list[str]:
+    return [t for t in _TERM.findall(text.lower()) if t not in _STOPWORDS]
+
+def split_passages(papers: list[dict], max_words: int = QA_PASSAGE_WORDS) -> list[str]:
+    passages = []
+    for paper in papers:
+        abstract = paper.get("abstract") or ""
+        if not abstract:
+            continue
+        title = paper.get("title") or ""
+        current = []
+        words = 0
+        for sentence in _SENTENCE_END.split(abstract.strip()):
+            sentence_words = len(sentence.split())
+            if current and words + sentence_words > max_words:
+                passages.append((title, " ".join(current)))
+                current = []
+                words = 0
+            current.append(sentence)
+            words += sentence_words
+        if current:
+            passages.append((title, " ".join(current)))
+    return [f"{title}: {text}" if title else text for title, text in passages]
+
+def bm25_scores(query: str, passages: list[str]) -> np.ndarray:
+    query_terms = set(tokenize(query))
+    docs = [tokenize(passage) for passage in passages]
+    if not docs or not query_terms:
+        return np.zeros(len(docs), dtype=np.float32)
+    avg_len = sum(len(doc) for doc in docs) / len(docs) or 1.0
+    df = Counter()
+    for doc in docs:
+        df.update(query_terms.intersection(doc))
+    idf = {t: math.log(1 + (len(docs) - df[t] + 0.5) / (df[t] + 0.5)) for t in query_terms}
+    scores = np.zeros(len(docs), dtype=np.float32)
+    for i, doc in enumerate(docs):
+        tf = Counter(t for t in doc if t in query_terms)
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * len(doc) / avg_len)
+        scores[i] = sum(idf[t] * n * (BM25_K1 + 1) / (n + norm) for t, n in tf.items())
+    return scores
+
+def _embedding_scores(query: str, passages: list[str]) -> np.ndarray:
+    from embeddings import encode
+    vectors = encode([query] + passages)
+    return vectors[1:] @ vectors[0]
+
+def _select(question: str, papers: list[dict], prefix: str, suffix: str) -> list[str]:
+    passages = split_passages(papers)
+    if not passages:
+        return []
+    scores = bm25_scores(question, passages)
+    if QA_RETRIEVAL == "hybrid":
+        try:
+            top = scores.max()
+            scores = (scores / top if top > 0 else scores) + _embedding_scores(question, passages)
+        except Exception as e:
+            logging.warning(f"Embedding retrieval failed, using BM25 only: {e}")
+    budget = window_budget(prefix, suffix)
+    tokenizer = get_tokenizer()
+    selected = []
+    used = 0
+    for i in np.argsort(-scores, kind="stable"):
+        if selected and scores[i] <= 0:
+            break
+        tokens = len(tokenizer(passages[i], add_special_tokens=False)["input_ids"]) + 2
+        # The best passage is always kept; summarize_long splits it if needed.
+        if selected and used + tokens > budget:
+            break
+        selected.append(i)
+        used += tokens
+    # Keep the packed passages in document order so the context reads naturally.
+    return [passages[i] for i in sorted(selected)]
+
+async def select_passages(question: str, papers: list[dict], prefix: str = "", suffix: str = "") -> list[str]:
+    with timing("retrieval"):
+        return await asyncio.to_thread(_select, question, papers[:MAX_QA_PAPERS], prefix, suffix)
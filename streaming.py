@@ -0,0 +1,138 @@
+import asyncio
+import json
+import time
+from summarizer import summarize_text
+import cache
+from cache import get_from_cache
+from dedup import MergeIndex
+from pipeline import pipeline
+from paper_store import SEARCH_MODE, SEARCH_MODES
+from refresh import refresh_scheduler, SEARCH_STALE_TTL
+from logger_config import logging
+
+async def _timed(coro):
+    start = time.perf_counter()
+    try:
+        result = await coro
+    except Exception as e:
+        result = e
+    return result, round((time.perf_counter() - start) * 1000, 1)
+
+async def _provider_task(source: str, query: str, max_results: int):
+    result, elapsed_ms = await _timed(pipeline.call(source, query, max_results))
+    return "results", source, result, elapsed_ms
+
+async def _summary_task(index: int, paper: dict, max_length: int, min_length: int):
+    summary, elapsed_ms = await _timed(summarize_text(paper["abstract"], max_length=max_length, min_length=min_length))
+    return "summary", index, summary, elapsed_ms
+
+async def stream_search(query: str, max_results: int = 5, summarize: bool = False,
+                        summary_max_length: int = 50, summary_min_length: int = 25, mode: str = SEARCH_MODE):
+    started = time.perf_counter()
+    if mode not in SEARCH_MODES:
+        yield {"type": "error", "message": f"mode must be one of {', '.join(SEARCH_MODES)}"}
+        return
+    cache_key = pipeline.cache_key(query, max_results)
+    errors = {}
+    timings = {}
+    merged = MergeIndex()
+    papers = merged.records
+    pending = set()
+    claim = None
+
+    # Merges a provider's results into the index and starts summaries for the
+    # papers not already seen from another source; returns those new papers.
+    def add_results(results):
+        new_papers = []
+        for paper in results:
+            index, is_new = merged.add(paper)
+            if not is_new:
+                continue
+            record = papers[index]
+            new_papers.append(record)
+            if summarize and record.get("abstract"):
+                pending.add(asyncio.create_task(
+                    _summary_task(index, record, summary_max_length, summary_min_length)
+                ))
+        return new_papers
+
+    def fetch():
+        return pipeline.fetch(query, max_results)
+
+    local_results = []
+    if mode != "remote":
+        local_results = await pipeline.search_local(query, max_results)
+    if pipeline.answers_locally(mode, local_results, max_results):
+        yield {"type": "results", "source": "local", "results": add_results(local_results), "elapsed_ms": 0.0}
+        entry = None
+    else:
+        refresh_scheduler.track(cache_key, fetch, pipeline.entry_ttl, True, SEARCH_STALE_TTL)
+        entry = await get_from_cache(cache_key)
+        if entry is not None:
+            remaining = await cache.time_to_live(cache_key)
+            if remaining is not None and remaining <= SEARCH_STALE_TTL:
+                cache.revalidate(cache_key, fetch, pipeline.entry_ttl, True, SEARCH_STALE_TTL, "stale")
+        else:
+            # Like get_or_fetch: only one fan-out per key runs at a time. A
+            # stream that finds one already running waits for its entry.
+            claim = cache.claim(cache_key)
+            if claim is None:
+                entry = await cache.join(cache_key)
+                if entry is None:
+                    claim = cache.claim(cache_key)
+        if entry is not None:
+            results = entry["results"] if isinstance(entry, dict) else entry
+            yield {"type": "results", "source": "cache", "results": add_results(results), "elapsed_ms": 0.0}
+        else:
+            for source in pipeline.providers:
+                pending.add(asyncio.create_task(_provider_task(source, query, max_results)))
+
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                kind, key, result, elapsed_ms = task.result()
+                if kind == "results":
+                    timings[key] = elapsed_ms
+                    if isinstance(result, Exception):
+                        logging.warning(f"{key} error: {result}")
+                        errors[key] = str(result)
+                        continue
+                    new_papers = add_results(result)
+                    yield {
+                        "type": "results",
+                        "source": key,
+                        "results": new_papers,
+                        "duplicates": len(result) - len(new_papers),
+                        "elapsed_ms": elapsed_ms
+                    }
+                else:
+                    event = {"type": "summary", "index": key, "title": papers[key].get("title", ""), "elapsed_ms": elapsed_ms}
+                    if isinstance(result, Exception):
+                        event["error"] = str(result)
+                    else:
+                        event["summary"] = result
+                    yield event
+
+        # The cached entry goes through the same post-merge stages as a
+        # regular search, so later searches for this query get identical
+        # results; requests waiting on this stream's claim get it too.
+        if claim is not None:
+            results = await pipeline.process(query, list(papers))
+            await cache.fill(cache_key, claim, {
+                "results": results, "errors": [f"{source}: {error}" for source, error in errors.items()]
+            }, pipeline.entry_ttl, True, SEARCH_STALE_TTL)
+    finally:
+        for task in pending:
+            task.cancel()
+        if claim is not None:
+            cache.release(cache_key, claim)
+
+    if not papers and local_results:
+        yield {"type": "results", "source": "local", "results": add_results(local_results), "elapsed_ms": 0.0}
+    timings["total"] = round((time.perf_counter() - started) * 1000, 1)
+    yield {"type": "done", "count": len(papers), "errors": errors, "timings": timings}
+
+async def ndjson(events):
+    async for event in events:
+        yield json.dumps(event) + "\n"
@@ -1,25 +1,370 @@
-from transformers import pipeline
 import sys
+import os
+import re
 import asyncio
+import time
+import hashlib
+import threading
+from metrics import SUMMARIZER_QUEUE_DEPTH, SUMMARIZER_BATCH_SIZE, SUMMARIZER_BATCH_SECONDS, SUMMARIZER_TOKEN_SECONDS, timing
+from cache import get_from_cache, set_to_cache, get_many_from_cache, set_many_to_cache
+from logger_config import logging
+from summary_workers import WorkerPool, SUMMARY_WORKERS
+
+SUMMARY_MODEL = os.getenv("SUMMARY_MODEL", "t5-small")
+SUMMARY_BACKEND = os.getenv("SUMMARY_BACKEND", "pipeline")
+SUMMARY_ONNX_DIR = os.getenv("SUMMARY_ONNX_DIR", "onnx-models")
+MODEL_WARMUP = os.getenv("MODEL_WARMUP", "false").lower() in ("1", "true", "yes")
+SUMMARY_CACHE_TTL = int(os.getenv("SUMMARY_CACHE_TTL", str(30 * 24 * 3600)))
+SUMMARY_BATCH_SIZE = int(os.getenv("SUMMARY_BATCH_SIZE", "16"))
+SUMMARY_BATCH_WAIT_MS = float(os.getenv("SUMMARY_BATCH_WAIT_MS", "10"))
+SUMMARY_QUEUE_LIMIT = int(os.getenv("SUMMARY_QUEUE_LIMIT", "4096"))
+SUMMARY_MODEL_MAX_TOKENS = int(os.getenv("SUMMARY_MODEL_MAX_TOKENS", "512"))
+CHUNK_SUMMARY_MAX_LENGTH = int(os.getenv("CHUNK_SUMMARY_MAX_LENGTH", "120"))
+CHUNK_SUMMARY_MIN_LENGTH = int(os.getenv("CHUNK_SUMMARY_MIN_LENGTH", "30"))
+MAX_REDUCE_LEVELS = 8
+MAX_SYNTHESIS_PAPERS = int(os.getenv("MAX_SYNTHESIS_PAPERS", "200"))
+# Room for the "summarize: " task prefix and end-of-sequence token.
+_RESERVED_TOKENS = 8
+_MIN_CHUNK_TOKENS = 64
+
+# transformers (and through it torch or onnxruntime) is only imported when a
+# backend or tokenizer is first loaded, keeping it out of server start-up.
+def _load_pipeline(model_name: str):
+    from transformers import pipeline
+    return pipeline("summarization", model=model_name)
+
+def _load_quantized(model_name: str):
+    # Dynamic int8 quantization of the Linear layers; activations stay float.
+    import torch
+    from transformers import AutoModelForSeq2SeqLM, AutoTokenizer, pipeline
+    model = AutoModelForSeq2SeqLM.from_pretrained(model_name)
+    model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return pipeline("summarization", model=model, tokenizer=AutoTokenizer.from_pretrained(model_name))
+
+def _load_onnx(model_name: str):
+    # Requires optimum[onnxruntime]. The model is exported once and reused
+    # from SUMMARY_ONNX_DIR afterwards.
+    from optimum.onnxruntime import ORTModelForSeq2SeqLM
+    from transformers import AutoTokenizer, pipeline
+    path = os.path.join(SUMMARY_ONNX_DIR, model_name.replace("/", "--"))
+    if os.path.isdir(path):
+        model = ORTModelForSeq2SeqLM.from_pretrained(path)
+        tokenizer = AutoTokenizer.from_pretrained(path)
+    else:
+        model = ORTModelForSeq2SeqLM.from_pretrained(model_name, export=True)
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+        model.save_pretrained(path)
+        tokenizer.save_pretrained(path)
+    return pipeline("summarization", model=model, tokenizer=tokenizer)
+
+SUMMARY_BACKENDS = {
+    "pipeline": _load_pipeline,
+    "quantized": _load_quantized,
+    "onnx": _load_onnx
+}
+
+def load_backend(backend: str = SUMMARY_BACKEND, model_name: str = SUMMARY_MODEL):
+    loader = SUMMARY_BACKENDS.get(backend)
+    if loader is None:
+        raise ValueError(f"Unknown SUMMARY_BACKEND {backend!r}, expected one of {', '.join(SUMMARY_BACKENDS)}")
+    return loader(model_name)
 
 _summarizer = None
+_tokenizer = None
+_load_lock = threading.Lock()
+_tokenizer_lock = threading.Lock()
 
 def get_summarizer():
     global _summarizer
-    if _summarizer is None:
+    with _load_lock:
+        if _summarizer is None:
+            try:
+                started = time.perf_counter()
+                _summarizer = load_backend()
+                logging.info(f"Loaded {SUMMARY_MODEL} ({SUMMARY_BACKEND}) in {time.perf_counter() - started:.1f}s")
+            except Exception as e:
+                print(f"Failed to load {SUMMARY_MODEL} summarization model: {e}", file=sys.stderr)
+                raise
+    return _summarizer
+
+def get_tokenizer():
+    # Token counting only needs the tokenizer, which loads in a fraction of
+    # the time of the model.
+    global _tokenizer
+    if _summarizer is not None:
+        return _summarizer.tokenizer
+    with _tokenizer_lock:
+        if _tokenizer is None:
+            from transformers import AutoTokenizer
+            _tokenizer = AutoTokenizer.from_pretrained(SUMMARY_MODEL)
+    return _tokenizer
+
+def warmup():
+    if SUMMARY_WORKERS > 0:
+        # Worker processes load their own model copies when the pool starts.
+        get_tokenizer()
+        return
+    started = time.perf_counter()
+    try:
+        get_summarizer()("Warm up the summarization model.", max_length=8, min_length=1, do_sample=False)
+        logging.info(f"Summarization model warmed up in {time.perf_counter() - started:.1f}s")
+    except Exception as e:
+        logging.warning(f"Summarization model warmup failed: {e}")
+
+def run_batch(summarizer, texts: list[str], max_length: int, min_length: int) -> tuple[list[str], float, int]:
+    started = time.perf_counter()
+    outputs = summarizer(
+        texts,
+        max_length=max_length,
+        min_length=min_length,
+        do_sample=False,
+        truncation=True,
+        batch_size=len(texts)
+    )
+    elapsed = time.perf_counter() - started
+    summaries = [output["summary_text"] for output in outputs]
+    generated = sum(len(ids) for ids in summarizer.tokenizer(summaries, add_special_tokens=False)["input_ids"])
+    return summaries, elapsed, generated
+
+def _summarize_batch(texts: list[str], max_length: int, min_length: int):
+    return run_batch(get_summarizer(), texts, max_length, min_length)
+
+def _observe_batch(size: int, elapsed: float, generated: int):
+    SUMMARIZER_BATCH_SIZE.observe(size)
+    SUMMARIZER_BATCH_SECONDS.observe(elapsed)
+    if generated:
+        SUMMARIZER_TOKEN_SECONDS.observe(elapsed / generated)
+
+class SummarizerOverloadedError(Exception):
+    pass
+
+class BatchScheduler:
+    def __init__(self, max_batch_size: int = SUMMARY_BATCH_SIZE, max_wait_ms: float = SUMMARY_BATCH_WAIT_MS,
+                 pool: WorkerPool = None, max_queue: int = SUMMARY_QUEUE_LIMIT):
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self.max_queue = max_queue
+        self.pool = pool
+        self._queue = asyncio.Queue()
+        self._worker = None
+        self._tasks = set()
+
+    async def submit(self, text: str, max_length: int, min_length: int) -> str:
+        if self.pool is not None and self.pool.broken:
+            raise self.pool.broken_error()
+        if self.max_queue > 0 and self._queue.qsize() >= self.max_queue:
+            raise SummarizerOverloadedError(f"Summarizer queue is full ({self.max_queue} texts waiting)")
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((text, max_length, min_length, future))
+        SUMMARIZER_QUEUE_DEPTH.inc()
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+        return await future
+
+    async def _collect(self):
+        batch = [await self._queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        SUMMARIZER_QUEUE_DEPTH.dec(len(batch))
+        return batch
+
+    async def _execute(self, items: list, max_length: int, min_length: int, worker=None):
+        texts = [text for text, _ in items]
         try:
-            _summarizer = pipeline("summarization", model="t5-small")
+            if worker is None:
+                loop = asyncio.get_running_loop()
+                result = await loop.run_in_executor(None, _summarize_batch, texts, max_length, min_length)
+            else:
+                result = await self.pool.run(worker, texts, max_length, min_length)
         except Exception as e:
-            print(f"Failed to load t5-small summarization model: {e}", file=sys.stderr)
-            raise
-    return _summarizer
+            for _, future in items:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        summaries, elapsed, generated = result
+        _observe_batch(len(texts), elapsed, generated)
+        for (_, future), summary in zip(items, summaries):
+            if not future.done():
+                future.set_result(summary)
+
+    def _fail_pending(self, batch: list, error: Exception):
+        while not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+            SUMMARIZER_QUEUE_DEPTH.dec()
+        for *_, future in batch:
+            if not future.done():
+                future.set_exception(error)
+
+    async def _run(self):
+        batch = []
+        try:
+            while True:
+                batch = []
+                # With a worker pool the next batch is only collected once a worker
+                # is free, so requests arriving while all are busy join one batch.
+                worker = await self.pool.acquire() if self.pool is not None else None
+                batch = await self._collect()
+                # Generation params are per forward pass, so requests that differ
+                # in max_length/min_length are run as separate sub-batches.
+                groups = {}
+                for text, max_length, min_length, future in batch:
+                    if not future.done():
+                        groups.setdefault((max_length, min_length), []).append((text, future))
+                for (max_length, min_length), items in groups.items():
+                    if self.pool is None:
+                        await self._execute(items, max_length, min_length)
+                        continue
+                    if worker is None:
+                        worker = await self.pool.acquire()
+                    task = asyncio.create_task(self._execute(items, max_length, min_length, worker))
+                    self._tasks.add(task)
+                    task.add_done_callback(self._tasks.discard)
+                    worker = None
+                if worker is not None:
+                    self.pool.release(worker)
+        except Exception as e:
+            # Without this, callers already queued would wait forever on a
+            # scheduler task that has died.
+            logging.error(f"Summarizer batch loop failed: {e}")
+            self._fail_pending(batch, e)
+
+_schedulers = {}
+_pool = None
+
+def get_scheduler() -> BatchScheduler:
+    global _pool
+    loop = asyncio.get_running_loop()
+    scheduler = _schedulers.get(loop)
+    if scheduler is None:
+        _schedulers.clear()
+        if SUMMARY_WORKERS > 0:
+            if _pool is not None:
+                _pool.shutdown()
+            _pool = WorkerPool(SUMMARY_WORKERS, SUMMARY_BACKEND, SUMMARY_MODEL)
+            _pool.start()
+        scheduler = BatchScheduler(pool=_pool)
+        _schedulers[loop] = scheduler
+    return scheduler
+
+def shutdown():
+    global _pool
+    _schedulers.clear()
+    if _pool is not None:
+        _pool.shutdown()
+        _pool = None
+
+_WHITESPACE = re.compile(r"\s+")
+summary_cache_stats = {"hits": 0, "misses": 0}
+# Other backends produce slightly different text, so they get their own
+# cache entries; the default keeps the keys written before backends existed.
+_MODEL_TAG = SUMMARY_MODEL if SUMMARY_BACKEND == "pipeline" else f"{SUMMARY_MODEL}/{SUMMARY_BACKEND}"
+
+def summary_cache_key(text: str, max_length: int, min_length: int) -> str:
+    normalized = _WHITESPACE.sub(" ", text).strip()
+    digest = hashlib.sha256(f"{_MODEL_TAG}|{max_length}|{min_length}|{normalized}".encode("utf-8")).hexdigest()
+    return f"summary:{digest}"
 
 async def summarize_text(text: str, max_length: int = 150, min_length: int = 30):
-    loop = asyncio.get_event_loop()
-    
-    def _summarize():
-        summarizer = get_summarizer()
-        summary = summarizer(text, max_length=max_length, min_length=min_length, do_sample=False)
-        return summary[0]["summary_text"]
-    
-    return await loop.run_in_executor(None, _summarize) 
\ No newline at end of file
+    key = summary_cache_key(text, max_length, min_length)
+    cached = await get_from_cache(key)
+    if cached is not None:
+        summary_cache_stats["hits"] += 1
+        return cached
+    summary_cache_stats["misses"] += 1
+    with timing("summarize"):
+        summary = await get_scheduler().submit(text, max_length, min_length)
+    await set_to_cache(key, summary, SUMMARY_CACHE_TTL)
+    return summary
+
+async def summarize_many(texts: list[str], max_length: int = 150, min_length: int = 30):
+    keys = [summary_cache_key(text, max_length, min_length) for text in texts]
+    results = await get_many_from_cache(keys)
+    # Identical texts in one call are only run through the model once.
+    pending = {}
+    for key, text, cached in zip(keys, texts, results):
+        if cached is None and key not in pending:
+            pending[key] = text
+    summary_cache_stats["hits"] += len(texts) - sum(1 for cached in results if cached is None)
+    summary_cache_stats["misses"] += len(pending)
+    scheduler = get_scheduler()
+    pending_keys = list(pending)
+    with timing("summarize"):
+        outputs = await asyncio.gather(
+            *(scheduler.submit(pending[key], max_length, min_length) for key in pending_keys),
+            return_exceptions=True
+        )
+    computed = dict(zip(pending_keys, outputs))
+    await set_many_to_cache(
+        {key: summary for key, summary in computed.items() if not isinstance(summary, Exception)},
+        SUMMARY_CACHE_TTL
+    )
+    return [cached if cached is not None else computed[key] for key, cached in zip(keys, results)]
+
+def count_tokens(text: str) -> int:
+    return len(get_tokenizer()(text, add_special_tokens=False)["input_ids"])
+
+def chunk_texts(texts: list[str], budget: int, separator: str = "\n\n") -> list[str]:
+    tokenizer = get_tokenizer()
+    ids_list = tokenizer(texts, add_special_tokens=False)["input_ids"] if texts else []
+    separator_tokens = len(tokenizer(separator, add_special_tokens=False)["input_ids"])
+    chunks = []
+    current = []
+    current_tokens = 0
+    for text, ids in zip(texts, ids_list):
+        if len(ids) > budget:
+            # A single text longer than the window is split on token boundaries.
+            pieces = [(tokenizer.decode(ids[i:i + budget]), len(ids[i:i + budget])) for i in range(0, len(ids), budget)]
+        else:
+            pieces = [(text, len(ids))]
+        for piece, tokens in pieces:
+            needed = tokens + (separator_tokens if current else 0)
+            if current and current_tokens + needed > budget:
+                chunks.append(separator.join(current))
+                current = []
+                current_tokens = 0
+                needed = tokens
+            current.append(piece)
+            current_tokens += needed
+    if current:
+        chunks.append(separator.join(current))
+    return chunks
+
+def window_budget(prefix: str = "", suffix: str = "") -> int:
+    overhead = count_tokens(prefix + suffix) if prefix or suffix else 0
+    return max(_MIN_CHUNK_TOKENS, SUMMARY_MODEL_MAX_TOKENS - overhead - _RESERVED_TOKENS)
+
+async def summarize_long(texts: list[str], max_length: int = 150, min_length: int = 30,
+                         prefix: str = "", suffix: str = ""):
+    loop = asyncio.get_running_loop()
+    with timing("tokenize"):
+        budget = await loop.run_in_executor(None, window_budget, prefix, suffix)
+    # Partial summaries must be well under the window so that each reduce
+    # level packs several of them together and the level count shrinks.
+    map_max_length = max(1, min(CHUNK_SUMMARY_MAX_LENGTH, budget // 3))
+    map_min_length = min(CHUNK_SUMMARY_MIN_LENGTH, map_max_length)
+    texts = [text for text in texts if text]
+    for _ in range(MAX_REDUCE_LEVELS):
+        with timing("tokenize"):
+            chunks = await loop.run_in_executor(None, chunk_texts, texts, budget)
+        if len(chunks) <= 1:
+            break
+        partials = await summarize_many(
+            [prefix + chunk + suffix for chunk in chunks],
+            max_length=map_max_length,
+            min_length=map_min_length
+        )
+        texts = [partial for partial in partials if not isinstance(partial, Exception)]
+        if not texts:
+            raise partials[0]
+    return await summarize_text(prefix + "\n\n".join(texts) + suffix, max_length=max_length, min_length=min_length)
@@ -0,0 +1,211 @@
+import os
+import asyncio
+import multiprocessing
+from logger_config import logging
+from metrics import SUMMARY_WORKERS_READY, SUMMARY_WORKER_RESTARTS
+
+SUMMARY_WORKERS = int(os.getenv("SUMMARY_WORKERS", "0"))
+SUMMARY_WORKER_THREADS = int(os.getenv(
+    "SUMMARY_WORKER_THREADS", str(max(1, (os.cpu_count() or 1) // max(1, SUMMARY_WORKERS)))
+))
+WORKER_START_ATTEMPTS = 3
+WORKER_MAX_BACKOFF = 30.0
+
+class WorkerCrashedError(Exception):
+    pass
+
+class WorkerPoolBrokenError(RuntimeError):
+    pass
+
+def _pin_threads(threads: int):
+    # The BLAS/OpenMP pools size themselves from these at import time, so
+    # they are set before torch is first imported in this process.
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[var] = str(threads)
+    try:
+        import torch
+    except ImportError:
+        return
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass
+
+def _worker_main(conn, backend: str, model_name: str, threads: int):
+    _pin_threads(threads)
+    try:
+        from summarizer import load_backend, run_batch
+        summarizer = load_backend(backend, model_name)
+    except Exception as e:
+        conn.send(("failed", f"{type(e).__name__}: {e}"))
+        return
+    conn.send(("ready", None))
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            return
+        if message is None:
+            return
+        texts, max_length, min_length = message
+        try:
+            conn.send(("done", run_batch(summarizer, texts, max_length, min_length)))
+        except Exception as e:
+            conn.send(("error", f"{type(e).__name__}: {e}"))
+
+class _Worker:
+    def __init__(self, index: int):
+        self.index = index
+        self.process = None
+        self.conn = None
+        self.generation = 0
+        self.ready = False
+        self.future = None
+        self.failures = 0
+
+# Each worker process holds its own model copy and is sent one batch at a
+# time over a dedicated pipe, watched by the event loop. Idle workers wait in
+# a queue, so a batch always goes to a free worker and callers wait (rather
+# than pile work onto a busy one) when every worker is occupied.
+class WorkerPool:
+    def __init__(self, size: int, backend: str, model_name: str, threads: int = SUMMARY_WORKER_THREADS):
+        self.size = size
+        self.backend = backend
+        self.model_name = model_name
+        self.threads = threads
+        self.loop = None
+        self.last_error = None
+        self._ctx = multiprocessing.get_context("spawn")
+        self._workers = [_Worker(i) for i in range(size)]
+        self._idle = asyncio.Queue()
+        self._closed = False
+
+    def start(self):
+        self.loop = asyncio.get_running_loop()
+        for worker in self._workers:
+            self._spawn(worker)
+        logging.info(f"Starting {self.size} summary workers with {self.threads} threads each")
+
+    def _spawn(self, worker: _Worker):
+        if self._closed:
+            return
+        parent, child = self._ctx.Pipe()
+        process = self._ctx.Process(
+            target=_worker_main,
+            args=(child, self.backend, self.model_name, self.threads),
+            name=f"summary-worker-{worker.index}",
+            daemon=True
+        )
+        process.start()
+        child.close()
+        worker.process = process
+        worker.conn = parent
+        worker.generation += 1
+        worker.ready = False
+        self.loop.add_reader(parent.fileno(), self._on_message, worker)
+
+    def _on_message(self, worker: _Worker):
+        try:
+            kind, payload = worker.conn.recv()
+        except (EOFError, OSError):
+            self._on_exit(worker)
+            return
+        if kind == "ready":
+            worker.ready = True
+            worker.failures = 0
+            SUMMARY_WORKERS_READY.inc()
+            self._idle.put_nowait((worker, worker.generation))
+            return
+        if kind == "failed":
+            self.last_error = payload
+            logging.error(f"Summary worker {worker.index} could not load the model: {payload}")
+            return
+        future, worker.future = worker.future, None
+        if future is not None and not future.done():
+            if kind == "done":
+                future.set_result(payload)
+            else:
+                future.set_exception(RuntimeError(payload))
+        self._idle.put_nowait((worker, worker.generation))
+
+    def _on_exit(self, worker: _Worker):
+        self.loop.remove_reader(worker.conn.fileno())
+        worker.conn.close()
+        worker.process.join(1)
+        if worker.ready:
+            SUMMARY_WORKERS_READY.dec()
+        else:
+            worker.failures += 1
+        worker.ready = False
+        future, worker.future = worker.future, None
+        if future is not None and not future.done():
+            future.set_exception(WorkerCrashedError(
+                f"summary worker {worker.index} exited with code {worker.process.exitcode}"
+            ))
+        if self._closed:
+            return
+        if worker.failures >= WORKER_START_ATTEMPTS:
+            logging.error(f"Summary worker {worker.index} failed to start {worker.failures} times, not restarting it")
+            return
+        delay = min(WORKER_MAX_BACKOFF, 2 ** worker.failures - 1)
+        logging.warning(f"Summary worker {worker.index} exited with code {worker.process.exitcode}, restarting in {delay}s")
+        SUMMARY_WORKER_RESTARTS.inc()
+        self.loop.call_later(delay, self._spawn, worker)
+
+    @property
+    def broken(self) -> bool:
+        return all(w.failures >= WORKER_START_ATTEMPTS for w in self._workers)
+
+    def broken_error(self) -> WorkerPoolBrokenError:
+        return WorkerPoolBrokenError(f"Summary workers failed to start: {self.last_error}")
+
+    async def acquire(self) -> _Worker:
+        while True:
+            if self.broken:
+                raise self.broken_error()
+            try:
+                worker, generation = await asyncio.wait_for(self._idle.get(), 1.0)
+            except asyncio.TimeoutError:
+                continue
+            # Entries left behind by a worker that has since been restarted are stale.
+            if worker.ready and worker.generation == generation and worker.future is None:
+                return worker
+
+    def release(self, worker: _Worker):
+        self._idle.put_nowait((worker, worker.generation))
+
+    async def run(self, worker: _Worker, texts: list[str], max_length: int, min_length: int):
+        # A batch whose worker crashes is retried once on another worker.
+        for attempt in range(2):
+            future = self.loop.create_future()
+            worker.future = future
+            try:
+                worker.conn.send((texts, max_length, min_length))
+            except OSError as e:
+                worker.future = None
+                future.set_exception(WorkerCrashedError(str(e)))
+            try:
+                return await future
+            except WorkerCrashedError:
+                if attempt:
+                    raise
+            worker = await self.acquire()
+
+    def shutdown(self):
+        self._closed = True
+        for worker in self._workers:
+            if worker.conn is None or worker.conn.closed:
+                continue
+            try:
+                self.loop.remove_reader(worker.conn.fileno())
+                worker.conn.send(None)
+            except (OSError, ValueError, RuntimeError):
+                pass
+            worker.conn.close()
+        SUMMARY_WORKERS_READY.set(0)
+        for worker in self._workers:
+            if worker.process is not None:
+                worker.process.join(5)
+                if worker.process.is_alive():
+                    worker.process.terminate()
@@ -0,0 +1,36 @@
+import pytest
+from benchmarks.backends import _texts, measure, rouge_l
+
+# Mirrors `python -m benchmarks.backends`: each alternative backend must stay
+# within --min-rouge of the reference pipeline on the stub abstracts.
+MIN_ROUGE = 0.8
+BACKEND_MODULES = {
+    "quantized": ["torch", "transformers"],
+    "onnx": ["optimum.onnxruntime", "transformers"]
+}
+
+def test_rouge_l():
+    assert rouge_l("the cat sat on the mat", "the cat sat on the mat") == 1.0
+    assert rouge_l("the cat sat", "a dog ran") == 0.0
+    assert rouge_l("", "") == 1.0
+    assert rouge_l("the cat sat on the mat", "the cat on mat") == pytest.approx(0.8)
+
+@pytest.fixture(scope="module")
+def reference():
+    pytest.importorskip("torch")
+    pytest.importorskip("transformers")
+    texts = _texts(4)
+    try:
+        _, outputs = measure("pipeline", texts, 50, 25)
+    except OSError as e:
+        pytest.skip(f"summary model unavailable: {e}")
+    return texts, outputs
+
+@pytest.mark.parametrize("backend", list(BACKEND_MODULES))
+def test_backend_matches_pipeline(backend, reference):
+    for module in BACKEND_MODULES[backend]:
+        pytest.importorskip(module)
+    texts, expected = reference
+    _, outputs = measure(backend, texts, 50, 25)
+    scores = [rouge_l(ref, out) for ref, out in zip(expected, outputs)]
+    assert sum(scores) / len(scores) >= MIN_ROUGE, scores
@@ -0,0 +1,85 @@
+import pytest
+from fastapi.testclient import TestClient
+from citations import parse_name, parse_date, format_citation, format_bibliography
+
+PAPER = {
+    "paper_id": "arxiv:1706.03762",
+    "title": "Attention Is All You Need",
+    "authors": ["Ashish Vaswani", "Noam Shazeer"],
+    "publication_date": "2017-06-12",
+    "source": "arXiv",
+    "arxiv_id": "1706.03762",
+    "url": "http://arxiv.org/abs/1706.03762"
+}
+
+@pytest.mark.parametrize("name, expected", [
+    ("Ashish Vaswani", (("Ashish",), "Vaswani", "")),
+    ("Ludwig van Beethoven", (("Ludwig",), "van Beethoven", "")),
+    ("Bob Jones Jr.", (("Bob",), "Jones", "Jr.")),
+    ("Jones, Bob", (("Bob",), "Jones", "")),
+    ("Plato", ((), "Plato", ""))
+])
+def test_parse_name(name, expected):
+    assert parse_name(name) == expected
+
+def test_parse_date():
+    assert parse_date("2017-06-12T17:57:34Z") == ("2017", 6, 12)
+    assert parse_date("2020-Jun") == ("2020", 6, 0)
+    assert parse_date("") == ("", 0, 0)
+
+def test_apa_and_mla():
+    assert format_citation(PAPER, "apa") == (
+        "Vaswani, A., & Shazeer, N. (2017). Attention Is All You Need. arXiv. http://arxiv.org/abs/1706.03762"
+    )
+    assert format_citation(PAPER, "mla") == (
+        'Vaswani, Ashish, and Noam Shazeer. "Attention Is All You Need." arXiv, 12 June 2017, arxiv.org/abs/1706.03762.'
+    )
+    assert format_citation({"title": "Untitled", "source": "PubMed"}, "mla") == '"Untitled." PubMed.'
+
+def test_missing_year_is_not_rendered_from_a_year_key():
+    assert format_citation({"title": "T", "authors": ["A B"], "year": 1999}, "apa") == "B, A. (n.d.). T."
+
+def test_bibtex_suffix_goes_before_given_names():
+    entry = format_citation({**PAPER, "authors": ["Bob Jones Jr."]}, "bibtex")
+    assert "author = {Jones, Jr., Bob}," in entry
+
+def test_bibtex_keys_are_unique_within_a_bibliography():
+    keys = [entry.split("{", 1)[1].split(",", 1)[0] for entry in format_bibliography([PAPER] * 3, "bibtex")]
+    assert keys == ["vaswani2017attention", "vaswani2017attentiona", "vaswani2017attentionb"]
+
+def test_ris_record_keeps_end_tag_space():
+    entry = format_citation(PAPER, "ris")
+    assert entry.startswith("TY  - GEN\n")
+    assert entry.endswith("\nER  - ")
+
+def test_unknown_style():
+    with pytest.raises(ValueError):
+        format_citation(PAPER, "chicago")
+
+@pytest.fixture
+def client(monkeypatch):
+    import mcp_server
+
+    async def get(ids):
+        return {pid: PAPER for pid in ids if pid == PAPER["paper_id"]}
+
+    monkeypatch.setattr(mcp_server.paper_store, "get", get)
+    return TestClient(mcp_server.app)
+
+def test_citations_endpoint_resolves_paper_ids(client):
+    body = client.post("/api/citations", json={
+        "paper_ids": [PAPER["paper_id"], "doi:missing"], "papers": [PAPER], "style": "ris"
+    }).json()
+    assert body["status"] == "success"
+    assert len(body["citations"]) == 2
+    assert body["not_found"] == ["doi:missing"]
+
+def test_citations_endpoint_rejects_unknown_style(client):
+    body = client.post("/api/citations", json={"papers": [PAPER], "style": "chicago"}).json()
+    assert body["status"] == "error"
+
+def test_citations_endpoint_streams(client):
+    response = client.post("/api/citations", json={"papers": [PAPER] * 250, "style": "bibtex", "stream": True})
+    assert response.headers["content-type"].startswith("application/x-bibtex")
+    assert response.text.count("@misc{") == 250
+    assert response.text.endswith("}\n\n")